@@ -0,0 +1,284 @@
+"""
+Times and memory-profiles each pipeline stage on synthetic data at several scales.
+
+Each stage runs in a fresh process so its peak memory is not hidden by earlier stages. Results
+are appended to reports/benchmarks/pipeline.jsonl and compared with the previous run of the
+same stage and scale:
+
+    python -m benchmarks.pipeline --rows 10000 --rows 1000000
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+import multiprocessing
+from pathlib import Path
+import resource
+import subprocess
+import time
+import tracemalloc
+
+from loguru import logger
+import pandas as pd
+import pyarrow.dataset
+import typer
+
+from wrwc.config import INTERIM_DATA_DIR, REPORTS_DIR
+
+BENCHMARK_DATA_DIR = INTERIM_DATA_DIR / "benchmarks"
+RESULTS_PATH = REPORTS_DIR / "benchmarks" / "pipeline.jsonl"
+
+app = typer.Typer()
+
+
+def scale_dir(rows: int) -> Path:
+    return BENCHMARK_DATA_DIR / f"rows-{rows}"
+
+
+def prepare_raw_data(rows: int, seed: int = 0) -> Path:
+    """Generates the synthetic raw data of a scale unless it exists."""
+    from wrwc.synthetic import synthetic_data
+
+    raw_dir = scale_dir(rows) / "raw"
+    if not (raw_dir / "WoonasquatucketData.csv").exists():
+        synthetic_data(raw_dir, n_rows=rows, seed=seed)
+    return raw_dir
+
+
+def _app_sites(rows: int) -> dict[str, str]:
+    """All sites in the synthetic data, so app stages scale with the data."""
+    df_site = pd.read_csv(scale_dir(rows) / "raw" / "SiteInfo.csv")
+    return dict(zip(df_site["WW Station"], df_site["Site Descr"]))
+
+
+def _processed_path(rows: int) -> Path:
+    from wrwc.store import latest_processed_data
+
+    return latest_processed_data(scale_dir(rows) / "processed")
+
+
+def _loaded_data(rows: int) -> pd.DataFrame:
+    from streamlit_app.data_processing import load_concentration_data
+
+    return load_concentration_data(_app_sites(rows), _processed_path(rows))
+
+
+# Stages in pipeline order. Each stage has a setup, which is not measured and returns the
+# arguments of the stage, and the measured run, which returns the stage output.
+def _setup_concentration_data(rows):
+    raw_dir = scale_dir(rows) / "raw"
+    processed_dir = scale_dir(rows) / "processed"
+    processed_dir.mkdir(parents=True, exist_ok=True)
+    return raw_dir / "WoonasquatucketData.csv", processed_dir, raw_dir / "SiteInfo.csv"
+
+
+def _run_concentration_data(input_path, processed_dir, site_info_path):
+    from wrwc.dataset import concentration_data
+    from wrwc.store import latest_processed_data
+
+    concentration_data(input_path, processed_dir, site_info_path)
+    return latest_processed_data(processed_dir)
+
+
+def _setup_load_concentration_data(rows):
+    return _app_sites(rows), _processed_path(rows)
+
+
+def _run_load_concentration_data(sites, input_path):
+    from streamlit_app.data_processing import load_concentration_data
+
+    return load_concentration_data(sites, input_path)
+
+
+def _setup_dissolved_oxygen_saturation(rows):
+    from wrwc.store import read_processed_data
+
+    return (read_processed_data(_processed_path(rows)).set_index("date"),)
+
+
+def _run_dissolved_oxygen_saturation(df):
+    from streamlit_app.data_processing import calculate_dissolved_oxygen_saturation
+
+    return calculate_dissolved_oxygen_saturation(df)
+
+
+def _setup_temporal_bins(rows):
+    return (_loaded_data(rows),)
+
+
+def _run_temporal_bins(df):
+    from streamlit_app.data_processing import process_temporal_bins
+
+    return process_temporal_bins(df)
+
+
+def _setup_monthly_count_data(rows):
+    return _loaded_data(rows), _app_sites(rows)
+
+
+def _run_monthly_count_data(df, sites):
+    from streamlit_app.data_processing import process_monthly_count_data
+
+    return process_monthly_count_data(df, sites)
+
+
+def _setup_mapping_data(rows):
+    output_dir = scale_dir(rows) / "mapping"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return _processed_path(rows), output_dir, scale_dir(rows) / "raw" / "SiteInfo.csv"
+
+
+def _run_mapping_data(input_path, output_dir, site_info_path):
+    from wrwc.dataset import mapping_data
+
+    mapping_data(input_path, output_dir, site_info_path)
+    return max(output_dir.glob("site_summary_*.csv"))
+
+
+STAGES = {
+    "concentration_data": (_setup_concentration_data, _run_concentration_data),
+    "load_concentration_data": (_setup_load_concentration_data, _run_load_concentration_data),
+    "calculate_dissolved_oxygen_saturation": (
+        _setup_dissolved_oxygen_saturation,
+        _run_dissolved_oxygen_saturation,
+    ),
+    "process_temporal_bins": (_setup_temporal_bins, _run_temporal_bins),
+    "process_monthly_count_data": (_setup_monthly_count_data, _run_monthly_count_data),
+    "mapping_data": (_setup_mapping_data, _run_mapping_data),
+}
+
+
+def count_rows(output) -> int:
+    """Number of rows in a stage output: dataframes, tuples of dataframes, or written files."""
+    if isinstance(output, pd.DataFrame):
+        return len(output)
+    if isinstance(output, tuple):
+        return sum(count_rows(o) for o in output)
+    if Path(output).suffix == ".csv":
+        return len(pd.read_csv(output))
+    return pyarrow.dataset.dataset(output, partitioning="hive").count_rows()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_stage(stage: str, rows: int, trace_allocations: bool = False) -> dict:
+    """
+    Runs a stage once and measures it. Meant to run in a fresh process.
+
+    :param stage: Stage name in STAGES
+    :param rows: Scale of the synthetic data
+    :param trace_allocations: Also trace the peak of Python and numpy allocations, which slows
+        the stage down
+    :return: Dictionary of measurements
+    """
+    setup, run = STAGES[stage]
+    args = setup(rows)
+    rows_in = len(args[0]) if isinstance(args[0], pd.DataFrame) else rows
+
+    rss_before = _peak_rss_mb()
+    if trace_allocations:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = run(*args)
+    seconds = time.perf_counter() - start
+    peak_alloc = tracemalloc.get_traced_memory()[1] / 1024**2 if trace_allocations else None
+    tracemalloc.stop()
+
+    return {
+        "stage": stage,
+        "rows": rows,
+        "rows_in": rows_in,
+        "rows_out": count_rows(output),
+        "seconds": round(seconds, 4),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "rss_growth_mb": round(_peak_rss_mb() - rss_before, 1),
+        "peak_alloc_mb": None if peak_alloc is None else round(peak_alloc, 1),
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_results(results_path: Path = RESULTS_PATH) -> pd.DataFrame:
+    """Reads all stored benchmark results."""
+    if not results_path.exists():
+        return pd.DataFrame()
+    return pd.read_json(results_path, lines=True)
+
+
+def compare_results(
+    df_new: pd.DataFrame, df_old: pd.DataFrame, keys: tuple[str, ...] = ("stage", "rows", "traced")
+) -> pd.DataFrame:
+    """
+    Compares results with the latest earlier result of the same stage and scale.
+
+    Runs with traced allocations are only compared with each other since tracing slows stages.
+
+    :param keys: Columns identifying comparable results
+    """
+    if df_old.empty:
+        return df_new.assign(previous_seconds=None, ratio=None)
+    df_previous = (
+        df_old.sort_values("timestamp")
+        .groupby(list(keys))
+        .last()[["seconds", "commit"]]
+        .rename(columns={"seconds": "previous_seconds", "commit": "previous_commit"})
+    )
+    df = df_new.join(df_previous, on=list(keys))
+    return df.assign(ratio=(df["seconds"] / df["previous_seconds"]).round(2))
+
+
+@app.command()
+def main(
+    rows: list[int] = typer.Option([10_000, 100_000], help="Raw rows of each scale"),
+    stages: list[str] = typer.Option(list(STAGES), help="Stages to run"),
+    trace_allocations: bool = typer.Option(False, help="Trace peak allocations"),
+    seed: int = 0,
+    results_path: Path = RESULTS_PATH,
+):
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    commit = _git_commit()
+    df_old = read_results(results_path)
+
+    records = []
+    for n in rows:
+        prepare_raw_data(n, seed=seed)
+        for stage in stages:
+            # A fresh process per stage isolates its peak memory
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                record = pool.submit(measure_stage, stage, n, trace_allocations).result()
+            record.update(timestamp=timestamp, commit=commit, traced=trace_allocations)
+            logger.info(f"{stage} at {n} rows: {record['seconds']} s")
+            records.append(record)
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    df_compare = compare_results(pd.DataFrame(records), df_old)
+    columns = [
+        "stage",
+        "rows",
+        "rows_out",
+        "seconds",
+        "previous_seconds",
+        "ratio",
+        "rss_growth_mb",
+    ]
+    print(df_compare[columns].to_string(index=False))
+
+
+if __name__ == "__main__":
+    app()
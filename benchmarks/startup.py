@@ -0,0 +1,142 @@
+"""
+Times the first render of each app page in a fresh process, as after an app restart.
+
+The disk cache is either empty (cold), or built by an earlier render of the page (warm), as
+after a restart with a cache prepared by `python -m wrwc.pipeline run`. Results are appended to
+reports/benchmarks/startup.jsonl and compared with the previous run of the same page and cache:
+
+    python -m benchmarks.startup --pages explorer --cache warm
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import resource
+import sys
+import tempfile
+import time
+
+from loguru import logger
+import pandas as pd
+import typer
+
+from benchmarks.pipeline import _git_commit, compare_results, read_results
+from wrwc.config import PROJ_ROOT, REPORTS_DIR
+
+PAGES_DIR = PROJ_ROOT / "streamlit_app" / "pages"
+PAGES = ["explorer", "timeseries", "boxplots", "exceedances"]
+RESULTS_PATH = REPORTS_DIR / "benchmarks" / "startup.jsonl"
+
+app = typer.Typer()
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_page(page: str, timeout: float = 600) -> dict:
+    """
+    Renders a page once and measures it. Meant to run in a fresh process.
+
+    The import of Streamlit's test runner is timed separately from the render, which includes
+    importing the page and the modules it uses, loading its data and building its figures.
+
+    :param page: Page name in PAGES_DIR
+    :param timeout: Seconds the render may take
+    :return: Dictionary of measurements
+    """
+    modules_before = len(sys.modules)
+    start = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    imported = time.perf_counter()
+    at = AppTest.from_file(str(PAGES_DIR / f"{page}.py"), default_timeout=timeout).run()
+    rendered = time.perf_counter()
+    if at.exception:
+        raise RuntimeError(f"{page} failed: {at.exception[0].value}")
+
+    return {
+        "page": page,
+        "streamlit_import_seconds": round(imported - start, 4),
+        "seconds": round(rendered - imported, 4),
+        "modules": len(sys.modules) - modules_before,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _in_fresh_process(page: str, cache_dir: Path) -> tuple[dict, float]:
+    """Measures a page in a spawned process using cache_dir, with the process wall time."""
+    # Read by wrwc.config when the spawned process imports it
+    os.environ["WRWC_CACHE_DIR"] = str(cache_dir)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        record = pool.submit(measure_page, page).result()
+    return record, time.perf_counter() - start
+
+
+@app.command()
+def main(
+    pages: list[str] = typer.Option(PAGES, help="Pages to render"),
+    cache: list[str] = typer.Option(["cold", "warm"], help="Disk cache 'cold' or 'warm'"),
+    repeat: int = typer.Option(3, help="Renders of each page, the fastest is kept"),
+    results_path: Path = RESULTS_PATH,
+):
+    unknown = set(cache) - {"cold", "warm"}
+    if unknown:
+        raise typer.BadParameter(f"Unknown cache modes: {', '.join(sorted(unknown))}")
+
+    timestamp = datetime.now().isoformat(timespec="seconds")
+    commit = _git_commit()
+    df_old = read_results(results_path)
+    cache_env = os.environ.get("WRWC_CACHE_DIR")
+
+    records = []
+    try:
+        for page in pages:
+            for mode in cache:
+                runs = []
+                for _ in range(repeat):
+                    with tempfile.TemporaryDirectory() as cache_dir:
+                        if mode == "warm":
+                            _in_fresh_process(page, Path(cache_dir))
+                        record, wall_seconds = _in_fresh_process(page, Path(cache_dir))
+                    record.update(process_seconds=round(wall_seconds, 4))
+                    runs.append(record)
+                record = min(runs, key=lambda r: r["seconds"])
+                record.update(timestamp=timestamp, commit=commit, cache=mode, repeat=repeat)
+                logger.info(f"{page} with {mode} cache: {record['seconds']} s")
+                records.append(record)
+    finally:
+        if cache_env is None:
+            os.environ.pop("WRWC_CACHE_DIR", None)
+        else:
+            os.environ["WRWC_CACHE_DIR"] = cache_env
+
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    df_compare = compare_results(pd.DataFrame(records), df_old, keys=("page", "cache"))
+    columns = [
+        "page",
+        "cache",
+        "streamlit_import_seconds",
+        "seconds",
+        "previous_seconds",
+        "ratio",
+        "process_seconds",
+        "modules",
+        "peak_rss_mb",
+    ]
+    print(df_compare[columns].to_string(index=False))
+
+
+if __name__ == "__main__":
+    app()
@@ -1,28 +1,77 @@
-import pandas as pd
+import functools
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
 import numpy as np
-import geopandas as gpd
-from gsw import O2sol
+import pandas as pd
+import streamlit as st
 from collections import OrderedDict
-from wrwc.config import RAW_DATA_DIR, PROCESSED_DATA_DIR, EXTERNAL_DATA_DIR
+from loguru import logger
+import wrwc.derived
+import wrwc.query
+import wrwc.rolling
+import wrwc.schema
+import wrwc.sites
+import wrwc.spatial
+import wrwc.store
+import wrwc.thresholds
+import wrwc.trends
+from wrwc.config import (
+    RAW_DATA_DIR, PROCESSED_DATA_DIR, CACHE_DIR, CACHE_MAX_BYTES, CSO_PATH, DATA_CHECK_INTERVAL,
+    SITE_GROUP, SITE_REGISTRY_PATH, WORKERS
+)
+from wrwc.derived import BACTERIA_PARAMETERS, DERIVED_PARAMETERS, calculate_derived_parameters
+from wrwc.instrumentation import instrumented, span
+from wrwc.manifest import data_fingerprint
+from wrwc.parallel import map_site_shards
+from wrwc.query import query, read_samples, source_sql, sql_literal, use_duckdb, where_sql
+from wrwc.rolling import rolling_geometric_means
+from wrwc.sites import brackish_sites, cso_dates, flagged_sites, group_sites
+from wrwc.spatial import CSO_SEARCH_RADIUS, cso_proximity, read_cso_layer
+from wrwc.store import latest_processed_data, latest_site_summary, read_processed_data
+from wrwc.thresholds import flag_exceedances, threshold_table
+from wrwc.trends import seasonal_trends
 
 
 def reverse_dict(dictionary: OrderedDict):
     return OrderedDict([(name, code) for code, name in dictionary.items()])
 
 
-# Read in site info and coordinates
-sites = OrderedDict([('WW635', 'Whipple Field'),
-                    ('WW437', 'Greystone Pond'),
-                    ('WW226', 'Cricket Park'),
-                    ('WW508', 'Manton Ave.'),
-                    ('WW227', 'Donigian Park'),
-                    ('WW308', 'Waterplace Park')])
+# Sites of the app in upstream to downstream order, see the site registry
+sites = group_sites(SITE_GROUP)
 site_name_lookup = reverse_dict(sites)
 
+# Year bins of the temporal aggregates: end points of the intervals and their labels
+YEAR_BINS = [1990, 2003, 2007, 2011, 2015, 2019, 2022]
+YEAR_BIN_LABELS = ['<2003', '2003-2006', '2007-2010', '2011-2014', '2015-2018', '2019-2021']
+
+# Keys of the monthly cube, see process_monthly_cube
+CUBE_KEYS = ['ww_id', 'parameter', 'unit', 'year', 'month']
+
+# Keys of the monthly exceedances, see process_monthly_exceedances
+EXCEEDANCE_KEYS = ['ww_id', 'parameter', 'threshold', 'year', 'month']
+
+# Unit of Fecal Coliforms, measured in CFU/100ml before 2011
+FECAL_COLIFORM_UNIT = 'MPN/100ml'
+
+# Window of the rolling geometric means of bacteria, the 30 day duration of the EPA 2012
+# recreational water quality criteria
+GEOMETRIC_MEAN_WINDOW = pd.Timedelta(days=30)
 
-def load_map_data(sites: dict[str, str]):
-    df_site = (pd.read_csv(PROCESSED_DATA_DIR / 'site_summary_20250708.csv')
-               .query(f"ww_id in {list(sites.keys())}")
+
+@instrumented()
+def load_map_data(sites: dict[str, str], radius: float = CSO_SEARCH_RADIUS,
+                  summary_path=None):
+    import geopandas as gpd  # Only needed by the map
+
+    summary_path = summary_path or latest_site_summary(PROCESSED_DATA_DIR)
+    df_site = (pd.read_csv(summary_path)
+               .loc[lambda x: x['ww_id'].isin(sites.keys())]
                .rename(columns={'lon_dd': 'lon', 'lat_dd': 'lat'})
                )
     # convert to geo-df
@@ -33,175 +82,217 @@ def load_map_data(sites: dict[str, str]):
     )
 
     # Read CSO points
-    df_cso = gpd.read_file(
-        EXTERNAL_DATA_DIR / 'UTILITY_NBC_Sewer_Overflows_spf_-4273409046426376393.gpkg')
-    df_cso = df_cso.to_crs(gdf.crs)
+    df_cso = get_cso_layer()
+
+    # Nearest CSO and number of CSOs within the radius of each site
+    gdf = gdf.join(cso_proximity(gdf, df_cso, radius=radius))
 
-    return gdf, df_cso
+    return gdf, df_cso.to_crs(gdf.crs)
 
 
 def calculate_dissolved_oxygen_saturation(df):
-    def _fill_temperature_values(df_wide):
-        """
-        Interpolate missing temperature
-        The sites are grouped by site and month. The missing value are interpolated
-        between years at the same site and during the same month. e.g. if
-        May 2008 was missing it would use the average between May 2007 and 2009.
-        """
+    return calculate_derived_parameters(df, ['Dissolved Oxygen Saturation'])
 
-        def _interpolate_temperature(group):
-            group = group.set_index('year')
-            group['Temperature'] = group['Temperature'].interpolate(method='linear')
-            return group
 
-        # groupby site and month
-        gb_site_month = (
-            df_wide
-            .reset_index()
-            .assign(month=lambda x: x['date'].dt.month,
-                    year=lambda x: x['date'].dt.year)
-            .groupby(by=['ww_id', 'month'])
-        )
-        # Interpolate temperature
-        df_interp = (
-            gb_site_month
-            .apply(_interpolate_temperature)
-            .reset_index(drop=True)
-            .sort_values(by=['ww_id', 'date'])
-        )
-        return df_interp
+@instrumented()
+def load_concentration_data(sites: dict[str, str], input_path=None, workers=WORKERS):
+    if input_path is None:
+        input_path = latest_processed_data()
 
-    def _fill_salinity_values(df_wide):
-        """
-        Fill NA salinity values. Median salinity for brackish site and 0 for freshwater
-        """
+    # Only the partitions for the requested sites are read from a parquet store
+    wq_data = (
+        read_processed_data(input_path, sites=sites.keys())
+        .set_index('date')
+    )
 
-        m_brackish_sites = df_wide['ww_id'] == 'WW308'
-        median_salinity = df_wide.loc[m_brackish_sites, 'Salinity, (ppt)'].median()
-
-        # 1. Fill Brackish Site (WW308) NAs with the median
-        df_wide.loc[m_brackish_sites, 'Salinity, (ppt)'] = (
-            df_wide.loc[m_brackish_sites, 'Salinity, (ppt)'].fillna(median_salinity))
-
-        # 2. Fill all other NAs (for freshwater sites) with 0
-        df_wide.loc[~m_brackish_sites, 'Salinity, (ppt)'] = (
-            df_wide.loc[~m_brackish_sites, 'Salinity, (ppt)'].fillna(0.))
-
-        return df_wide
-
-    def _dissolved_oxygen_saturation(df_wide):
-        """ Calculates dissovled oxygen saturation """
-
-        # Calculate maximum dissolved oxygen at salinity, pressure, and temperature
-        N = len(df_wide)
-        df_wide['do_max'] = O2sol(
-            SA=df_wide['Salinity, (ppt)'],  # Assumes ppt is close enough to SA in g/kg
-            CT=df_wide['Temperature'],
-            p=np.repeat(0, N),  # Assume 1 atm
-            lat=np.repeat(41.8246, N),  # Providence coordinates
-            lon=np.repeat(-71.418884, N),
-        ) * (31.998 * 1e-3)  # Convert from umol/kg to mg/l
-
-        # Calculate dissolved oxygen saturation
-        df_do_saturation = (
-            df_wide
-            .assign(do_sat=df_wide['Dissolved Oxygen'] / df_wide['do_max'] * 100,
-                    sample_type='Water',
-                    depth=0.0,
-                    parameter='Dissolved Oxygen Saturation',
-                    unit='percent')
-            .drop(columns=['Salinity, (ppt)', 'Temperature', 'month', 'Dissolved Oxygen', 'do_max'])
-            .rename(columns={'do_sat': 'concentration'})
-            .dropna(subset=['concentration'])
-            .set_index('date')
-        )
-        return df_do_saturation
+    standardize_units(wq_data)
 
-    # Process dataframe for calculations
-    m = df['parameter'].isin(['Dissolved Oxygen', 'Temperature', 'Salinity, (ppt)'])
-    df_do = (
-        df
-        .loc[m, ['ww_id', 'parameter', 'concentration']]
-        .reset_index()
-        .pivot_table(
-            index=['ww_id', 'date'],
-            columns='parameter',
-            values='concentration'
-        )
-    )
+    # Calculate derived parameters, e.g. dissolved oxygen saturation
+    wq_data_with_derived = calculate_derived_parameters(wq_data, workers=workers)
 
-    # Fill in missing values
-    df_interp = _fill_temperature_values(df_do)
-    df_interp = _fill_salinity_values(df_interp)
+    return wq_data_with_derived
 
-    # Calculate dissolved oxygen saturation
-    df_do_sat = _dissolved_oxygen_saturation(df_interp)
 
-    # Append calculated values
-    df_out = pd.concat([df, df_do_sat], axis=0, ignore_index=False)
+def standardize_units(wq_data: pd.DataFrame):
+    """Sets the unit of Fecal Coliforms to FECAL_COLIFORM_UNIT in place."""
+    if (isinstance(wq_data['unit'].dtype, pd.CategoricalDtype)
+            and FECAL_COLIFORM_UNIT not in wq_data['unit'].cat.categories):
+        wq_data['unit'] = wq_data['unit'].cat.add_categories(FECAL_COLIFORM_UNIT)
+    wq_data.loc[wq_data['parameter'] == 'Fecal Coliform', 'unit'] = FECAL_COLIFORM_UNIT
 
-    return df_out
 
+@instrumented()
+def load_derived_data(sites: dict[str, str], input_path=None, workers=WORKERS):
+    """
+    Derived parameter rows of load_concentration_data, calculated from only the rows and
+    columns of their inputs. Used with queries reading the measured rows from the files.
+    """
+    if input_path is None:
+        input_path = latest_processed_data()
 
-def load_concentration_data(sites: dict[str, str]):
-    wq_data = (
-        pd.read_csv(PROCESSED_DATA_DIR / "wrwc-processed-data-20250501.csv", parse_dates=['date'])
-        .query(f"ww_id in {list(sites.keys())}")
+    inputs = sorted({p for d in DERIVED_PARAMETERS.values() for p in d.inputs})
+    wq_inputs = (
+        read_samples(input_path, sites=sites.keys(), parameters=inputs,
+                     columns=['ww_id', 'parameter', 'unit', 'date', 'concentration'])
         .set_index('date')
     )
-
-    # Standardize unit for Fecal Coliforms
-    wq_data.loc[wq_data['parameter'] == 'Fecal Coliform', 'unit'] = 'MPN/100ml'
-
-    # Calculate dissolved oxygen concentration
-    wq_data_with_do = calculate_dissolved_oxygen_saturation(wq_data)
-
-    return wq_data_with_do
+    standardize_units(wq_inputs)
+    return calculate_derived_parameters(wq_inputs, workers=workers).iloc[len(wq_inputs):]
+
+
+@instrumented()
+def load_bacteria_data(sites: dict[str, str], input_path=None):
+    """
+    Bacteria rows of load_concentration_data, read without the other parameters. Used with
+    queries reading the measured rows from the files.
+    """
+    if input_path is None:
+        input_path = latest_processed_data()
+
+    wq_bacteria = (
+        read_samples(input_path, sites=sites.keys(), parameters=BACTERIA_PARAMETERS,
+                     columns=['ww_id', 'parameter', 'unit', 'date', 'concentration'])
+        .set_index('date')
+    )
+    standardize_units(wq_bacteria)
+    return wq_bacteria
 
 
-def process_monthly_count_data(data: pd.DataFrame, sites: dict[str, str]):
-    counts = (
+def _monthly_sample_counts(data: pd.DataFrame):
+    return (
         data
-        .groupby(['parameter', 'ww_id'])
+        .groupby(['parameter', 'ww_id'], observed=True)
         .resample("MS", include_groups=False)
         .size()
+    )
+
+
+@instrumented()
+def process_monthly_count_data(data: pd.DataFrame, sites: dict[str, str], workers=WORKERS):
+    """Number of samples of each parameter and site by month, see map_site_shards for workers."""
+    counts = (
+        pd.concat(map_site_shards(
+            _monthly_sample_counts, data[['parameter', 'ww_id']], workers=workers
+        ))
         .unstack(fill_value=0)
         .reindex(sites.keys(), level=1)
     )
     return counts
 
 
-def process_temporal_bins(data: pd.DataFrame):
-    bins = [1990, 2003, 2007, 2011, 2015, 2019, 2022]  # End points of intervals
-    labels = ['<2003', '2003-2006', '2007-2010', '2011-2014', '2015-2018', '2019-2021']
+def _monthly_cube(data: pd.DataFrame):
+    """Concentration measures of each site, parameter, unit, year and month."""
     data = data.reset_index()
-    df_temporal = (
+    return (
         data
         .assign(
-            pre_2015=lambda x: ['pre' if year < 2015 else 'post' for year in x['date'].dt.year],
-            year_range=pd.cut(data['date'].dt.year, bins=bins, labels=labels,
-                              include_lowest=True, right=False),
             year=data['date'].dt.year,
-            month=data['date'].dt.month
+            month=data['date'].dt.month,
+            sumsq=data['concentration'] ** 2
         )
+        .groupby(by=CUBE_KEYS, observed=True)
+        .agg(count=('concentration', 'count'), sum=('concentration', 'sum'),
+             sumsq=('sumsq', 'sum'), min=('concentration', 'min'), max=('concentration', 'max'))
     )
 
-    # Aggregate measures across year ranges by month
-    df_mean_year_range = (
-        df_temporal
-        .groupby(by=['ww_id', 'parameter', 'unit', 'year_range', 'month'], observed=True)[
-            'concentration']
-        .agg(['mean', 'min', 'max', 'count'])
-        .query("ww_id not in ['WW508']")
-        .reset_index()
+
+@instrumented()
+def process_monthly_cube(data: pd.DataFrame, workers=WORKERS):
+    """
+    Aggregates concentrations by site, parameter, unit, year and month into their count, sum,
+    sum of squares, min and max. Any binning of the years is rolled up from the cube without
+    the rows, see rollup_cube. See map_site_shards for workers.
+    """
+    shards = map_site_shards(
+        _monthly_cube, data[['ww_id', 'parameter', 'unit', 'concentration']], workers=workers
+    )
+    # Cubes are sorted by their keys, shards hold whole sites
+    return shards[0] if len(shards) == 1 else pd.concat(shards).sort_index()
+
+
+def rollup_cube(cube: pd.DataFrame, bins: pd.Series, name: str):
+    """
+    Rolls the monthly cube up to measures by site, parameter, unit, bin and month.
+
+    :param cube: Monthly cube, see process_monthly_cube
+    :param bins: Bin of each row of the cube, rows without a bin are left out
+    :param name: Name of the bin column
+    :return: Mean, min, max, count and standard deviation of the concentrations
+    """
+    df = (
+        cube
+        .assign(**{name: bins})
+        .groupby(by=['ww_id', 'parameter', 'unit', name, 'month'], observed=True)
+        .agg(count=('count', 'sum'), sum=('sum', 'sum'), sumsq=('sumsq', 'sum'),
+             min=('min', 'min'), max=('max', 'max'))
     )
+    # Sample variance from the sums, clipped at 0 against round-off
+    variance = (df['sumsq'] - df['sum'] ** 2 / df['count']) / (df['count'] - 1)
+    return pd.DataFrame({
+        'mean': df['sum'] / df['count'],
+        'min': df['min'],
+        'max': df['max'],
+        'count': df['count'],
+        'std': np.sqrt(variance.clip(lower=0)),
+    })
+
+
+def year_bins(cube: pd.DataFrame, edges=YEAR_BINS, labels=YEAR_BIN_LABELS):
+    """
+    Bins the rows of the monthly cube by year, e.g. by ~4 years, decades or chosen ranges.
+
+    :param cube: Monthly cube, see process_monthly_cube
+    :param edges: First year of each bin and the year after the last bin, in order
+    :param labels: Bin labels, the first and last year of each bin if None
+    :return: Ordered categorical bin of each row, missing outside the bins
+    """
+    if labels is None:
+        labels = [str(start) if stop - start == 1 else f'{start}-{stop - 1}'
+                  for start, stop in zip(edges, edges[1:])]
+    bins = pd.cut(cube.index.get_level_values('year'), bins=edges, labels=labels,
+                  include_lowest=True, right=False)
+    return pd.Series(bins, index=cube.index)
+
+
+def intervention_bins(cube: pd.DataFrame, dates: dict, labels=('pre', 'post')):
+    """
+    Bins the rows of the monthly cube before and after an intervention at each site, e.g. the
+    CSO improvements. The month of the intervention is binned after it.
+
+    :param cube: Monthly cube, see process_monthly_cube
+    :param dates: Intervention date keyed by ww_id
+    :param labels: Labels of the months before and after the intervention
+    :return: Bin of each row, missing for sites without a date
+    """
+    dates = pd.Series(dates, dtype='datetime64[ns]')
+    start = (dates.dt.year * 12 + dates.dt.month - 1).reindex(
+        cube.index.get_level_values('ww_id').astype(str)).to_numpy()
+    months = (cube.index.get_level_values('year') * 12
+              + cube.index.get_level_values('month') - 1).to_numpy()
+    bins = np.where(months < start, labels[0], labels[1]).astype(object)
+    bins[np.isnan(start)] = None
+    return pd.Series(bins, index=cube.index)
+
+
+def temporal_bins(cube: pd.DataFrame, edges=YEAR_BINS, labels=YEAR_BIN_LABELS,
+                  year_bin_exclude=None, intervention_dates=None):
+    """
+    Rolls the monthly cube up to monthly measures across year bins, ~4 year bins by default,
+    and before/after the CSO improvements of each site. Sites are selected with the year_bins
+    flag and the cso_study sites and dates of the site registry unless given.
+    """
+    if year_bin_exclude is None:
+        year_bin_exclude = flagged_sites('year_bins', value=False)
+    if intervention_dates is None:
+        intervention_dates = cso_dates()
+
+    cube_year_bins = cube[~cube.index.get_level_values('ww_id').isin(year_bin_exclude)]
+    df_mean_year_range = rollup_cube(
+        cube_year_bins, year_bins(cube_year_bins, edges, labels), 'year_range'
+    ).reset_index()
 
     df_mean_cso = (
-        df_temporal
-        .groupby(by=['ww_id', 'parameter', 'unit', 'pre_2015', 'month'], observed=True)[
-            'concentration']
-        .agg(['mean', 'min', 'max', 'count'])
-        .query("ww_id in ['WW227', 'WW308', 'WW437']")
+        rollup_cube(cube, intervention_bins(cube, intervention_dates), 'pre_2015')
         .reset_index()
         .sort_values(
             by=['ww_id', 'parameter', 'unit', 'pre_2015', 'month'],
@@ -212,13 +303,697 @@ def process_temporal_bins(data: pd.DataFrame):
     return df_mean_year_range, df_mean_cso
 
 
-def get_ordered_sites(df):
-    """Defines upstream to downstream site order."""
-    site_order = ["Whipple Field", "Greystone Pond", "Cricket Park",
-                  "Manton Ave.", "Donigian Park", "Waterplace Park"]
-    sort_key = {site: i for i, site in enumerate(site_order)}
+@instrumented()
+def process_temporal_bins(data: pd.DataFrame, year_bin_exclude=None, intervention_dates=None,
+                          workers=WORKERS):
+    """
+    Aggregates concentrations by month across ~4 year bins and before/after the CSO
+    improvements, see temporal_bins. See map_site_shards for workers.
+    """
+    cube = process_monthly_cube(data, workers=workers)
+    return temporal_bins(cube, year_bin_exclude=year_bin_exclude,
+                         intervention_dates=intervention_dates)
+
+
+@instrumented()
+def process_trends(cube: pd.DataFrame):
+    """
+    Seasonal Mann-Kendall test and Sen's slope of the monthly means of each site, parameter
+    and unit, with months as seasons and slopes per year, see seasonal_trends. Values in
+    different units are separate series.
+    """
+    df = cube.assign(value=cube['sum'] / cube['count']).reset_index()
+    return seasonal_trends(df, ['ww_id', 'parameter', 'unit']).reset_index()
+
+
+def _monthly_exceedances(data: pd.DataFrame):
+    """Samples compared with each threshold and samples exceeding it by site, year and month."""
+    df = flag_exceedances(data.reset_index())
+    return (
+        df
+        .assign(year=df['date'].dt.year, month=df['date'].dt.month)
+        .groupby(by=EXCEEDANCE_KEYS, observed=True)['exceeds']
+        .agg(samples='size', exceedances='sum')
+    )
+
+
+@instrumented()
+def process_monthly_exceedances(data: pd.DataFrame, workers=WORKERS):
+    """
+    Flags every sample against the thresholds of its parameter, see flag_exceedances, and counts
+    the samples and exceedances of each threshold by site, year and month. Exceedance rates by
+    any period are rolled up from the counts, see exceedance_rates. See map_site_shards for
+    workers.
+    """
+    shards = map_site_shards(
+        _monthly_exceedances, data[['ww_id', 'parameter', 'unit', 'concentration']],
+        workers=workers
+    )
+    return shards[0] if len(shards) == 1 else pd.concat(shards).sort_index()
+
+
+def exceedance_rates(monthly: pd.DataFrame, by: list[str], bins: pd.Series | None = None):
+    """
+    Rolls monthly exceedances up to the rate of samples exceeding each threshold.
+
+    :param monthly: Monthly exceedances, see process_monthly_exceedances
+    :param by: Keys besides site, parameter and threshold, e.g. month or year_range
+    :param bins: Bin of each row of monthly when by includes year_range, see year_bins
+    :return: Samples, exceedances and rate with the threshold fields, see threshold_table
+    """
+    if bins is not None:
+        monthly = monthly.assign(year_range=bins)
+    keys = ['ww_id', 'parameter', 'threshold', *by]
+    df = (
+        monthly
+        .groupby(by=keys, observed=True)[['samples', 'exceedances']]
+        .sum()
+        .assign(rate=lambda x: x['exceedances'] / x['samples'])
+        .reset_index()
+    )
+    df_thresholds = threshold_table()[['value', 'direction', 'unit', 'name', 'label', 'color']]
+    return df.join(df_thresholds, on='threshold')
+
+
+def rollup_exceedances(monthly: pd.DataFrame):
+    """
+    Exceedance rates of each site and threshold overall, by month and by ~4 year bins, as
+    shown in the plots and the exceedance summary.
+    """
+    return (
+        exceedance_rates(monthly, []),
+        exceedance_rates(monthly, ['month']),
+        exceedance_rates(monthly, ['year_range'], year_bins(monthly)),
+    )
+
+
+def single_sample_limits(df: pd.DataFrame):
+    """
+    Single sample threshold of each sample in its unit, see the threshold registry, NaN for
+    samples without one.
+    """
+    df_thresholds = threshold_table()
+    df_thresholds = df_thresholds[
+        (df_thresholds['name'] == 'single sample') & (df_thresholds['direction'] == 'max')
+        & df_thresholds['site_class'].isna()
+    ]
+    limits = df_thresholds.set_index(['parameter', 'unit'])['value']
+    keys = pd.MultiIndex.from_arrays([df['parameter'].astype(str), df['unit'].astype(str)])
+    return pd.Series(limits.reindex(keys).to_numpy(), index=df.index)
+
+
+def _rolling_geometric_means(data: pd.DataFrame, window=GEOMETRIC_MEAN_WINDOW):
+    """Rolling geometric means and single sample exceedance rates of each site and bacteria."""
+    df = data.reset_index()
+    return rolling_geometric_means(df, ['ww_id', 'parameter', 'unit'], window,
+                                   limits=single_sample_limits(df))
+
+
+@instrumented()
+def process_rolling_geometric_means(data: pd.DataFrame, window=GEOMETRIC_MEAN_WINDOW,
+                                    workers=WORKERS):
+    """
+    Geometric means of the bacteria samples of each site in the window up to each sample date,
+    and the rate of those samples exceeding the single sample threshold, see
+    rolling_geometric_means. The windows of all sites and parameters are computed together.
+    See map_site_shards for workers.
+    """
+    data = data[data['parameter'].isin(BACTERIA_PARAMETERS)]
+    shards = map_site_shards(
+        _rolling_geometric_means, data[['ww_id', 'parameter', 'unit', 'concentration']],
+        window=window, workers=workers
+    )
+    return shards[0] if len(shards) == 1 else (
+        pd.concat(shards)
+        .sort_values(['ww_id', 'parameter', 'unit', 'date'], ignore_index=True)
+    )
+
+
+def _box_statistics(data: pd.DataFrame):
+    """Box statistics and outliers of each site, parameter and month."""
+    keys = ['ww_id', 'parameter', 'month']
+    df = (
+        data
+        .reset_index()
+        .assign(month=lambda x: x['date'].dt.month)
+        .dropna(subset=['concentration'])
+    )
+    grouped = df.groupby(keys, observed=True)['concentration']
+    df_stats = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    df_stats.columns = ['q1', 'median', 'q3']
+
+    # Whiskers reach the most extreme values within 1.5 IQR of the quartiles, as in plotly
+    iqr = df_stats['q3'] - df_stats['q1']
+    bounds = pd.DataFrame({'low': df_stats['q1'] - 1.5 * iqr, 'high': df_stats['q3'] + 1.5 * iqr})
+    df = df.join(bounds, on=keys)
+    m_inside = df['concentration'].between(df['low'], df['high'])
+    df_stats = df_stats.join(
+        df[m_inside].groupby(keys, observed=True)['concentration']
+        .agg(lowerfence='min', upperfence='max')
+    ).assign(count=grouped.size())
+
+    # Units of each site and parameter in order of appearance, as shown in the axis title
+    units = (
+        data
+        .groupby(['ww_id', 'parameter'], observed=True)['unit']
+        .agg(lambda x: ', '.join(map(str, x.unique())))
+    )
+    df_stats = df_stats.join(units, on=['ww_id', 'parameter'])
+
+    df_outliers = df.loc[~m_inside, ['ww_id', 'parameter', 'month', 'date', 'concentration']]
+    return df_stats, df_outliers
+
 
-    sites_in_data = [sites[s] for s in df['ww_id'].unique()]
-    ordered_sites = sorted(sites_in_data, key=lambda site: sort_key.get(site, float('inf')))
+@instrumented()
+def process_box_statistics(data: pd.DataFrame, workers=WORKERS):
+    """
+    Summarizes concentrations for boxplots by site, parameter and month: quartiles (q1, median,
+    q3), whiskers (lowerfence, upperfence), count and unit, and the outlier samples beyond the
+    whiskers. See map_site_shards for workers.
+    """
+    shards = map_site_shards(
+        _box_statistics, data[['ww_id', 'parameter', 'unit', 'concentration']], workers=workers
+    )
+    df_stats = pd.concat([stats for stats, _ in shards]).sort_index().reset_index()
+    df_outliers = pd.concat([outliers for _, outliers in shards], ignore_index=True)
+    return df_stats, df_outliers
+
+
+def _samples_sql(sites: dict[str, str], input_path):
+    """Query of the measured rows of the sites as loaded, and the rows of the derived table."""
+    return f"""
+        SELECT ww_id, parameter,
+            CASE WHEN parameter = 'Fecal Coliform' THEN {sql_literal(FECAL_COLIFORM_UNIT)}
+                ELSE unit END AS unit,
+            date, concentration
+        FROM {source_sql(input_path)}
+        WHERE {where_sql(sites.keys())}
+        UNION ALL
+        SELECT ww_id::VARCHAR, parameter::VARCHAR, unit::VARCHAR, date::TIMESTAMP, concentration
+        FROM derived
+    """
+
+
+@instrumented()
+def query_monthly_cube(sites: dict[str, str], input_path, derived: pd.DataFrame):
+    """
+    process_monthly_cube of the loaded data, aggregated by DuckDB from the processed data and
+    the derived rows, see load_derived_data.
+    """
+    df = query(f"""
+        SELECT ww_id, parameter, unit, year(date) AS year, month(date) AS month,
+            count(concentration) AS count, coalesce(sum(concentration), 0) AS sum,
+            coalesce(sum(concentration * concentration), 0) AS sumsq,
+            min(concentration) AS min, max(concentration) AS max
+        FROM ({_samples_sql(sites, input_path)})
+        WHERE ww_id IS NOT NULL AND parameter IS NOT NULL AND unit IS NOT NULL
+            AND date IS NOT NULL
+        GROUP BY ALL
+    """, tables={'derived': derived.reset_index()})
+
+    return (
+        df
+        .astype({'ww_id': 'category', 'year': 'int32', 'month': 'int32'})
+        .set_index(CUBE_KEYS)
+        .sort_index()
+    )
+
+
+@instrumented()
+def query_monthly_exceedances(sites: dict[str, str], input_path, derived: pd.DataFrame):
+    """
+    process_monthly_exceedances of the loaded data, counted by DuckDB from the processed data
+    and the derived rows, see load_derived_data.
+    """
+    brackish = ', '.join(map(sql_literal, brackish_sites())) or 'NULL'
+    df = query(f"""
+        SELECT s.ww_id, s.parameter, t.threshold, year(s.date) AS year, month(s.date) AS month,
+            count(*) AS samples,
+            count_if(CASE WHEN t.direction = 'max' THEN s.concentration > t.value
+                ELSE s.concentration < t.value END) AS exceedances
+        FROM ({_samples_sql(sites, input_path)}) AS s
+        JOIN thresholds AS t ON s.parameter = t.parameter AND s.unit = t.unit
+        WHERE s.concentration IS NOT NULL AND s.date IS NOT NULL AND (
+            t.site_class IS NULL OR t.site_class =
+                CASE WHEN s.ww_id IN ({brackish}) THEN 'brackish' ELSE 'fresh' END
+        )
+        GROUP BY ALL
+    """, tables={'derived': derived.reset_index(), 'thresholds': threshold_table().reset_index()})
 
-    return ordered_sites
+    return (
+        df
+        .astype({'ww_id': 'category', 'year': 'int32', 'month': 'int32', 'samples': 'int64',
+                 'exceedances': 'int64'})
+        .set_index(EXCEEDANCE_KEYS)
+        .sort_index()
+    )
+
+
+@instrumented()
+def query_monthly_counts(sites: dict[str, str], input_path, derived: pd.DataFrame):
+    """
+    process_monthly_count_data of the loaded data, counted by DuckDB from the processed data and
+    the derived rows, see load_derived_data.
+    """
+    df = query(f"""
+        SELECT parameter, ww_id, date_trunc('month', date) AS date, count(*) AS count
+        FROM ({_samples_sql(sites, input_path)})
+        WHERE parameter IS NOT NULL AND ww_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY ALL
+    """, tables={'derived': derived.reset_index()})
+
+    # Every month between the first and last sample of each site and parameter, as resampled
+    ordinal = df['date'].dt.year * 12 + df['date'].dt.month - 1
+    spans = ordinal.groupby([df['parameter'], df['ww_id']]).agg(['min', 'max'])
+    first = spans['min'].min()
+    covered = np.zeros(spans['max'].max() - first + 2, dtype=int)
+    np.add.at(covered, spans['min'] - first, 1)
+    np.add.at(covered, spans['max'] - first + 1, -1)
+    months = first + np.flatnonzero(covered.cumsum()[:-1])
+    months = pd.to_datetime({'year': months // 12, 'month': months % 12 + 1, 'day': 1})
+    counts = (
+        df
+        .set_index(['parameter', 'ww_id', 'date'])['count']
+        .unstack(fill_value=0)
+        .reindex(columns=pd.DatetimeIndex(months, name='date'), fill_value=0)
+        .sort_index()
+        .reindex(sites.keys(), level=1)
+    )
+    return counts
+
+
+def query_samples(input_path, derived: pd.DataFrame, ww_id, parameter):
+    """Rows of a site and parameter as loaded with a month column, read by DuckDB if used."""
+    if parameter in DERIVED_PARAMETERS:
+        df = derived[(derived['ww_id'] == ww_id) & (derived['parameter'] == parameter)]
+    else:
+        df = read_samples(input_path, sites=[ww_id], parameters=[parameter]).set_index('date')
+        standardize_units(df)
+    return df.reset_index().assign(month=lambda x: x['date'].dt.month)
+
+
+def get_ordered_sites(ww_ids):
+    """Names of the site codes in the data in upstream to downstream order."""
+    river_order = {code: i for i, code in enumerate(sites)}
+    ordered_codes = sorted(ww_ids, key=lambda code: river_order.get(code, float('inf')))
+
+    return [sites[code] for code in ordered_codes]
+
+
+def _code_version():
+    """Hash of the source code that produces the cached data."""
+    h = hashlib.sha256()
+    for module in [sys.modules[__name__], wrwc.derived, wrwc.query, wrwc.schema, wrwc.sites,
+                   wrwc.rolling, wrwc.spatial, wrwc.store, wrwc.thresholds, wrwc.trends]:
+        h.update(Path(module.__file__).read_bytes())
+    return h.hexdigest()
+
+
+CODE_VERSION = _code_version()
+
+
+def cache_key(*parts):
+    """Content address of a cached product."""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def evict_cache(max_bytes: int = CACHE_MAX_BYTES):
+    """Deletes the least recently used cache files until the cache fits in max_bytes."""
+    files = []
+    for path in CACHE_DIR.glob('*.pkl'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:  # Evicted by another process
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        logger.debug(f"Evicted {path.name} from cache")
+
+
+def cached(product: str, key: str, compute):
+    """
+    Returns a product from the on-disk cache, computing and storing it on a miss.
+
+    The cache is shared by all processes using CACHE_DIR. Files are written atomically and
+    their modification time is updated on every hit for least recently used eviction. Files
+    that fail to load, e.g. pickled by other library versions, are deleted and recomputed.
+    """
+    path = CACHE_DIR / f"{product}-{key}.pkl"
+    with span(f'cached {product}') as s:
+        try:
+            with open(path, 'rb') as f:
+                obj = pickle.load(f)
+            path.touch()
+            logger.debug(f"Loaded {product} from cache")
+            s.note = 'hit'
+            return obj
+        except FileNotFoundError:
+            s.note = 'miss'
+        except Exception as e:  # noqa: BLE001 - unpickling can raise almost any exception
+            logger.warning(f"Deleting unreadable cache file {path.name}: {e!r}")
+            path.unlink(missing_ok=True)
+            s.note = 'miss'
+
+        obj = compute()
+
+        # Unique per writer, so threads and processes filling the same product don't collide
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, prefix=f'{path.stem}.', suffix='.tmp',
+                                         delete=False) as f:
+            try:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+        logger.debug(f"Stored {product} in cache")
+        evict_cache()
+
+        return obj
+
+
+@functools.lru_cache(maxsize=32)
+def _file_fingerprint(path, mtime_ns, size):
+    """Content hash of a file, memoized while the file is unmodified."""
+    return data_fingerprint(path)
+
+
+def _path_fingerprint(path):
+    """Fingerprint of a file or parquet store, see data_fingerprint."""
+    path = Path(path)
+    if path.is_dir():
+        return data_fingerprint(path)
+    stat = path.stat()
+    return _file_fingerprint(path, stat.st_mtime_ns, stat.st_size)
+
+
+def _data_key(sites: dict[str, str], input_path):
+    """Cache key of data loaded for a set of sites from processed data."""
+    return cache_key(
+        _path_fingerprint(input_path),
+        list(sites),
+        _path_fingerprint(SITE_REGISTRY_PATH),
+        CODE_VERSION
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _load_cso_layer(key, cso_path):
+    gdf_cso = cached('cso_layer', key, functools.partial(read_cso_layer, cso_path))
+    gdf_cso.sindex  # Build the spatial index once per process
+    return gdf_cso
+
+
+def get_cso_layer(cso_path=CSO_PATH):
+    """CSO outfalls projected for distance calculations with their spatial index built."""
+    return _load_cso_layer(cache_key(_path_fingerprint(cso_path), CODE_VERSION), cso_path)
+
+
+def get_concentration_data(sites: dict[str, str], input_path=None):
+    """Cached load_concentration_data."""
+    input_path = input_path or latest_processed_data()
+    return cached('concentration', _data_key(sites, input_path),
+                  lambda: load_concentration_data(sites, input_path))
+
+
+def get_derived_data(sites: dict[str, str], input_path=None):
+    """Cached load_derived_data."""
+    input_path = input_path or latest_processed_data()
+    return cached('derived', _data_key(sites, input_path),
+                  lambda: load_derived_data(sites, input_path))
+
+
+def get_monthly_cube(sites: dict[str, str], input_path=None):
+    """
+    Cached process_monthly_cube of the loaded data, queried from the processed data without
+    loading it when DuckDB is used.
+    """
+    input_path = input_path or latest_processed_data()
+    return cached('monthly_cube', _data_key(sites, input_path), lambda: (
+        query_monthly_cube(sites, input_path, get_derived_data(sites, input_path))
+        if use_duckdb() else
+        process_monthly_cube(get_concentration_data(sites, input_path))
+    ))
+
+
+def get_monthly_exceedances(sites: dict[str, str], input_path=None):
+    """
+    Cached process_monthly_exceedances of the loaded data, queried from the processed data
+    without loading it when DuckDB is used.
+    """
+    input_path = input_path or latest_processed_data()
+    return cached('monthly_exceedances', _data_key(sites, input_path), lambda: (
+        query_monthly_exceedances(sites, input_path, get_derived_data(sites, input_path))
+        if use_duckdb() else
+        process_monthly_exceedances(get_concentration_data(sites, input_path))
+    ))
+
+
+def get_trends(sites: dict[str, str], input_path=None):
+    """Cached process_trends of the cached monthly cube."""
+    input_path = input_path or latest_processed_data()
+    return cached('trends', _data_key(sites, input_path),
+                  lambda: process_trends(get_monthly_cube(sites, input_path)))
+
+
+def get_rolling_geometric_means(sites: dict[str, str], input_path=None):
+    """
+    Cached process_rolling_geometric_means of the loaded data, computed from only the bacteria
+    rows of the processed data when DuckDB is used.
+    """
+    input_path = input_path or latest_processed_data()
+    return cached('rolling_geometric_means', _data_key(sites, input_path),
+                  lambda: process_rolling_geometric_means(
+                      load_bacteria_data(sites, input_path) if use_duckdb() else
+                      get_concentration_data(sites, input_path)
+                  ))
+
+
+def get_temporal_bins(sites: dict[str, str], input_path=None):
+    """process_temporal_bins of the loaded data, rolled up from the cached monthly cube."""
+    return temporal_bins(get_monthly_cube(sites, input_path))
+
+
+def get_monthly_count_data(sites: dict[str, str], input_path=None):
+    """
+    Cached process_monthly_count_data of the loaded data, queried from the processed data
+    without loading it when DuckDB is used.
+    """
+    input_path = input_path or latest_processed_data()
+    return cached('monthly_counts', _data_key(sites, input_path), lambda: (
+        query_monthly_counts(sites, input_path, get_derived_data(sites, input_path))
+        if use_duckdb() else
+        process_monthly_count_data(get_concentration_data(sites, input_path), sites)
+    ))
+
+
+def get_box_statistics(sites: dict[str, str], input_path=None):
+    """Cached process_box_statistics of the loaded data."""
+    input_path = input_path or latest_processed_data()
+    return cached('box_statistics', _data_key(sites, input_path),
+                  lambda: process_box_statistics(get_concentration_data(sites, input_path)))
+
+
+class SiteParameterIndex:
+    """
+    Lookup of the rows and parameters of each site.
+
+    The frame is sorted by site and parameter once, keeping the original row order within each
+    selection, so the rows of a site and parameter are a contiguous slice.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.sort_values(['ww_id', 'parameter'], kind='stable', ignore_index=True)
+
+        sizes = (
+            self.df
+            .groupby(['ww_id', 'parameter'], observed=True, sort=False, dropna=False)
+            .size()
+        )
+        stops = sizes.cumsum()
+        self._slices = {}
+        parameters = {}
+        for (ww_id, parameter), size, stop in zip(sizes.index, sizes, stops):
+            if pd.isna(ww_id) or pd.isna(parameter):
+                continue
+            self._slices[ww_id, parameter] = slice(stop - size, stop)
+            parameters.setdefault(ww_id, []).append(parameter)
+        self._parameters = {ww_id: sorted(p) for ww_id, p in parameters.items()}
+
+    @property
+    def sites(self):
+        """Site codes in the data."""
+        return list(self._parameters)
+
+    def parameters(self, ww_id):
+        """Sorted parameters measured at a site."""
+        return self._parameters.get(ww_id, [])
+
+    def select(self, ww_id, parameter):
+        """Rows of a site and parameter, empty if there are none."""
+        return self.df.iloc[self._slices.get((ww_id, parameter), slice(0, 0))]
+
+
+class DataStore:
+    """
+    Read-only concentration data shared by all pages and sessions of an app process.
+
+    Products are built on first use and the same objects are handed to every caller, so they
+    must not be modified in place.
+    """
+
+    def __init__(self, sites: dict[str, str], input_path, version=None):
+        self.sites = sites
+        self.input_path = input_path
+        self.version = version  # Identifies the data, e.g. in figure cache keys
+        self._lock = threading.RLock()
+        self._products = {}
+        self.samples = functools.lru_cache(maxsize=64)(self._samples)
+
+    def _get(self, product, build):
+        with self._lock:
+            if product not in self._products:
+                with span(f'store {product}'):
+                    self._products[product] = build()
+            return self._products[product]
+
+    @property
+    def data(self):
+        """Concentration data indexed by date."""
+        return self._get('data', lambda: get_concentration_data(self.sites, self.input_path))
+
+    @property
+    def sample_index(self):
+        """Concentration data with date and month columns, indexed by site and parameter."""
+        return self._get('sample_index', lambda: SiteParameterIndex(
+            self.data
+            .reset_index()
+            .assign(month=lambda x: x['date'].dt.month)
+        ))
+
+    @property
+    def derived(self):
+        """Derived parameter rows, see load_derived_data."""
+        return self._get('derived', lambda: get_derived_data(self.sites, self.input_path))
+
+    def _samples(self, ww_id, parameter):
+        """
+        Rows of a site and parameter with date and month columns. Queried from the processed
+        data when DuckDB is used, so the data is not loaded. The last 64 selections are kept.
+        """
+        if not use_duckdb():
+            return self.sample_index.select(ww_id, parameter)
+        return query_samples(self.input_path, self.derived, ww_id, parameter)
+
+    @property
+    def monthly_cube(self):
+        """Monthly cube of concentration measures, see process_monthly_cube."""
+        return self._get('monthly_cube',
+                         lambda: get_monthly_cube(self.sites, self.input_path))
+
+    @property
+    def cube_index(self):
+        """Monthly cube with its keys as columns, indexed by site and parameter."""
+        return self._get('cube_index',
+                         lambda: SiteParameterIndex(self.monthly_cube.reset_index()))
+
+    @property
+    def exceedance_rates(self):
+        """Exceedance rates overall, by month and by ~4 year bins, see rollup_exceedances."""
+        return self._get('exceedance_rates', lambda: rollup_exceedances(
+            get_monthly_exceedances(self.sites, self.input_path)
+        ))
+
+    @property
+    def exceedance_index(self):
+        """Overall exceedance rates indexed by site and parameter."""
+        return self._get('exceedance_index',
+                         lambda: SiteParameterIndex(self.exceedance_rates[0]))
+
+    @property
+    def trends(self):
+        """Seasonal trends of each site and parameter, see process_trends."""
+        return self._get('trends', lambda: get_trends(self.sites, self.input_path))
+
+    @property
+    def rolling_geometric_means(self):
+        """Rolling geometric means of bacteria indexed by site and parameter."""
+        return self._get('rolling_geometric_means', lambda: SiteParameterIndex(
+            get_rolling_geometric_means(self.sites, self.input_path)
+        ))
+
+    @property
+    def temporal_bins(self):
+        """~4 year bins and pre/post CSO bins, see process_temporal_bins."""
+        return self._get('temporal_bins',
+                         lambda: temporal_bins(self.monthly_cube))
+
+    @property
+    def temporal_bin_indexes(self):
+        """~4 year bins and pre/post CSO bins indexed by site and parameter."""
+        return self._get('temporal_bin_indexes',
+                         lambda: tuple(SiteParameterIndex(df) for df in self.temporal_bins))
+
+    @property
+    def box_statistics(self):
+        """Monthly box statistics and outliers indexed by site and parameter."""
+        return self._get('box_statistics', lambda: tuple(
+            SiteParameterIndex(df) for df in get_box_statistics(self.sites, self.input_path)
+        ))
+
+    @property
+    def map_data(self):
+        """Site locations with CSO proximity and CSO locations, see load_map_data."""
+        return self._get('map_data', lambda: load_map_data(self.sites))
+
+    @property
+    def monthly_counts(self):
+        """Monthly sample counts, see process_monthly_count_data."""
+        return self._get('monthly_counts',
+                         lambda: get_monthly_count_data(self.sites, self.input_path))
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_data_store(key, sites: dict[str, str], input_path):
+    return DataStore(sites, input_path, version=key)
+
+
+# Resolved input path and data key by sites and requested input path, with the time resolved
+_resolved_data = {}
+_resolved_data_lock = threading.Lock()
+
+
+def _resolve_data(sites: dict[str, str], input_path=None):
+    """
+    Latest processed data and its data key, reused for DATA_CHECK_INTERVAL seconds so pages
+    and figures asking for the store don't list and fingerprint the processed data every time.
+    """
+    request = (tuple(sites.items()), input_path)
+    with _resolved_data_lock:
+        resolved = _resolved_data.get(request)
+    if resolved is not None and time.monotonic() - resolved[0] < DATA_CHECK_INTERVAL:
+        return resolved[1:]
+
+    path = input_path or latest_processed_data()
+    resolved = (time.monotonic(), path, _data_key(sites, path))
+    with _resolved_data_lock:
+        _resolved_data[request] = resolved
+    return resolved[1:]
+
+
+def get_data_store(sites: dict[str, str] = sites, input_path=None):
+    """
+    Returns the data store of the app process.
+
+    The store is replaced when the processed data changes, noticed within
+    DATA_CHECK_INTERVAL seconds.
+    """
+    input_path, key = _resolve_data(sites, input_path)
+    return _load_data_store(key, sites, input_path)
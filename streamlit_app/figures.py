@@ -1,14 +1,34 @@
-import plotly.express as px
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+import plotly.colors
 import plotly.graph_objects as go
+import plotly.io as pio
 import streamlit as st
+from loguru import logger
+from wrwc.config import FIGURE_CACHE_SIZE
+from wrwc.derived import geometric_mean_parameter
+from wrwc.instrumentation import span
+from wrwc.thresholds import classify_site, parameter_thresholds
+
+# LRU cache of figures serialized as json, shared by all sessions of the app process
+_figure_cache = OrderedDict()
+_figure_cache_lock = threading.Lock()
+_warmed = set()
 
 
 def site_map(gdf, df_cso):
+    import plotly.express as px  # Slow to import, so only imported by the plots using it
 
     fig = px.scatter_map(gdf,
                          lat=gdf.geometry.y, lon=gdf.geometry.x,
                          hover_name="site_descr",
-                         hover_data=["ww_id", "parameters", "years", "depths"],
+                         hover_data={"ww_id": True, "parameters": True, "years": True,
+                                     "depths": True, "nearest_cso": True,
+                                     "cso_distance_m": ":.0f", "cso_count": True},
+                         labels={"nearest_cso": "Nearest CSO",
+                                 "cso_distance_m": "CSO distance (m)",
+                                 "cso_count": "CSOs nearby"},
                          color_discrete_sequence=['purple'],
                          size=[1 for s in range(len(gdf))],
                          size_max=8,
@@ -62,7 +82,16 @@ def get_unit(df, column='unit'):
     return unit
 
 
-def plot_timeseries(df_mean, site_code, site_name, parameter, log=False, minmax=False):
+def plot_timeseries(df_mean, site_code, site_name, parameter, log=False, minmax=False,
+                    thresholds=None):
+    """
+    Monthly means of each bin with the thresholds of the parameter.
+
+    thresholds are records of threshold fields with their label and exceedance rate, see
+    exceedance_rates, or the thresholds of the registry without rates if None.
+    """
+    import plotly.express as px
+
     m = (df_mean['ww_id'] == site_code) & (df_mean['parameter'] == parameter)
 
     color_by = 'year_range'
@@ -71,9 +100,9 @@ def plot_timeseries(df_mean, site_code, site_name, parameter, log=False, minmax=
 
     bins = df_mean.loc[m, color_by].unique()
     # Sample the color scale to get a color for each year
-    continuous_scale = px.colors.sequential.Viridis
-    bin_colors = px.colors.sample_colorscale(continuous_scale,
-                                             [i / len(bins) for i, _ in enumerate(bins)])
+    continuous_scale = plotly.colors.sequential.Viridis
+    bin_colors = plotly.colors.sample_colorscale(continuous_scale,
+                                                 [i / len(bins) for i, _ in enumerate(bins)])
 
     # Create color map with index as key and color as value
     color_map = {bin_val: color for bin_val, color in zip(bins, bin_colors)}
@@ -117,24 +146,50 @@ def plot_timeseries(df_mean, site_code, site_name, parameter, log=False, minmax=
                 showlegend=False
             )
 
-    match parameter:
-        case 'Phosphorus, Total':
-            fig.add_hline(y=25, line_dash="dash", line_color="red")
-        case 'Enterococci':
-            fig.add_hline(y=54, line_dash="dash", line_color="red")
-            fig.add_hline(y=33, line_dash="dash", line_color="darkred")
-        case 'pH':
-            fig.add_hline(y=6.5, line_dash="dash", line_color="red")
-            fig.add_hline(y=9.0, line_dash="dash", line_color="red")
-        case 'Dissolved Oxygen':
-            fig.add_hline(y=5.0, line_dash="dash", line_color="red")
-        case 'Dissolved Oxygen Saturation':
-            fig.add_hline(y=60, line_dash="dash", line_color="red")
+    # Thresholds of the registry, annotated with the rate of samples exceeding them if given
+    if thresholds is None:
+        thresholds = [asdict(t) for t in parameter_thresholds(parameter, classify_site(site_code))]
+    for t in thresholds:
+        text = f"{t['rate']:.0%} of values {t['label']}" if 'rate' in t else None
+        fig.add_hline(y=t['value'], line_dash="dash", line_color=t['color'],
+                      annotation_text=text)
+
+    return fig
+
+
+def plot_geometric_means(df, site_code, site_name, parameter, log=False):
+    """
+    Rolling geometric means of a site and parameter, see process_rolling_geometric_means, with
+    the thresholds of the parameter's geometric mean in the registry annotated with the share of
+    windows above.
+    """
+    unit = get_unit(df) if len(df) else ''
+    # Rates of the samples in each window above the single sample threshold, if there is one
+    rates = ('<br>samples above single sample threshold=%{customdata[1]:.0%}'
+             if df['exceedance_rate'].notna().any() else '')
+
+    fig = go.Figure(go.Scatter(
+        x=df['date'], y=df['geometric_mean'], mode='lines',
+        customdata=df[['samples', 'exceedance_rate']],
+        hovertemplate='date=%{x|%Y-%m-%d}<br>geometric mean=%{y:.3g}<br>'
+                      'samples=%{customdata[0]}' + rates + '<extra></extra>',
+    ))
+    fig.update_layout(title=f'Site: {site_name}, {site_code}', xaxis_title='Date',
+                      yaxis_title=f"{parameter} geometric mean ({unit})",
+                      yaxis_type='log' if log else None)
+
+    for t in parameter_thresholds(geometric_mean_parameter(parameter), classify_site(site_code)):
+        if t.unit == unit:
+            share = (df['geometric_mean'] > t.value).mean() if len(df) else 0
+            fig.add_hline(y=t.value, line_dash="dash", line_color=t.color,
+                          annotation_text=f"{share:.0%} of windows {t.label}")
 
     return fig
 
 
 def plot_boxplot(df, site_code, site_name, parameter, log=False, all_points=False):
+    import plotly.express as px
+
     unit = get_unit(df)
     point_display = ('all' if all_points else 'outliers')
 
@@ -145,3 +200,77 @@ def plot_boxplot(df, site_code, site_name, parameter, log=False, all_points=Fals
                  title=f'Site: {site_name}, {site_code}')
     return fig
 
+
+def plot_box_summary(df_stats, df_outliers, site_code, site_name, parameter, log=False):
+    """
+    Boxplot by month drawn from precomputed box statistics, see process_box_statistics.
+
+    Only the statistics and outliers are sent to the browser, so the figure size does not grow
+    with the number of samples.
+    """
+    unit = get_unit(df_stats)
+    color = plotly.colors.qualitative.Plotly[0]
+
+    fig = go.Figure([
+        go.Box(x=df_stats['month'], q1=df_stats['q1'], median=df_stats['median'],
+               q3=df_stats['q3'], lowerfence=df_stats['lowerfence'],
+               upperfence=df_stats['upperfence'], boxpoints=False, marker_color=color,
+               name=''),
+        go.Scatter(x=df_outliers['month'], y=df_outliers['concentration'], mode='markers',
+                   marker_color=color, customdata=df_outliers['date'],
+                   hovertemplate='date=%{customdata|%Y-%m-%d}<br>concentration=%{y}'
+                                 '<extra></extra>'),
+    ])
+    fig.update_layout(title=f'Site: {site_name}, {site_code}', showlegend=False,
+                      xaxis_title='Month', yaxis_title=f"{parameter} ({unit})",
+                      yaxis_type='log' if log else None)
+    return fig
+
+
+def cached_figure(key, plot, *args, **kwargs):
+    """
+    Returns plot(*args, **kwargs), restored from the LRU cache of serialized figures when possible.
+
+    The key must identify the dataset version and every option that changes the figure. A new
+    figure is restored from json on each call, so callers can't modify the cached copy.
+    """
+    with _figure_cache_lock:
+        spec = _figure_cache.get(key)
+        if spec is not None:
+            _figure_cache.move_to_end(key)
+    with span(f'figure {plot.__name__}') as s:
+        s.note = 'hit' if spec is not None else 'miss'
+        if spec is not None:
+            return pio.from_json(spec)
+
+        fig = plot(*args, **kwargs)
+        with _figure_cache_lock:
+            _figure_cache[key] = fig.to_json()
+            while len(_figure_cache) > FIGURE_CACHE_SIZE:
+                _figure_cache.popitem(last=False)
+        return fig
+
+
+def warm_figures(name, builders):
+    """
+    Builds figures in a background thread so they are cached before they are selected.
+
+    Runs once per name, e.g. per page and dataset version. Builders that fail are skipped
+    and logged at debug level.
+    """
+    with _figure_cache_lock:
+        if name in _warmed:
+            return
+        _warmed.add(name)
+
+    def warm():
+        warmed = 0
+        for build in builders:
+            try:
+                build()
+                warmed += 1
+            except Exception:  # noqa: BLE001 - warming is best effort, the page builds it again
+                logger.opt(exception=True).debug(f"Skipped warming a figure for {name}")
+        logger.info(f"Warmed {warmed} of {len(builders)} figures for {name}")
+
+    threading.Thread(target=warm, daemon=True).start()
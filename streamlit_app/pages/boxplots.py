@@ -1,22 +1,43 @@
-import pandas as pd
+from collections.abc import Callable
+from functools import partial
 import streamlit as st
 from streamlit_app.data_processing import (
     sites, site_name_lookup,
-    load_concentration_data,
+    get_data_store,
     get_ordered_sites
 )
-from streamlit_app.figures import plot_boxplot
+from streamlit_app.figures import plot_boxplot, plot_box_summary, cached_figure, warm_figures
+from wrwc.config import WARM_FIGURES
 
 
-@st.cache_data
 def get_plot_data():
-    wq_data = load_concentration_data(sites)
-
-    # add a month column
-    wq_data.reset_index(inplace=True)
-    wq_data['month'] = wq_data['date'].dt.month
-
-    return wq_data
+    # Samples of a site and parameter with date and month columns, and the monthly box
+    # statistics and outliers of the shared data
+    store = get_data_store(sites)
+    return store.samples, store.box_statistics
+
+
+def get_figure(i, data, site_code, parameter, log=False, all_points=False):
+    samples, (stats_index, outlier_index) = data
+    key = (get_data_store(sites).version, 'boxplot', i, site_code, parameter, log, all_points)
+    options = dict(site_code=site_code, site_name=sites[site_code], parameter=parameter, log=log)
+    if all_points:
+        # Raw samples are only sent to the browser when all points are shown
+        return cached_figure(key, plot_boxplot, samples(site_code, parameter),
+                             all_points=True, **options)
+    return cached_figure(key, plot_box_summary, stats_index.select(site_code, parameter),
+                         outlier_index.select(site_code, parameter), **options)
+
+
+def warm_page_figures(data: list[tuple]):
+    # Default view of every site and parameter
+    builders = [
+        partial(get_figure, i, d, site_code, parameter)
+        for i, d in enumerate(data)
+        for site_code in d[1][0].sites
+        for parameter in d[1][0].parameters(site_code)
+    ]
+    warm_figures(('boxplot', get_data_store(sites).version), builders)
 
 
 def get_year_range_text(df):
@@ -26,10 +47,10 @@ def get_year_range_text(df):
 
 
 @st.fragment
-def boxplot_section(data: list[pd.DataFrame], names: list[str]):
+def boxplot_section(data: list[tuple[Callable, tuple]], names: list[str]):
     page = 'box'
-    df0 = data[0]
-    sites_list = get_ordered_sites(df0)
+    index0 = data[0][1][0]
+    sites_list = get_ordered_sites(index0.sites)
 
     # Initialize state
     st.session_state.setdefault(
@@ -37,12 +58,7 @@ def boxplot_section(data: list[pd.DataFrame], names: list[str]):
         sites_list[0]
     )
 
-    initial_params = sorted(
-        df0.loc[
-            df0['ww_id'] == site_name_lookup[st.session_state[f'{page}_site_store']],
-            'parameter'
-        ].unique()
-    )
+    initial_params = index0.parameters(site_name_lookup[st.session_state[f'{page}_site_store']])
     st.session_state.setdefault(
         f"{page}_param_store",
         initial_params[0]
@@ -63,12 +79,7 @@ def boxplot_section(data: list[pd.DataFrame], names: list[str]):
     st.session_state[f"{page}_site_store"] = site_name
 
     # Parameter selection
-    site_parameters = sorted(
-        df0.loc[
-            df0['ww_id'] == site_name_lookup[st.session_state[f'{page}_site_store']],
-            'parameter'
-        ].unique()
-    )
+    site_parameters = index0.parameters(site_name_lookup[st.session_state[f'{page}_site_store']])
 
     # Only reset if invalid
     if st.session_state[f"{page}_param_store"] not in site_parameters:
@@ -90,18 +101,16 @@ def boxplot_section(data: list[pd.DataFrame], names: list[str]):
         log_scale = col2_1.checkbox('log scale', value=False)
         all_points = col2_2.checkbox('All data points', value=False)
 
-    for i, (df, name) in enumerate(zip(data, names)):
+    for i, (d, name) in enumerate(zip(data, names)):
         try:
             # Query site and parameter
-            m = (df['ww_id'] == site_name_lookup.get(site_name)) & (df['parameter'] == parameter)
-            plot_df = df[m]
+            plot_df = d[0](site_name_lookup.get(site_name), parameter)
 
             st.subheader(name)
             st.plotly_chart(
-                plot_boxplot(
-                    plot_df,
+                get_figure(
+                    i, d,
                     site_code=site_name_lookup.get(site_name),
-                    site_name=site_name,
                     parameter=parameter,
                     log=log_scale,
                     all_points=all_points
@@ -122,4 +131,6 @@ def boxplot_section(data: list[pd.DataFrame], names: list[str]):
 
 # Page layout
 data = get_plot_data()
+if WARM_FIGURES:
+    warm_page_figures([data])
 boxplot_section([data], ['Site Concentrations by Month'])
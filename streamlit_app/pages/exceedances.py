@@ -0,0 +1,86 @@
+import streamlit as st
+from streamlit_app.data_processing import sites, get_data_store
+from streamlit_app.figures import heatmap
+
+
+def get_summary_data():
+    # Exceedance rates of each site and threshold overall, by month and by ~4 year bins
+    return get_data_store(sites).exceedance_rates
+
+
+def rate_table(df, column):
+    """Exceedance rates in percent with sites upstream to downstream as rows, by column."""
+    codes = [code for code in sites if code in set(df['ww_id'])]
+    return (
+        df
+        .astype({'ww_id': str})
+        .pivot(index='ww_id', columns=column, values='rate')
+        .reindex(codes)
+        .rename(index=sites, columns=str)
+        .mul(100)
+    )
+
+
+@st.fragment
+def exceedance_section(rates):
+    df_overall, df_month, df_year_range = rates
+
+    col1, col2 = st.columns(2)
+    with col1:
+        parameter = st.selectbox(
+            label='Parameter',
+            options=sorted(df_overall['parameter'].unique()),
+            key='exceedance_parameter'
+        )
+    df_parameter = df_overall[df_overall['parameter'] == parameter]
+    thresholds = dict(
+        df_parameter[['label', 'threshold']].drop_duplicates().sort_values('threshold')
+        .itertuples(index=False)
+    )
+    with col2:
+        label = st.selectbox(
+            label='Threshold',
+            options=list(thresholds),
+            key=f'exceedance_threshold_{parameter}'
+        )
+    threshold = thresholds[label]
+
+    df_sites = df_parameter[df_parameter['threshold'] == threshold]
+    st.dataframe(
+        df_sites
+        .assign(site=lambda x: x['ww_id'].map(sites), rate=lambda x: x['rate'] * 100)
+        .set_index('ww_id')
+        .reindex([code for code in sites if code in set(df_sites['ww_id'])])
+        [['site', 'samples', 'exceedances', 'rate']],
+        hide_index=True, width='stretch',
+        column_config={
+            'site': 'Site',
+            'samples': 'Samples',
+            'exceedances': 'Exceedances',
+            'rate': st.column_config.NumberColumn('Exceedance rate (%)', format='%.1f'),
+        }
+    )
+
+    title = f'{parameter} values {label}'
+    for df, column, by in [(df_month, 'month', 'month'), (df_year_range, 'year_range', 'years')]:
+        st.plotly_chart(
+            heatmap(
+                rate_table(df[df['threshold'] == threshold], column),
+                title=f'% of {title} by {by}'
+            ),
+            key=f'exceedance_{column}', use_container_width=True
+        )
+
+
+# Page layout
+rates = get_summary_data()
+
+st.header('Threshold Exceedances')
+st.caption("Share of values beyond each threshold of a parameter, in the unit of the threshold. "
+           "Geometric mean thresholds are compared with the monthly geometric means of bacteria, "
+           "e.g. Enterococci Geometric Mean.")
+exceedance_section(rates)
+
+# Padding at the bottom of the page to prevent browser auto scroll anchoring
+# issues in firefox and safari.
+st.markdown("<div style='height:1000px;'></div>", unsafe_allow_html=True)
@@ -1,23 +1,21 @@
 import streamlit as st
 from streamlit_app.data_processing import (
     sites, site_name_lookup,
-    load_map_data,
-    load_concentration_data,
-    process_monthly_count_data,
+    get_data_store,
 )
 from streamlit_app.figures import site_map, heatmap
+from wrwc.config import SITE_GROUP
+from wrwc.sites import SITE_GROUP_TITLES
+from wrwc.spatial import CSO_SEARCH_RADIUS
 
 
-@st.cache_data
 def get_map_data():
-    gdf, df_cso = load_map_data(sites)
+    gdf, df_cso = get_data_store(sites).map_data
     return gdf, df_cso
 
 
-@st.cache_data
 def get_plot_data():
-    wq_data = load_concentration_data(sites)
-    count_data = process_monthly_count_data(wq_data, sites)
+    count_data = get_data_store(sites).monthly_counts
     return count_data
 
 
@@ -39,12 +37,27 @@ def heatmap_section(counts):
 
 df_counts = get_plot_data()
 
-st.title("Woonasquatucket River Lower Riverine Sites")
+st.title(SITE_GROUP_TITLES.get(SITE_GROUP, "Woonasquatucket River Sites"))
 
 with st.expander("Site Map", expanded=True):
-    fig = site_map(*get_map_data())
+    gdf_sites, gdf_cso = get_map_data()
+    fig = site_map(gdf_sites, gdf_cso)
     st.plotly_chart(fig, use_container_width=True)
 
+with st.expander("CSO Proximity", expanded=False):
+    st.dataframe(
+        gdf_sites.loc[:, ['site_descr', 'ww_id', 'nearest_cso', 'cso_distance_m', 'cso_count']]
+        .rename(columns={
+            'site_descr': 'Site',
+            'ww_id': 'Site ID',
+            'nearest_cso': 'Nearest CSO',
+            'cso_distance_m': 'Distance (m)',
+            'cso_count': f'CSOs within {CSO_SEARCH_RADIUS} m',
+        })
+        .round({'Distance (m)': 0}),
+        hide_index=True
+    )
+
 with st.expander("Sampling Counts", expanded=True):
     heatmap_section(df_counts)
 
@@ -1,26 +1,126 @@
-import pandas as pd
+from functools import partial
 import streamlit as st
 from streamlit_app.data_processing import (
     sites, site_name_lookup,
-    load_concentration_data,
-    process_temporal_bins, get_ordered_sites
+    get_data_store, get_ordered_sites, SiteParameterIndex,
+    CUBE_KEYS, GEOMETRIC_MEAN_WINDOW, YEAR_BINS, YEAR_BIN_LABELS, temporal_bins
 )
-from streamlit_app.figures import plot_timeseries
+from streamlit_app.figures import (
+    plot_timeseries, plot_geometric_means, cached_figure, warm_figures
+)
+from wrwc.config import WARM_FIGURES
+from wrwc.derived import BACTERIA_PARAMETERS
+from wrwc.sites import cso_dates, flagged_sites
 
 
-@st.cache_data
 def get_plot_data():
-    wq_data = load_concentration_data(sites)
-    df_4year_bin, df_cso_bin = process_temporal_bins(wq_data)
+    # Monthly cube of the shared data, binned by site and parameter when plotted, the seasonal
+    # trends and the exceedance rates of each site and parameter
+    store = get_data_store(sites)
+    return (store.cube_index, store.exceedance_index), store.trends
+
+
+def year_bin_options(cube_index: SiteParameterIndex):
+    """Year bin edges and labels by name, see year_bins."""
+    years = cube_index.df['year']
+    decades = list(range(years.min() // 10 * 10, years.max() + 10, 10))
+    return {
+        '~4 year bins': (tuple(YEAR_BINS), tuple(YEAR_BIN_LABELS)),
+        'Decades': (tuple(decades), None),
+    }
+
+
+def get_figure(i, data, site_code, parameter, log=False, minmax=False,
+               edges=tuple(YEAR_BINS), labels=tuple(YEAR_BIN_LABELS)):
+    # Rolled up from the cube of the site and parameter, so any year bins are fast
+    cube_index, exceedance_index = data
+    version = get_data_store(sites).version
+    cube = cube_index.select(site_code, parameter).set_index(CUBE_KEYS)
+    return cached_figure(
+        (version, 'timeseries', i, site_code, parameter, log, minmax, edges, labels),
+        plot_timeseries,
+        temporal_bins(cube, list(edges), None if labels is None else list(labels))[i],
+        site_code=site_code,
+        site_name=sites[site_code],
+        parameter=parameter,
+        log=log,
+        minmax=minmax,
+        thresholds=exceedance_index.select(site_code, parameter).to_dict('records')
+    )
+
+
+def get_geometric_mean_figure(site_code, parameter, log=False):
+    # Rolling geometric means are only built once a bacteria parameter is shown
+    store = get_data_store(sites)
+    return cached_figure(
+        (store.version, 'geometric_mean', site_code, parameter, log),
+        plot_geometric_means,
+        store.rolling_geometric_means.select(site_code, parameter),
+        site_code=site_code,
+        site_name=sites[site_code],
+        parameter=parameter,
+        log=log
+    )
+
 
-    return df_4year_bin, df_cso_bin
+def warm_page_figures(data: tuple[SiteParameterIndex, SiteParameterIndex], charts: int):
+    # Default view of every site and parameter
+    cube_index = data[0]
+    builders = [
+        partial(get_figure, i, data, site_code, parameter)
+        for site_code in cube_index.sites
+        for parameter in cube_index.parameters(site_code)
+        for i in range(charts)
+    ]
+    warm_figures(('timeseries', get_data_store(sites).version), builders)
+
+
+def trend_summary(df_trends, site_code, parameter):
+    st.subheader('Trends')
+    df_site = df_trends[df_trends['ww_id'] == site_code]
+
+    # One trend per unit the parameter was measured in
+    selected = df_site[df_site['parameter'] == parameter]
+    for _, row in selected.iterrows():
+        name = f"**{parameter}**" + (f" in {row['unit']}" if len(selected) > 1 else '')
+        years = f"from {row['first']} to {row['last']}"
+        if row['trend'] in ('increasing', 'decreasing'):
+            st.markdown(f"{name} is {row['trend']} by {abs(row['slope']):.3g} "
+                        f"{row['unit']} per year {years} (p = {row['p_value']:.3f}).")
+        elif row['trend'] == 'no trend':
+            st.markdown(f"{name} has no significant trend {years} "
+                        f"(p = {row['p_value']:.2f}).")
+        else:
+            st.markdown(f"{name} has too few samples to test for a trend.")
+
+    st.dataframe(
+        df_site
+        .assign(years=lambda x: x['first'].astype(str) + '-' + x['last'].astype(str))
+        [['parameter', 'trend', 'slope', 'unit', 'p_value', 'years', 'n']],
+        hide_index=True, width='stretch',
+        column_config={
+            'parameter': 'Parameter',
+            'trend': 'Trend',
+            'slope': st.column_config.NumberColumn("Sen's slope per year", format='%.3g'),
+            'unit': 'Unit',
+            'p_value': st.column_config.NumberColumn('p-value', format='%.3f'),
+            'years': 'Years',
+            'n': st.column_config.NumberColumn('Months sampled'),
+        }
+    )
+    st.caption("Seasonal Mann-Kendall test of the monthly means with months as seasons, "
+               "significant at p < 0.05. Sen's slope is the median change per year between "
+               "means of the same month.")
 
 
 @st.fragment
-def timeseries_section(data: list[pd.DataFrame], names: list[str]):
+def timeseries_section(data: tuple[SiteParameterIndex, SiteParameterIndex], df_trends):
     page = 'timeseries'
-    df0 = data[0]
-    sites_list = get_ordered_sites(df0)
+    index0 = data[0]
+    year_bin_exclude = flagged_sites('year_bins', value=False)
+    sites_list = get_ordered_sites(
+        [code for code in index0.sites if code not in year_bin_exclude]
+    )
 
     # Initialize state
     st.session_state.setdefault(
@@ -28,12 +128,7 @@ def timeseries_section(data: list[pd.DataFrame], names: list[str]):
         sites_list[0]
     )
 
-    initial_params = sorted(
-        df0.loc[
-            df0['ww_id'] == site_name_lookup[st.session_state[f'{page}_site_store']],
-            'parameter'
-        ].unique()
-    )
+    initial_params = index0.parameters(site_name_lookup[st.session_state[f'{page}_site_store']])
     st.session_state.setdefault(
         f"{page}_param_store",
         initial_params[0]
@@ -54,12 +149,7 @@ def timeseries_section(data: list[pd.DataFrame], names: list[str]):
     st.session_state[f"{page}_site_store"] = site_name
 
     # Parameter selection
-    site_parameters = sorted(
-        df0.loc[
-            df0['ww_id'] == site_name_lookup[st.session_state[f'{page}_site_store']],
-            'parameter'
-        ].unique()
-    )
+    site_parameters = index0.parameters(site_name_lookup[st.session_state[f'{page}_site_store']])
 
     # Only reset if invalid
     if st.session_state[f"{page}_param_store"] not in site_parameters:
@@ -81,23 +171,65 @@ def timeseries_section(data: list[pd.DataFrame], names: list[str]):
         log_scale = col2_1.checkbox('log scale', value=False)
         min_max = col2_2.checkbox('Min-Max lines', value=False)
 
-    for i, (df, name) in enumerate(zip(data, names)):
+    # Year bin selection, custom bins are given by their edges
+    options = year_bin_options(index0)
+    with col1:
+        bin_name = st.radio('Year bins', [*options, 'Custom'], horizontal=True,
+                            key=f"{page}_bins")
+    if bin_name == 'Custom':
+        years = index0.df['year']
+        edges = st.multiselect(
+            'First year of each bin, and the year after the last bin',
+            options=list(range(years.min(), years.max() + 2)),
+            default=[year for year in YEAR_BINS if years.min() <= year <= years.max() + 1],
+            key=f"{page}_edges"
+        )
+        edges, labels = tuple(sorted(edges)), None
+    else:
+        edges, labels = options[bin_name]
+
+    site_code = site_name_lookup.get(site_name)
+    cso_date = cso_dates().get(site_code)
+    names = [
+        'Custom year bins' if bin_name == 'Custom' else bin_name,
+        'Pre and Post CSO improvements'
+        + (f' of {cso_date:%B %Y}' if cso_date is not None else ''),
+    ]
+    for i, name in enumerate(names):
         try:
             st.subheader(name)
+            if i == 0 and len(edges) < 2:
+                st.info("Select at least two bin edges.")
+                continue
             st.plotly_chart(
-                plot_timeseries(
-                    df,
-                    site_code=site_name_lookup.get(site_name),
-                    site_name=site_name,
+                get_figure(
+                    i, data,
+                    site_code=site_code,
                     parameter=parameter,
                     log=log_scale,
-                    minmax=min_max
+                    minmax=min_max,
+                    edges=edges,
+                    labels=labels
                 ),
                 key=f'timeseries_{i}', use_container_width=True
             )
         except IndexError as e:
+            if i == 0:
+                st.info("No samples in the selected year bins.")
+                continue
+            cso_site_names = [sites[code] for code in flagged_sites('cso_study') if code in sites]
             st.info("Pre and post CSO improvements is only available for sites: "
-                    "Greystone Pond, Donigian Park, and Waterplace Park.")
+                    f"{', '.join(cso_site_names)}.")
+
+    if parameter in BACTERIA_PARAMETERS:
+        st.subheader(f'{GEOMETRIC_MEAN_WINDOW.days} day geometric mean')
+        st.plotly_chart(get_geometric_mean_figure(site_code, parameter, log=log_scale),
+                        key='timeseries_geometric_mean', use_container_width=True)
+        st.caption(f"Geometric mean of the samples in the {GEOMETRIC_MEAN_WINDOW.days} days up "
+                   "to each sample date, with counts below 1 taken as 1.")
+
+    trend_summary(df_trends, site_code, parameter)
+
     if parameter == 'Fecal Coliform':
         st.info(
             "Note: Fecal Coliform methodology changed from CFU/100ml to MPN/100ml in 2011. "
@@ -107,11 +239,10 @@ def timeseries_section(data: list[pd.DataFrame], names: list[str]):
 
 
 # Page layout
-df_4year_bins, df_cso_bins = get_plot_data()
-timeseries_section(
-    data=[df_4year_bins, df_cso_bins],
-    names=['~4 year bins', 'Pre and Post 2015 CSO improvements']
-)
+data, df_trends = get_plot_data()
+if WARM_FIGURES:
+    warm_page_figures(data, charts=2)
+timeseries_section(data, df_trends)
 
 # Padding at the bottom of the page to prevent browser auto scroll anchoring
 # issues in firefox and safari.
@@ -1,4 +1,6 @@
 import streamlit as st
+from wrwc.config import DEBUG_PANEL
+from wrwc.instrumentation import collect_spans, spans_table
 
 st.set_page_config(
     page_title="Riverine Sites",
@@ -10,8 +12,19 @@ st.set_page_config(
 explorer = st.Page("pages/explorer.py", title="Explorer", icon="🗺️")
 timeseries = st.Page("pages/timeseries.py", title="Time Series", icon="📈")
 boxplots = st.Page("pages/boxplots.py", title="Box Plots", icon="📦")
+exceedances = st.Page("pages/exceedances.py", title="Exceedances", icon="🚩")
 
-pg = st.navigation([explorer, boxplots, timeseries], expanded=True)
-pg.run()
+pg = st.navigation([explorer, boxplots, timeseries, exceedances], expanded=True)
+with collect_spans() as spans:
+    pg.run()
+
+# Timings and memory of the stages run during this rerun
+if DEBUG_PANEL or st.query_params.get('debug') == '1':
+    with st.sidebar.expander("Debug: last rerun"):
+        if spans:
+            st.caption(f"{sum(s.seconds for s in spans if s.depth == 0):.3f} s in stages")
+            st.dataframe(spans_table(spans), hide_index=True)
+        else:
+            st.caption("No stages ran, all products were already loaded.")
 
 
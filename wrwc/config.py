@@ -1,14 +1,14 @@
+import os
 from pathlib import Path
 
-from dotenv import load_dotenv
-from loguru import logger
-
-# Load environment variables from .env file if it exists
-load_dotenv()
-
 # Paths
 PROJ_ROOT = Path(__file__).resolve().parents[1]
-logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
+
+# Load environment variables from .env file if it exists, python-dotenv is only imported then
+if (PROJ_ROOT / ".env").is_file():
+    from dotenv import load_dotenv
+
+    load_dotenv(PROJ_ROOT / ".env")
 
 DATA_DIR = PROJ_ROOT / "data"
 RAW_DATA_DIR = DATA_DIR / "raw"
@@ -20,3 +20,40 @@ MODELS_DIR = PROJ_ROOT / "models"
 
 REPORTS_DIR = PROJ_ROOT / "reports"
 FIGURES_DIR = REPORTS_DIR / "figures"
+
+REFERENCES_DIR = PROJ_ROOT / "references"
+
+# Combined sewer overflow (CSO) outfalls of the Narragansett Bay Commission
+CSO_PATH = EXTERNAL_DATA_DIR / "UTILITY_NBC_Sewer_Overflows_spf_-4273409046426376393.gpkg"
+
+# strftime format of the sample dates in the raw data, rows with other dates are reported
+RAW_DATE_FORMAT = os.getenv("WRWC_RAW_DATE_FORMAT", "%Y-%m-%d")
+
+# Site names, river order and study membership, and the group of sites shown in the app
+SITE_REGISTRY_PATH = Path(os.getenv("WRWC_SITE_REGISTRY") or REFERENCES_DIR / "site_registry.csv")
+SITE_GROUP = os.getenv("WRWC_SITE_GROUP", "lower_riverine")
+
+# On-disk cache of loaded and derived data shared between app processes
+CACHE_DIR = Path(os.getenv("WRWC_CACHE_DIR") or INTERIM_DATA_DIR / "cache")
+CACHE_MAX_BYTES = int(os.getenv("WRWC_CACHE_MAX_BYTES", str(2 * 1024**3)))
+
+# Seconds the app reuses the resolved processed data and its fingerprint before checking the
+# processed data directory for changes again
+DATA_CHECK_INTERVAL = float(os.getenv("WRWC_DATA_CHECK_INTERVAL", "10"))
+
+# In-memory cache of serialized app figures, optionally warmed when a page first loads
+FIGURE_CACHE_SIZE = int(os.getenv("WRWC_FIGURE_CACHE_SIZE", "512"))
+WARM_FIGURES = os.getenv("WRWC_WARM_FIGURES", "0") == "1"
+
+# Engine of the app's queries of the processed data: "duckdb", "pandas", or "auto" for DuckDB
+# when it is installed (an optional dependency)
+QUERY_ENGINE = os.getenv("WRWC_QUERY_ENGINE", "auto")
+
+# Worker processes for per-site calculations, 1 runs them in the calling process. Always 1 in
+# the app server, see parallel.map_site_shards
+WORKERS = int(os.getenv("WRWC_WORKERS", "1"))
+
+# Stage timings and memory: an optional json lines log of all spans, and a debug panel in the
+# app showing the spans of the last rerun (also shown with ?debug=1 in the app url)
+SPAN_LOG_PATH = os.getenv("WRWC_SPAN_LOG")
+DEBUG_PANEL = os.getenv("WRWC_DEBUG_PANEL", "0") == "1"
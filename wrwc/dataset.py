@@ -1,37 +1,137 @@
+from collections.abc import Iterable
 from datetime import datetime
-import pandas as pd
 from pathlib import Path
+import shutil
+
 from loguru import logger
-from functools import partial
-from wrwc.config import PROCESSED_DATA_DIR, RAW_DATA_DIR
+import numpy as np
+import pandas as pd
 
+from wrwc.config import INTERIM_DATA_DIR, PROCESSED_DATA_DIR, RAW_DATA_DIR, RAW_DATE_FORMAT
+from wrwc.instrumentation import instrumented, span
+from wrwc.manifest import file_sha256, input_record, read_manifest, row_hashes, write_manifest
+from wrwc.schema import (
+    MAX_INVALID_DATE_SHARE,
+    PLACEMENT_PROBLEMS,
+    RAW_DTYPES,
+    conform,
+    describe_problems,
+    invalid_rows,
+    parse_dates,
+)
+from wrwc.store import (
+    INCREMENTAL_STORE_NAME,
+    PARTITION_COLUMNS,
+    delete_partitions,
+    is_store,
+    latest_processed_data,
+    read_concentration_store,
+    read_processed_data,
+    write_concentration_store,
+)
 
-def concentration_data(
+# Inconsistent units in the raw data and their replacement
+UNIT_FIXES = {"mg/L": "mg/l"}
+
+# Raw rows that don't fit the schema, with their problems and whether they were dropped,
+# written by the last ingestion
+INVALID_ROWS_PATH = INTERIM_DATA_DIR / "invalid_rows.csv"
+
+
+def normalize_name(col: str) -> str:
+    """
+    Standardizes a column name to lower case with underscores.
+
+    :param col: Raw column name
+    :return: Standardized column name
+    """
+    return col.replace(" ", "_").lower()
+
+
+def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Standardizes column names to lower case with underscores.
+
+    :param df: Dataframe with raw column names
+    :return: Dataframe with standardized column names
+    """
+    return df.rename(columns=normalize_name)
+
+
+def read_raw_data(
     input_path: Path = RAW_DATA_DIR / "WoonasquatucketData.csv",
-    output_path: Path = PROCESSED_DATA_DIR,
+    chunksize: int | None = None,
+    usecols: list[str] | None = None,
 ):
     """
-    Formats the concentration data and fixes inconsistencies in the raw data.
+    Reads the raw concentration data with the column types of the schema, see
+    schema.RAW_DTYPES.
+
+    Fixing the types keeps the schema the same between chunks, e.g. a chunk where a text column
+    is empty would otherwise be read as float. Undeclared columns are read as text.
 
     :param input_path: Path to raw data csv file
-    :param output_path: Path to directory to save output
-    :return: None
+    :param chunksize: Number of rows per chunk, read all rows at once if None
+    :param usecols: Standardized names of the columns to read, all columns if None
+    :return: Dataframe of raw data, or an iterator of dataframes if chunksize is set
     """
-    logger.info("Processing dataset...")
+    header = pd.read_csv(input_path, nrows=0).columns
+    if usecols is not None:
+        header = [col for col in header if normalize_name(col) in usecols]
+    dtype = {col: RAW_DTYPES.get(normalize_name(col), "str") for col in header}
+    return pd.read_csv(input_path, usecols=header, dtype=dtype, chunksize=chunksize)
 
-    site_info_path = RAW_DATA_DIR / "SiteInfo.csv"
 
-    # Read in data
-    df_data_raw = pd.read_csv(input_path)
-    df_data = df_data_raw.copy()
-    df_site = pd.read_csv(site_info_path)
+def read_site_info(site_info_path: Path = RAW_DATA_DIR / "SiteInfo.csv") -> pd.DataFrame:
+    """
+    Reads the site info and standardizes its column names.
 
-    # Standardize column names
-    df_data.columns = [col.replace(" ", "_").lower() for col in df_data.columns]
+    :param site_info_path: Path to site info csv file
+    :return: Dataframe of site info with a ww_id column
+    """
+    return normalize_columns(pd.read_csv(site_info_path)).rename(columns={"ww_station": "ww_id"})
 
-    # Create dictionary of parameter codes to parameter name for relabeling with concise names
+
+def map_categories(s: pd.Series, mapper) -> pd.Series:
+    """
+    Maps the distinct values of a series and returns a categorical series.
+
+    The mapper is only applied to the categories, so the cost depends on the number of distinct
+    values rather than the number of rows. Categories that map to the same value are merged.
+
+    :param s: Series to map, converted to categorical if needed
+    :param mapper: Function or dictionary applied to each category, unmapped values become NA
+    :return: Categorical series of mapped values
+    """
+    s = s.astype("category")
+    codes, categories = pd.factorize(s.cat.categories.map(mapper))
+    row_codes = s.cat.codes.to_numpy()
+    new_codes = np.where(row_codes >= 0, codes[row_codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(new_codes, categories=categories), index=s.index, name=s.name
+    )
+
+
+def parse_parameter_code(parameter: str) -> str:
+    """
+    Parses the parameter code from a raw parameter string.
+
+    :param parameter: Raw parameter string, e.g. "Phosphorus, Total - 00665"
+    :return: Parameter code, e.g. "00665"
+    """
+    return parameter.split("-")[-1].strip()
+
+
+def parameter_dictionary(parameters: Iterable[str]) -> dict[str, str]:
+    """
+    Creates a dictionary of parameter codes to concise parameter names.
+
+    :param parameters: Distinct raw parameter strings, e.g. "Phosphorus, Total - 00665", missing
+        values are skipped
+    :return: Dictionary of parameter code to parameter name
+    """
     param_code_to_name = {
-        s.split("-")[-1].strip(): s.split("-")[0].strip() for s in df_data.parameter.unique()
+        parse_parameter_code(s): s.split("-")[0].strip() for s in parameters if pd.notna(s)
     }
     shortened_names = {
         "00915": "Calcium",
@@ -43,21 +143,90 @@ def concentration_data(
         "00608": "Nitrogen, Ammonia",
     }
     param_code_to_name.update(shortened_names)
+    return param_code_to_name
+
+
+def report_invalid_rows(
+    df_invalid: pd.DataFrame,
+    problems: pd.DataFrame,
+    dropped: pd.Series,
+    invalid_rows_path: Path | None = None,
+):
+    """
+    Logs the number of invalid rows with each problem and appends the rows to a csv file.
+
+    :param df_invalid: Invalid raw rows
+    :param problems: Problems of each row, see schema.invalid_rows
+    :param dropped: Whether each row is dropped or kept
+    :param invalid_rows_path: Path to csv file of invalid rows, only logged if None
+    :return: None
+    """
+    for rows, action in [(dropped, "Dropped"), (~dropped, "Kept")]:
+        if rows.any():
+            counts = problems[rows].sum()
+            logger.warning(
+                f"{action} {rows.sum()} invalid rows: "
+                + ", ".join(f"{problem} ({n})" for problem, n in counts[counts > 0].items())
+            )
+    if invalid_rows_path is not None:
+        invalid_rows_path.parent.mkdir(parents=True, exist_ok=True)
+        df_invalid.assign(problem=describe_problems(problems), dropped=dropped).to_csv(
+            invalid_rows_path, mode="a", header=not invalid_rows_path.exists(), index=False
+        )
+
+
+@instrumented()
+def process_concentration_data(
+    df_data: pd.DataFrame,
+    df_site: pd.DataFrame,
+    param_code_to_name: dict[str, str] | None = None,
+    invalid_rows_path: Path | None = None,
+) -> pd.DataFrame:
+    """
+    Formats raw concentration data and merges in the site info.
 
-    # Process Site info
-    df_site.columns = [col.replace(" ", "_").lower() for col in df_site.columns]
-    df_site.rename(columns={"ww_station": "ww_id"}, inplace=True)
+    Rows that don't fit the schema are reported, see schema.invalid_rows. Rows that can't be
+    placed, without a site, parameter or a date matching the raw date format, are dropped. Rows
+    with a unit not allowed for the parameter are kept, see schema.ALLOWED_UNITS.
+
+    :param df_data: Raw concentration data
+    :param df_site: Site info, see read_site_info
+    :param param_code_to_name: Parameter dictionary, created from df_data if None
+    :param invalid_rows_path: Path to csv file the invalid rows are appended to
+    :return: Processed concentration data
+    :raises ValueError: If more than MAX_INVALID_DATE_SHARE of the rows have an invalid date,
+        most likely as the raw date format (WRWC_RAW_DATE_FORMAT) doesn't match the data
+    """
+    # Standardize column names
+    df_data = df_raw = normalize_columns(df_data)
+
+    # Create dictionary of parameter codes to parameter name for relabeling with concise names
+    if param_code_to_name is None:
+        param_code_to_name = parameter_dictionary(df_data.parameter.unique())
+
+    # Create datetime, parameter code, and parameter name columns. Dates, parameters and units
+    # are parsed once per distinct value.
+    df_data = df_data.assign(
+        date=parse_dates(df_data["date_of_sample"]),
+        param_code=map_categories(df_data["parameter"], parse_parameter_code),
+        unit=map_categories(df_data["unit"], lambda u: UNIT_FIXES.get(u, u)),
+    ).assign(parameter=lambda x: map_categories(x["param_code"], param_code_to_name))
+
+    problems = invalid_rows(df_data)
+    invalid_dates = problems["invalid date"].sum()
+    if invalid_dates > MAX_INVALID_DATE_SHARE * len(df_data):
+        raise ValueError(
+            f"{invalid_dates} of {len(df_data)} sample dates don't match the raw date format "
+            f"{RAW_DATE_FORMAT!r}, set WRWC_RAW_DATE_FORMAT to the format of the raw data"
+        )
+    if len(problems):
+        dropped = problems[PLACEMENT_PROBLEMS].any(axis=1)
+        report_invalid_rows(df_raw.loc[problems.index], problems, dropped, invalid_rows_path)
+        df_data = df_data.drop(index=problems.index[dropped])
 
     # Process dataframe
     df_data = (
         df_data
-        # Create datetime, parameter code, and parameter name columns
-        .assign(
-            date=pd.to_datetime(df_data["date_of_sample"]),
-            param_code=[s.split("-")[-1].strip() for s in df_data["parameter"]],
-            unit=df_data["unit"].replace("mg/L", "mg/l"),
-        )
-        .assign(parameter=lambda x: [param_code_to_name[s] for s in x["param_code"]])
         # Drop no data or redundant columns
         .drop(
             columns=[
@@ -67,18 +236,246 @@ def concentration_data(
                 "fish_taxa",
                 "date_of_sample",
             ]
-        )
-        .merge(
+        ).merge(
             df_site.loc[:, ["ww_id", "wbid", "wb_type", "site_descr", "lat_dd", "lon_dd"]],
             on="ww_id",
             how="left",
         )
     )
-    logger.success("Processing dataset complete.")
+    return conform(df_data)
+
+
+@instrumented()
+def concentration_data(
+    input_path: Path = RAW_DATA_DIR / "WoonasquatucketData.csv",
+    output_path: Path = PROCESSED_DATA_DIR,
+    site_info_path: Path = RAW_DATA_DIR / "SiteInfo.csv",
+    output_format: str = "parquet",
+    partition_cols: tuple[str, ...] = PARTITION_COLUMNS,
+    incremental: bool = False,
+    chunksize: int | None = None,
+    invalid_rows_path: Path | None = INVALID_ROWS_PATH,
+):
+    """
+    Formats the concentration data and fixes inconsistencies in the raw data.
+
+    :param input_path: Path to raw data csv file
+    :param output_path: Path to directory to save output
+    :param site_info_path: Path to site info csv file
+    :param output_format: "parquet" for a store partitioned by partition_cols or "csv"
+    :param partition_cols: Columns to partition the parquet store by
+    :param incremental: Only process new or changed rows into the incremental parquet store
+    :param chunksize: Stream the raw data in chunks of this many rows to bound memory use
+    :param invalid_rows_path: Path to csv file of the raw rows that don't fit the schema,
+        replaced on each run
+    :return: None
+    """
+    if incremental:
+        if output_format != "parquet":
+            raise ValueError("Incremental ingestion requires the parquet output format")
+        if chunksize is not None:
+            raise ValueError("Chunked ingestion is not supported in incremental mode")
+        update_concentration_store(
+            input_path,
+            output_path / INCREMENTAL_STORE_NAME,
+            site_info_path,
+            partition_cols,
+            invalid_rows_path,
+        )
+        return
 
     date_str = datetime.now().strftime("%Y%m%d")
-    filename = f"wrwc-processed-data-{date_str}.csv"
-    df_data.to_csv(output_path / filename, index=False)
+    match output_format:
+        case "parquet":
+            output_file = output_path / f"wrwc-processed-data-{date_str}.parquet"
+        case "csv":
+            output_file = output_path / f"wrwc-processed-data-{date_str}.csv"
+        case _:
+            raise ValueError(f"Unknown output format: {output_format}")
+
+    logger.info("Processing dataset...")
+    df_site = read_site_info(site_info_path)
+    if invalid_rows_path is not None:
+        invalid_rows_path.unlink(missing_ok=True)
+
+    if chunksize is None:
+        with span("read_raw_data") as s:
+            df_raw = read_raw_data(input_path)
+            s.rows_out = len(df_raw)
+        df_data = process_concentration_data(df_raw, df_site, invalid_rows_path=invalid_rows_path)
+        write_processed_data(df_data, output_file, partition_cols)
+    else:
+        stream_concentration_data(
+            input_path, output_file, df_site, chunksize, partition_cols, invalid_rows_path
+        )
+    logger.success("Processing dataset complete.")
+
+
+@instrumented()
+def write_processed_data(
+    df: pd.DataFrame,
+    output_file: Path,
+    partition_cols: tuple[str, ...] = PARTITION_COLUMNS,
+    chunk: int | None = None,
+):
+    """
+    Writes processed concentration data to a parquet store or csv file.
+
+    :param df: Processed concentration data
+    :param output_file: Path to parquet store (.parquet) or csv file
+    :param partition_cols: Columns to partition the parquet store by
+    :param chunk: Index of the chunk being written, chunks after the first are appended
+    :return: None
+    """
+    if is_store(output_file):
+        if chunk is None:
+            write_concentration_store(df, output_file, partition_cols)
+        else:
+            write_concentration_store(
+                df,
+                output_file,
+                partition_cols,
+                basename_template=f"part-{chunk:05d}-{{i}}.parquet",
+                append=True,
+            )
+    else:
+        append = bool(chunk)
+        df.to_csv(output_file, index=False, mode="a" if append else "w", header=not append)
+
+
+@instrumented()
+def stream_concentration_data(
+    input_path: Path,
+    output_file: Path,
+    df_site: pd.DataFrame,
+    chunksize: int,
+    partition_cols: tuple[str, ...] = PARTITION_COLUMNS,
+    invalid_rows_path: Path | None = None,
+):
+    """
+    Processes the raw concentration data in chunks and writes each chunk to the output.
+
+    Only one chunk is held in memory at a time, so peak memory depends on the chunk size and not
+    on the size of the raw data.
+
+    :param input_path: Path to raw data csv file
+    :param output_file: Path to parquet store (.parquet) or csv file
+    :param df_site: Site info, see read_site_info
+    :param chunksize: Number of raw rows per chunk
+    :param partition_cols: Columns to partition the parquet store by
+    :param invalid_rows_path: Path to csv file the invalid rows of each chunk are appended to
+    :return: None
+    """
+    # First pass over the parameter column so parameters are relabeled the same in every chunk
+    parameters = {}
+    for chunk in read_raw_data(input_path, chunksize=chunksize, usecols=["parameter"]):
+        parameters.update(dict.fromkeys(chunk.iloc[:, 0].unique()))
+    param_code_to_name = parameter_dictionary(parameters)
+
+    if is_store(output_file) and output_file.exists():
+        shutil.rmtree(output_file)
+
+    rows = 0
+    for i, chunk in enumerate(read_raw_data(input_path, chunksize=chunksize)):
+        df_chunk = process_concentration_data(
+            chunk, df_site, param_code_to_name, invalid_rows_path
+        )
+        write_processed_data(df_chunk, output_file, partition_cols, chunk=i)
+        rows += len(df_chunk)
+        logger.info(f"Processed chunk {i} ({rows} rows)")
+
+
+@instrumented()
+def update_concentration_store(
+    input_path: Path = RAW_DATA_DIR / "WoonasquatucketData.csv",
+    store_path: Path = PROCESSED_DATA_DIR / INCREMENTAL_STORE_NAME,
+    site_info_path: Path = RAW_DATA_DIR / "SiteInfo.csv",
+    partition_cols: tuple[str, ...] = PARTITION_COLUMNS,
+    invalid_rows_path: Path | None = INVALID_ROWS_PATH,
+):
+    """
+    Incrementally updates the processed concentration store from the raw data.
+
+    The manifest of the store records a content hash, row count and latest sample date of each
+    input. Unchanged inputs are skipped. Otherwise, raw rows are matched to the processed rows
+    by row hash so only new rows are processed and appended, and the partitions holding changed
+    or deleted rows are rewritten. A change to the site info or partitioning rebuilds the store.
+    Invalid rows are never stored, so they are reported again by each update.
+
+    :param input_path: Path to raw data csv file
+    :param store_path: Directory of the incremental parquet store
+    :param site_info_path: Path to site info csv file
+    :param partition_cols: Columns to partition the parquet store by
+    :param invalid_rows_path: Path to csv file of the new raw rows that don't fit the schema,
+        replaced on each update
+    :return: None
+    """
+    partition_cols = list(partition_cols)
+    if partition_cols[0] != "ww_id":
+        raise ValueError("The incremental store must be partitioned by ww_id first")
+
+    manifest = read_manifest(store_path)
+    data_sha256 = file_sha256(input_path)
+    site_sha256 = file_sha256(site_info_path)
+
+    rebuild = (
+        manifest is None
+        or manifest["partition_cols"] != partition_cols
+        or manifest["inputs"]["site_info"]["sha256"] != site_sha256
+    )
+    if not rebuild and manifest["inputs"]["data"]["sha256"] == data_sha256:
+        logger.info(f"{input_path} is unchanged, skipping ingestion.")
+        return
+
+    logger.info("Processing dataset incrementally...")
+    if invalid_rows_path is not None:
+        invalid_rows_path.unlink(missing_ok=True)
+
+    # Read in data
+    with span("read_raw_data") as s:
+        df_data = read_raw_data(input_path)
+        s.rows_out = len(df_data)
+    df_site = read_site_info(site_info_path)
+    with span("row_hashes", rows_in=len(df_data)):
+        df_data["row_hash"] = row_hashes(df_data)
+
+    if rebuild:
+        logger.info(f"Rebuilding {store_path}")
+        if store_path.exists():
+            shutil.rmtree(store_path)
+        df_new = df_data
+    else:
+        df_existing = read_concentration_store(store_path, columns=["ww_id", "row_hash"])
+        m_removed = ~df_existing["row_hash"].isin(df_data["row_hash"])
+        df_new = df_data[~df_data["row_hash"].isin(df_existing["row_hash"])]
+
+        # Rewrite partitions that hold rows no longer in the raw data
+        if m_removed.any():
+            affected = df_existing.loc[m_removed, "ww_id"].unique()
+            df_keep = read_concentration_store(store_path, sites=affected)
+            df_keep = df_keep[df_keep["row_hash"].isin(df_data["row_hash"])]
+            delete_partitions(store_path, "ww_id", affected)
+            if len(df_keep):
+                write_concentration_store(df_keep, store_path, partition_cols, append=True)
+        logger.info(f"{len(df_new)} new and {m_removed.sum()} removed rows")
+
+    if len(df_new):
+        df_processed = process_concentration_data(
+            df_new, df_site, invalid_rows_path=invalid_rows_path
+        )
+        write_concentration_store(df_processed, store_path, partition_cols, append=True)
+
+    df_dates = read_concentration_store(store_path, columns=["date"])["date"]
+    write_manifest(
+        store_path,
+        inputs={
+            "data": input_record(input_path, len(df_data), df_dates.max(), data_sha256),
+            "site_info": input_record(site_info_path, len(df_site), sha256=site_sha256),
+        },
+        rows=len(df_dates),
+        partition_cols=partition_cols,
+    )
+    logger.success("Incremental processing complete.")
 
 
 def list_to_string(l: list, wrap: int = 4):
@@ -100,66 +497,142 @@ def list_to_string(l: list, wrap: int = 4):
     return output_str
 
 
+def distinct_values(
+    df: pd.DataFrame, column: str, sort: bool = True, dropna: bool = False
+) -> pd.DataFrame:
+    """
+    Finds the distinct values of a column at each site.
+
+    The values of each site are contiguous. Categorical values are sorted by value rather than
+    by category order.
+
+    :param df: Dataframe with ww_id and the column
+    :param column: Column to find distinct values of
+    :param sort: Sort values within each site, otherwise values are in order of first appearance
+    :param dropna: Drop missing values
+    :return: Dataframe of distinct (ww_id, value) pairs
+    """
+    df_distinct = df[["ww_id", column]].drop_duplicates()
+    if dropna:
+        df_distinct = df_distinct.dropna(subset=[column])
+    if isinstance(df_distinct[column].dtype, pd.CategoricalDtype):
+        df_distinct[column] = df_distinct[column].astype(object)
+    return df_distinct.sort_values(by=["ww_id", column] if sort else ["ww_id"], kind="stable")
+
+
+def join_values(
+    df_distinct: pd.DataFrame, column: str, index: pd.Index, wrap: int = 4
+) -> pd.Series:
+    """
+    Joins the distinct values of each site to a string, see list_to_string.
+
+    :param df_distinct: Distinct (ww_id, value) pairs in display order, see distinct_values
+    :param column: Column of values to join
+    :param index: Sites (ww_id) of the output, sites without values get an empty string
+    :param wrap: Number of values to fit on a line
+    :return: Series of strings indexed by ww_id
+    """
+    sizes = df_distinct.groupby("ww_id", observed=True, sort=False).size()
+    position = df_distinct.groupby("ww_id", observed=True, sort=False).cumcount().to_numpy() + 1
+    size = np.repeat(sizes.to_numpy(), sizes.to_numpy())
+    separator = np.where(position == size, "", np.where(position % wrap == 0, ", <br>", ", "))
+    values = df_distinct[column].astype(str).str.replace(",", "", regex=False)
+    parts = (values + separator).tolist()
+
+    stops = np.cumsum(sizes.to_numpy())
+    joined = ["".join(parts[stop - n : stop]) for n, stop in zip(sizes, stops)]
+    return pd.Series(joined, index=sizes.index, dtype=object).reindex(index, fill_value="")
+
+
+def list_values(df_distinct: pd.DataFrame, column: str, index: pd.Index) -> pd.Series:
+    """
+    Collects the distinct values of each site to a list.
+
+    :param df_distinct: Distinct (ww_id, value) pairs in display order, see distinct_values
+    :param column: Column of values to collect
+    :param index: Sites (ww_id) of the output, sites without values get an empty list
+    :return: Series of lists indexed by ww_id
+    """
+    lists = df_distinct.groupby("ww_id", observed=True)[column].agg(list)
+    return pd.Series([lists.get(ww_id, []) for ww_id in index], index=index, dtype=object)
+
+
+@instrumented()
 def mapping_data(
-    input_path: Path = PROCESSED_DATA_DIR / "wrwc-processed-data-20250501.csv",
+    input_path: Path | None = None,
     output_path: Path = PROCESSED_DATA_DIR,
+    site_info_path: Path = RAW_DATA_DIR / "SiteInfo.csv",
+    structured: bool = False,
+    tag: str | None = None,
 ):
     """
     Creates data for mapping sites with summarized information.
 
-    :param input_path: path to concentration file to use
+    :param input_path: path to concentration file or parquet store to use, latest if None
     :param output_path: output directory
+    :param site_info_path: path to site info csv file
+    :param structured: also write a parquet summary with list columns of the distinct
+        parameters, years, and depths
+    :param tag: suffix of the output file names, e.g. "latest", the current date if None
     :return: None
     """
     # Read in data
-    df_data = pd.read_csv(input_path, parse_dates=['date'])
-    df_site = pd.read_csv(RAW_DATA_DIR / "SiteInfo.csv")
-    df_site.columns = [col.replace(" ", "_").lower() for col in df_site.columns]
-    df_site.rename(columns={'ww_station': 'ww_id'}, inplace=True)
+    df_data = read_processed_data(input_path or latest_processed_data())
+    df_site = read_site_info(site_info_path)
 
-    # Aggregate parameters
-    df_mapping = df_data.groupby(["ww_id"]).agg(
-        {
-            "parameter": lambda x: sorted(x.unique()),
-            "date": lambda x: list(x.dt.year.unique()),
-            "depth": lambda x: sorted(x.dropna().unique()),
-        }
-    )
-    ...
-    df_mapping = (
-        df_mapping.merge(
-            df_site.loc[:, ["ww_id", "wbid", "wb_type", "site_descr", "lat_dd", "lon_dd"]],
-            left_index=True,
-            right_on="ww_id",
-            how="left",
-        )
-        .loc[
-            :,
-            [
-                "ww_id",
-                "wbid",
-                "wb_type",
-                "site_descr",
-                "lat_dd",
-                "lon_dd",
-                "parameter",
-                "date",
-                "depth",
-            ],
-        ]
-        .rename(columns={"parameter": "parameters", "date": "years", "depth": "depths"})
-    )
+    # Distinct values of each site in display order, sorted
+    df_data = df_data.assign(year=df_data["date"].dt.year)
+    distinct = {
+        "parameters": (distinct_values(df_data, "parameter"), "parameter", 4),
+        "years": (distinct_values(df_data, "year"), "year", 8),
+        "depths": (distinct_values(df_data, "depth", dropna=True), "depth", 10),
+    }
+    sites = df_data.groupby(["ww_id"], observed=True).size().index
 
     # Convert lists to strings for maping display
-    df_mapping_out = df_mapping.assign(
-        parameters=df_mapping["parameters"].apply(list_to_string),
-        years=df_mapping["years"].apply(partial(list_to_string, wrap=8)),
-        depths=df_mapping["depths"].apply(partial(list_to_string, wrap=10)),
+    df_mapping = pd.DataFrame(
+        {
+            name: join_values(df_distinct, column, sites, wrap=wrap)
+            for name, (df_distinct, column, wrap) in distinct.items()
+        },
+        index=sites,
     )
+    df_mapping_out = df_mapping.merge(
+        df_site.loc[:, ["ww_id", "wbid", "wb_type", "site_descr", "lat_dd", "lon_dd"]],
+        left_index=True,
+        right_on="ww_id",
+        how="left",
+    ).loc[
+        :,
+        [
+            "ww_id",
+            "wbid",
+            "wb_type",
+            "site_descr",
+            "lat_dd",
+            "lon_dd",
+            "parameters",
+            "years",
+            "depths",
+        ],
+    ]
 
-    date_str = datetime.now().strftime("%Y%m%d")
+    date_str = tag or datetime.now().strftime("%Y%m%d")
     df_mapping_out.to_csv(output_path / f"site_summary_{date_str}.csv", index=False)
 
+    if structured:
+        df_lists = pd.DataFrame(
+            {
+                f"{name}_list": list_values(df_distinct, column, sites)
+                for name, (df_distinct, column, _) in distinct.items()
+            },
+            index=sites,
+        )
+        df_structured = df_mapping_out.merge(
+            df_lists, left_on="ww_id", right_index=True, how="left"
+        )
+        df_structured.to_parquet(output_path / f"site_summary_{date_str}.parquet", index=False)
+
 
 if __name__ == "__main__":
     mapping_data()
@@ -0,0 +1,347 @@
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from wrwc.config import WORKERS
+from wrwc.instrumentation import instrumented
+from wrwc.parallel import map_site_shards
+from wrwc.schema import unit_allowed
+from wrwc.sites import brackish_sites
+
+BACTERIA_PARAMETERS = ["Enterococci", "E.coli", "Fecal Coliform"]
+
+
+@dataclass(frozen=True)
+class DerivedParameter:
+    """
+    A parameter calculated from measured parameters.
+
+    compute receives the wide frame of its own inputs, indexed by (ww_id, date) with one column
+    per input and a row for each date with any input, and returns a series of values indexed
+    by (ww_id, date).
+    """
+
+    name: str
+    inputs: tuple[str, ...]
+    compute: Callable[[pd.DataFrame], pd.Series]
+    unit: str | None = None  # Unit of the first input if None
+
+
+DERIVED_PARAMETERS: dict[str, DerivedParameter] = {}
+
+
+def derived_parameter(name: str, inputs: list[str], unit: str | None = None):
+    """
+    Registers a function as the calculation of a derived parameter.
+
+    :param name: Name of the derived parameter
+    :param inputs: Measured parameters required by the calculation
+    :param unit: Unit of the derived parameter, the unit of the first input if None
+    :return: Decorator that registers the function
+    """
+
+    def register(compute: Callable[[pd.DataFrame], pd.Series]):
+        DERIVED_PARAMETERS[name] = DerivedParameter(name, tuple(inputs), compute, unit)
+        return compute
+
+    return register
+
+
+def interpolate_by_group(values: pd.Series, keys: list) -> pd.Series:
+    """
+    Linearly interpolates missing values between neighbours in the same group.
+
+    Equivalent to interpolating each group with Series.interpolate(method="linear"), which
+    treats the values as equally spaced: values before the first valid value stay missing and
+    values after the last valid value take the last valid value. Rows must be ordered within
+    each group. All groups are filled at once with grouped forward and backward fills.
+
+    :param values: Values to interpolate
+    :param keys: Group keys aligned with values
+    :return: Interpolated values
+    """
+    position = values.groupby(keys, observed=True).cumcount().astype(float)
+    valid_position = position.where(values.notna())
+
+    prev_position = valid_position.groupby(keys, observed=True).ffill()
+    next_position = valid_position.groupby(keys, observed=True).bfill()
+    prev_value = values.groupby(keys, observed=True).ffill()
+    next_value = values.groupby(keys, observed=True).bfill()
+
+    slope = (next_value - prev_value) / (next_position - prev_position)
+    interpolated = slope * (position - prev_position) + prev_value
+
+    return values.fillna(interpolated).fillna(prev_value)
+
+
+def fill_temperature(df_wide: pd.DataFrame) -> pd.Series:
+    """
+    Interpolates missing temperature.
+
+    The sites are grouped by site and month. The missing values are interpolated between years
+    at the same site and during the same month. e.g. if May 2008 was missing it would use the
+    average between May 2007 and 2009.
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :return: Filled temperature aligned with df_wide
+    """
+    # Sort by site and month so each group's samples are contiguous and in date order
+    df_sorted = (
+        df_wide["Temperature"]
+        .reset_index()
+        .assign(month=lambda x: x["date"].dt.month)
+        .sort_values(by=["ww_id", "month", "date"])
+    )
+    filled = interpolate_by_group(
+        df_sorted["Temperature"], [df_sorted["ww_id"], df_sorted["month"]]
+    )
+    return pd.Series(filled.sort_index().to_numpy(), index=df_wide.index)
+
+
+def fill_salinity(df_wide: pd.DataFrame, median_salinity: float | None = None) -> pd.Series:
+    """
+    Fills missing salinity with the median salinity for brackish sites and 0 for freshwater.
+
+    Brackish sites are flagged in the site registry.
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :param median_salinity: Median salinity of brackish sites, from df_wide if None
+    :return: Filled salinity aligned with df_wide
+    """
+    salinity = df_wide["Salinity, (ppt)"]
+    m_brackish_sites = df_wide.index.get_level_values("ww_id").isin(brackish_sites())
+    if median_salinity is None:
+        median_salinity = salinity[m_brackish_sites].median()
+    fill_value = np.where(m_brackish_sites, median_salinity, 0.0)
+    return salinity.fillna(pd.Series(fill_value, index=salinity.index))
+
+
+# Missing inputs filled before a derivation is calculated
+INPUT_FILLS = {
+    "Temperature": fill_temperature,
+    "Salinity, (ppt)": fill_salinity,
+}
+
+
+@derived_parameter(
+    "Dissolved Oxygen Saturation",
+    inputs=["Dissolved Oxygen", "Temperature", "Salinity, (ppt)"],
+    unit="percent",
+)
+def dissolved_oxygen_saturation(df_wide: pd.DataFrame) -> pd.Series:
+    """
+    Calculates dissolved oxygen saturation.
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :return: Percent saturation of dissolved oxygen
+    """
+    from gsw import O2sol  # Slow to import and only needed here
+
+    # Calculate maximum dissolved oxygen at salinity, pressure, and temperature.
+    # Scalar arguments are broadcast by gsw in a single call.
+    do_max = O2sol(
+        SA=df_wide["Salinity, (ppt)"].to_numpy(),  # Assumes ppt is close enough to SA in g/kg
+        CT=df_wide["Temperature"].to_numpy(),
+        p=0,  # Assume 1 atm
+        lat=41.8246,  # Providence coordinates
+        lon=-71.418884,
+    ) * (31.998 * 1e-3)  # Convert from umol/kg to mg/l
+
+    return df_wide["Dissolved Oxygen"] / do_max * 100
+
+
+@derived_parameter(
+    "Un-ionized Ammonia",
+    inputs=["Nitrogen, Ammonia", "pH", "Temperature"],
+    unit="mg/l",
+)
+def unionized_ammonia(df_wide: pd.DataFrame) -> pd.Series:
+    """
+    Calculates un-ionized ammonia from total ammonia, pH, and temperature (Emerson et al., 1975).
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :return: Un-ionized ammonia in the unit of total ammonia
+    """
+    pka = 0.09018 + 2729.92 / (df_wide["Temperature"] + 273.15)
+    fraction = 1 / (1 + 10 ** (pka - df_wide["pH"]))
+    return df_wide["Nitrogen, Ammonia"] * fraction
+
+
+@derived_parameter(
+    "TN:TP Ratio",
+    inputs=["Nitrogen, Total", "Phosphorus, Total"],
+    unit="molar ratio",
+)
+def tn_tp_ratio(df_wide: pd.DataFrame) -> pd.Series:
+    """
+    Calculates the molar ratio of total nitrogen (mg/l) to total phosphorus (ug/l).
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :return: Molar TN:TP ratio
+    """
+    nitrogen = df_wide["Nitrogen, Total"] / 14.007  # mmol/l
+    phosphorus = df_wide["Phosphorus, Total"] * 1e-3 / 30.974  # mmol/l
+    return nitrogen / phosphorus
+
+
+def monthly_geometric_mean(df_wide: pd.DataFrame, parameter: str) -> pd.Series:
+    """
+    Calculates the geometric mean of each site's samples in each calendar month.
+
+    Counts below 1 are set to 1 so the logarithm is defined.
+
+    :param df_wide: Wide frame indexed by (ww_id, date)
+    :param parameter: Parameter to average
+    :return: Geometric means indexed by (ww_id, date) with the date at the start of the month
+    """
+    values = df_wide[parameter].dropna().clip(lower=1)
+    ww_id = values.index.get_level_values("ww_id")
+    month = values.index.get_level_values("date").to_period("M").to_timestamp()
+    log_mean = np.log(values).groupby([ww_id, month], observed=True).mean()
+    return np.exp(log_mean).rename_axis(["ww_id", "date"])
+
+
+def geometric_mean_parameter(parameter: str) -> str:
+    """Name of the derived monthly geometric mean of a bacteria parameter."""
+    return f"{parameter} Geometric Mean"
+
+
+for bacteria in BACTERIA_PARAMETERS:
+    derived_parameter(geometric_mean_parameter(bacteria), inputs=[bacteria])(
+        partial(monthly_geometric_mean, parameter=bacteria)
+    )
+
+
+def wide_inputs(df: pd.DataFrame, inputs: list[str]) -> pd.DataFrame:
+    """
+    Pivots derivation inputs to a wide frame.
+
+    :param df: Concentration data indexed by date
+    :param inputs: Parameters to pivot
+    :return: Wide frame indexed by (ww_id, date) with one column per input, mean of duplicates
+    """
+    m = df["parameter"].isin(inputs)
+    df_wide = (
+        df.loc[m, ["ww_id", "parameter", "concentration"]]
+        .reset_index()
+        .pivot_table(
+            index=["ww_id", "date"], columns="parameter", values="concentration", observed=True
+        )
+        .reindex(columns=inputs)
+        .sort_index()
+    )
+    df_wide.columns = list(df_wide.columns)
+    return df_wide
+
+
+def brackish_median_salinity(df: pd.DataFrame) -> float:
+    """Median salinity of brackish sites, as used by fill_salinity."""
+    m = df["ww_id"].isin(brackish_sites())
+    return wide_inputs(df[m], ["Salinity, (ppt)"])["Salinity, (ppt)"].median()
+
+
+def derived_values(
+    df: pd.DataFrame, parameters: list[str], median_salinity: float | None = None
+) -> list[pd.Series]:
+    """
+    Calculates the values of derived parameters.
+
+    Apart from the median salinity of brackish sites, which can be given, the values of a site
+    only depend on the rows of that site.
+
+    :param df: Concentration data indexed by date
+    :param parameters: Names of derived parameters
+    :param median_salinity: Median salinity of brackish sites, see fill_salinity
+    :return: Series of values indexed by (ww_id, date) for each derived parameter
+    """
+    derived = [DERIVED_PARAMETERS[name] for name in parameters]
+    df_wide = wide_inputs(df, sorted({p for d in derived for p in d.inputs}))
+    fills = {
+        **INPUT_FILLS,
+        "Salinity, (ppt)": partial(fill_salinity, median_salinity=median_salinity),
+    }
+
+    values = []
+    for d in derived:
+        # Only the dates of the derivation's own inputs, temperature is interpolated by position
+        # so the dates of other inputs would change it
+        df_inputs = df_wide[list(d.inputs)].dropna(how="all")
+
+        # Fill in missing values
+        for parameter, fill in fills.items():
+            if parameter in df_inputs.columns:
+                df_inputs[parameter] = fill(df_inputs)
+
+        values.append(d.compute(df_inputs).dropna())
+    return values
+
+
+@instrumented()
+def calculate_derived_parameters(
+    df: pd.DataFrame, parameters: list[str] | None = None, workers: int = WORKERS
+) -> pd.DataFrame:
+    """
+    Calculates derived parameters and appends them to the concentration data.
+
+    The inputs of all derivations are pivoted to a wide frame once. Each derivation is
+    calculated on the columns of its own inputs, on the dates with any of them, after filling
+    missing inputs. Derivations with missing inputs give no rows. Input rows with a unit not
+    allowed for the parameter are left out, see schema.ALLOWED_UNITS.
+
+    With more than one worker, sites are split between worker processes and only the rows of
+    derivation inputs are sent to them. The result is the same as with one worker.
+
+    :param df: Concentration data indexed by date
+    :param parameters: Names of derived parameters to calculate, all registered if None
+    :param workers: Number of worker processes, see parallel.map_site_shards
+    :return: Concentration data with the derived parameters appended as rows
+    """
+    parameters = list(parameters or DERIVED_PARAMETERS)
+    derived = [DERIVED_PARAMETERS[name] for name in parameters]
+
+    inputs = {p for d in derived for p in d.inputs}
+    df_inputs = df.loc[
+        df["parameter"].isin(inputs), ["ww_id", "parameter", "unit", "concentration"]
+    ]
+    df_inputs = df_inputs[unit_allowed(df_inputs["parameter"], df_inputs["unit"]).to_numpy()]
+    df_inputs = df_inputs.drop(columns="unit")
+
+    if workers <= 1:
+        values = derived_values(df_inputs, parameters)
+    else:
+        shard_values = map_site_shards(
+            derived_values,
+            df_inputs,
+            parameters,
+            median_salinity=brackish_median_salinity(df_inputs),
+            workers=workers,
+        )
+        # Values are sorted by site and date, shards hold whole sites
+        values = [
+            pd.concat([v[i] for v in shard_values]).sort_index() for i in range(len(derived))
+        ]
+
+    # Calculate derived values as long rows
+    df_derived = [
+        v.rename("concentration")
+        .reset_index()
+        .assign(
+            sample_type="Water",
+            depth=0.0,
+            parameter=d.name,
+            unit=d.unit or _parameter_unit(df, d.inputs[0]),
+        )
+        for d, v in zip(derived, values)
+    ]
+
+    # Append calculated values
+    return pd.concat([df, *(d.set_index("date") for d in df_derived)], axis=0)
+
+
+def _parameter_unit(df: pd.DataFrame, parameter: str) -> str | None:
+    """Most common unit of a parameter in the concentration data."""
+    units = df.loc[df["parameter"] == parameter, "unit"].mode()
+    return units.iloc[0] if len(units) else None
@@ -0,0 +1,204 @@
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import functools
+import threading
+import time
+import tracemalloc
+
+from loguru import logger
+import pandas as pd
+
+from wrwc.config import SPAN_LOG_PATH
+
+try:
+    import resource
+except ImportError:  # Not available on windows
+    resource = None
+
+_local = threading.local()
+
+
+@dataclass
+class Span:
+    """
+    Measurements of a pipeline stage.
+
+    Memory is measured as the resident set size (RSS) of the process after the stage, the growth
+    of the peak RSS during the stage, and the change in traced allocations if tracemalloc is
+    tracing.
+    """
+
+    name: str
+    depth: int = 0  # Number of enclosing spans
+    rows_in: int | None = None
+    rows_out: int | None = None
+    seconds: float | None = None
+    rss_mb: float | None = None
+    peak_rss_growth_mb: float | None = None
+    alloc_mb: float | None = None
+    note: str | None = None
+
+
+def _rss_mb() -> float | None:
+    """Current resident set size, only available on linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * resource.getpagesize() / 1024**2
+
+
+def _peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _traced_mb() -> float | None:
+    return tracemalloc.get_traced_memory()[0] / 1024**2 if tracemalloc.is_tracing() else None
+
+
+def count_rows(obj) -> int | None:
+    """Number of rows in a dataframe, series, or tuple or list of them, else None."""
+    if isinstance(obj, pd.DataFrame | pd.Series):
+        return len(obj)
+    if (
+        isinstance(obj, tuple | list)
+        and obj
+        and all(isinstance(o, pd.DataFrame | pd.Series) for o in obj)
+    ):
+        return sum(len(o) for o in obj)
+    return None
+
+
+def _difference(after, before):
+    return None if after is None or before is None else round(after - before, 1)
+
+
+@contextmanager
+def span(name: str, rows_in: int | None = None) -> Iterator[Span]:
+    """
+    Measures a pipeline stage.
+
+    The span is logged at debug level with its measurements bound as the "span" extra, and added
+    to the spans being collected in the current thread, see collect_spans. Set rows_out and
+    note on the yielded span to record them.
+
+    :param name: Stage name
+    :param rows_in: Number of input rows
+    :return: Context manager yielding the span
+    """
+    depth = getattr(_local, "depth", 0)
+    s = Span(name, depth=depth, rows_in=rows_in)
+    peak_before = _peak_rss_mb()
+    traced_before = _traced_mb()
+
+    _local.depth = depth + 1
+    start = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.seconds = round(time.perf_counter() - start, 4)
+        _local.depth = depth
+        rss = _rss_mb()
+        s.rss_mb = None if rss is None else round(rss, 1)
+        s.peak_rss_growth_mb = _difference(_peak_rss_mb(), peak_before)
+        s.alloc_mb = _difference(_traced_mb(), traced_before)
+        _record(s)
+
+
+def _record(s: Span):
+    counted = s.rows_in is not None or s.rows_out is not None
+    rows = f", rows {s.rows_in} -> {s.rows_out}" if counted else ""
+    logger.bind(span=asdict(s)).debug(
+        f"{'  ' * s.depth}{s.name}: {s.seconds:.3f} s{rows}, rss {s.rss_mb} MB "
+        f"(peak +{s.peak_rss_growth_mb} MB){f', {s.note}' if s.note else ''}"
+    )
+    for collector in getattr(_local, "collectors", []):
+        collector.append(s)
+
+
+def instrumented(name: str | None = None) -> Callable:
+    """
+    Decorates a function to run in a span.
+
+    Input rows are counted from the first dataframe argument and output rows from the result.
+
+    :param name: Stage name, the function name if None
+    :return: Decorator
+    """
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            df_in = next((a for a in (*args, *kwargs.values()) if count_rows(a) is not None), None)
+            with span(name or func.__name__, rows_in=count_rows(df_in)) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = count_rows(result)
+            return result
+
+        return wrapper
+
+    return decorate
+
+
+@contextmanager
+def collect_spans() -> Iterator[list[Span]]:
+    """
+    Collects the spans completed in the current thread, e.g. during a Streamlit rerun.
+
+    :return: Context manager yielding the list spans are added to
+    """
+    spans = []
+    collectors = getattr(_local, "collectors", [])
+    _local.collectors = [*collectors, spans]
+    try:
+        yield spans
+    finally:
+        _local.collectors = collectors
+
+
+def spans_table(spans: list[Span]) -> pd.DataFrame:
+    """
+    Tabulates spans in the order they started, with names indented by nesting depth.
+
+    :param spans: Spans in the order they completed
+    :return: Dataframe with one row per span
+    """
+    columns = [f.name for f in Span.__dataclass_fields__.values()]
+    df = pd.DataFrame([asdict(s) for s in spans], columns=columns).astype(
+        {"rows_in": "Int64", "rows_out": "Int64"}
+    )
+    if df.empty:
+        return df
+
+    df = df.iloc[_start_order(spans, list(range(len(spans))))]
+    return df.assign(name=df["depth"].map(lambda d: "  " * d) + df["name"]).reset_index(drop=True)
+
+
+def _start_order(spans: list[Span], positions: list[int]) -> list[int]:
+    """
+    Orders spans by start, given their positions in completion order.
+
+    A span completes after the spans it encloses, so each span is moved before the spans of the
+    next level that completed since its preceding sibling.
+    """
+    if not positions:
+        return []
+    top = min(spans[i].depth for i in positions)
+    result, children = [], []
+    for i in positions:
+        if spans[i].depth == top:
+            result.extend([i, *_start_order(spans, children)])
+            children = []
+        else:
+            children.append(i)
+    return result + _start_order(spans, children)
+
+
+if SPAN_LOG_PATH:
+    # Structured log of all spans, one json record per line
+    logger.add(SPAN_LOG_PATH, level="DEBUG", serialize=True, filter=lambda r: "span" in r["extra"])
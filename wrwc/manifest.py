@@ -0,0 +1,116 @@
+from datetime import datetime
+import hashlib
+import json
+from pathlib import Path
+
+import pandas as pd
+
+# Files starting with an underscore are ignored when pyarrow discovers a dataset
+MANIFEST_NAME = "_manifest.json"
+
+
+def file_sha256(path: Path, block_size: int = 1 << 20) -> str:
+    """
+    Computes the sha256 hash of a file's contents.
+
+    :param path: Path to file
+    :param block_size: Number of bytes to read at a time
+    :return: Hex digest of the file contents
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+def data_fingerprint(path: Path) -> str:
+    """
+    Computes a fingerprint of processed data that changes when the data changes.
+
+    Files are hashed by content. Parquet stores are fingerprinted by the name, size and
+    modification time of each file, since their files are replaced rather than edited in place.
+
+    :param path: Path to a file or a parquet store directory
+    :return: Hex digest identifying the data
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return file_sha256(path)
+
+    h = hashlib.sha256()
+    for file in sorted(p for p in path.rglob("*") if p.is_file()):
+        stat = file.stat()
+        h.update(f"{file.relative_to(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def row_hashes(df: pd.DataFrame) -> pd.Series:
+    """
+    Hashes each row of a raw dataframe.
+
+    Identical rows are disambiguated by their occurrence number so duplicated samples are
+    tracked individually.
+
+    :param df: Raw dataframe
+    :return: Series of uint64 row hashes
+    """
+    h = pd.util.hash_pandas_object(df, index=False)
+    occurrence = h.groupby(h).cumcount()
+    return pd.util.hash_pandas_object(
+        pd.DataFrame({"hash": h.values, "occurrence": occurrence.values}), index=False
+    ).set_axis(df.index)
+
+
+def input_record(
+    path: Path, rows: int, max_date: pd.Timestamp | None = None, sha256: str | None = None
+) -> dict:
+    """
+    Creates a manifest record of a processed input file.
+
+    :param path: Path to input file
+    :param rows: Number of rows in the input file
+    :param max_date: Latest sample date in the input file
+    :param sha256: Content hash of the input file, computed if None
+    :return: Dictionary describing the input file
+    """
+    return {
+        "path": str(path),
+        "sha256": sha256 or file_sha256(path),
+        "rows": int(rows),
+        "max_date": None if max_date is None or pd.isna(max_date) else str(max_date.date()),
+    }
+
+
+def read_manifest(store_path: Path) -> dict | None:
+    """
+    Reads the manifest of a processed data store.
+
+    :param store_path: Directory of the parquet store
+    :return: Manifest dictionary or None if the store has no manifest
+    """
+    manifest_path = Path(store_path) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(store_path: Path, inputs: dict, rows: int, partition_cols: list[str]):
+    """
+    Writes the manifest of a processed data store.
+
+    :param store_path: Directory of the parquet store
+    :param inputs: Input records keyed by input name, see input_record
+    :param rows: Number of rows in the store
+    :param partition_cols: Columns the store is partitioned by
+    :return: None
+    """
+    manifest = {
+        "updated": datetime.now().isoformat(timespec="seconds"),
+        "rows": int(rows),
+        "partition_cols": list(partition_cols),
+        "inputs": inputs,
+    }
+    with open(Path(store_path) / MANIFEST_NAME, "w") as f:
+        json.dump(manifest, f, indent=2)
@@ -0,0 +1,112 @@
+import atexit
+from collections.abc import Callable
+import heapq
+import multiprocessing
+from multiprocessing.pool import Pool
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+from wrwc.config import WORKERS
+
+# Shards per worker, more shards even out the work when site sizes are skewed
+SHARDS_PER_WORKER = 4
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def site_shards(ww_id: pd.Series, n_shards: int) -> list[np.ndarray]:
+    """
+    Splits rows into shards of whole sites with about the same number of rows.
+
+    Sites are assigned largest first to the shard with the fewest rows, with ties broken by
+    ww_id, so the shards only depend on the data.
+
+    :param ww_id: Site of each row
+    :param n_shards: Maximum number of shards
+    :return: Row positions of each non-empty shard, in row order, rows without a site are in the
+        first shard
+    """
+    sizes = ww_id.value_counts(sort=False)
+    sizes = sizes[sizes > 0]
+    order = sorted(zip(-sizes.to_numpy(), sizes.index.astype(str), sizes.index))
+
+    shards = [(0, i) for i in range(min(n_shards, len(order)))]
+    shard_of = {}
+    for negative_size, _, site in order:
+        rows, i = heapq.heappop(shards)
+        shard_of[site] = i
+        heapq.heappush(shards, (rows - negative_size, i))
+
+    shard = ww_id.map(shard_of).astype(float).fillna(0).to_numpy()
+    return [positions for i in range(len(shards)) if len(positions := np.flatnonzero(shard == i))]
+
+
+def _in_streamlit_server() -> bool:
+    """
+    Whether this is a Streamlit server process.
+
+    Spawned processes import the __main__ module of their parent, and Streamlit runs each page
+    as __main__, so the page would run in every worker.
+    """
+    runtime = sys.modules.get("streamlit.runtime")
+    return runtime is not None and runtime.exists()
+
+
+def process_pool(workers: int) -> Pool:
+    """
+    Worker processes kept for the life of the process, so each call doesn't pay their startup.
+
+    Workers are spawned rather than forked, which is safe in threaded processes, and all are
+    started when the pool is created. The pool is replaced when the number of workers changes.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool_workers != workers:
+            _close_pool()
+            _pool = multiprocessing.get_context("spawn").Pool(workers)
+            _pool_workers = workers
+        return _pool
+
+
+@atexit.register
+def _close_pool():
+    global _pool, _pool_workers
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+    _pool, _pool_workers = None, None
+
+
+def map_site_shards(
+    func: Callable, df: pd.DataFrame, *args, workers: int = WORKERS, **kwargs
+) -> list:
+    """
+    Calls func on shards of whole sites in parallel worker processes.
+
+    func must only combine rows of the same site (ww_id column) and be importable by the
+    workers. Results are returned in shard order whatever order the workers finish in, so
+    merging them is deterministic.
+
+    Sites are not sharded in a Streamlit server process, where func is called once on all of df
+    whatever the number of workers. The app reads products computed in parallel by the pipeline
+    from the cache instead.
+
+    :param func: Function called as func(df_shard, *args, **kwargs)
+    :param df: Data with a ww_id column
+    :param workers: Number of worker processes, func is called once on all of df if 1
+    :return: List of results, one per shard
+    """
+    if workers <= 1 or _in_streamlit_server():
+        return [func(df, *args, **kwargs)]
+
+    shards = site_shards(df["ww_id"], workers * SHARDS_PER_WORKER)
+    if len(shards) <= 1:
+        return [func(df, *args, **kwargs)]
+    pool = process_pool(workers)
+    results = [pool.apply_async(func, (df.iloc[p], *args), kwargs) for p in shards]
+    return [result.get() for result in results]
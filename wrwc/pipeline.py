@@ -0,0 +1,316 @@
+"""
+Runs the data pipeline, skipping stages whose inputs are unchanged since their last run.
+
+Stages declare their input and output paths, and a stage depends on the stages that write its
+inputs. Stages whose dependencies are done run in parallel:
+
+    python -m wrwc.pipeline run
+    python -m wrwc.pipeline run site_summary --force
+    python -m wrwc.pipeline status
+
+Outputs have stable names, so the app and nightly refreshes don't depend on the run date.
+"""
+
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from typing import Annotated
+
+from loguru import logger
+import typer
+
+from wrwc.config import (
+    CSO_PATH,
+    INTERIM_DATA_DIR,
+    PROCESSED_DATA_DIR,
+    PROJ_ROOT,
+    RAW_DATA_DIR,
+    SITE_GROUP,
+    SITE_REGISTRY_PATH,
+)
+from wrwc.instrumentation import span
+from wrwc.manifest import data_fingerprint
+from wrwc.store import INCREMENTAL_STORE_NAME, LATEST_TAG
+
+RAW_DATA_PATH = RAW_DATA_DIR / "WoonasquatucketData.csv"
+SITE_INFO_PATH = RAW_DATA_DIR / "SiteInfo.csv"
+STORE_PATH = PROCESSED_DATA_DIR / INCREMENTAL_STORE_NAME
+SITE_SUMMARY_PATH = PROCESSED_DATA_DIR / f"site_summary_{LATEST_TAG}.csv"
+
+# Input fingerprints of the last successful run of each stage
+STATE_PATH = INTERIM_DATA_DIR / "pipeline_state.json"
+
+app = typer.Typer()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A pipeline stage.
+
+    :param name: Stage name
+    :param run: Function running the stage, called without arguments in a worker process
+    :param inputs: Paths read by the stage
+    :param outputs: Paths written by the stage, the stage runs if any are missing
+    """
+
+    name: str
+    run: Callable[[], None]
+    inputs: tuple[Path, ...]
+    outputs: tuple[Path, ...] = ()
+
+
+def _concentration():
+    from wrwc.dataset import concentration_data
+
+    concentration_data(RAW_DATA_PATH, PROCESSED_DATA_DIR, SITE_INFO_PATH, incremental=True)
+
+
+def _site_summary():
+    from wrwc.dataset import mapping_data
+
+    mapping_data(STORE_PATH, PROCESSED_DATA_DIR, SITE_INFO_PATH, tag=LATEST_TAG)
+
+
+def _app_cache():
+    # Builds the app's cached products so the first page load after a refresh is fast
+    from streamlit_app import data_processing
+
+    from wrwc.sites import group_sites
+
+    sites = group_sites(SITE_GROUP)
+    data_processing.get_monthly_cube(sites, STORE_PATH)
+    data_processing.get_trends(sites, STORE_PATH)
+    data_processing.get_monthly_exceedances(sites, STORE_PATH)
+    data_processing.get_rolling_geometric_means(sites, STORE_PATH)
+    data_processing.get_monthly_count_data(sites, STORE_PATH)
+    data_processing.get_box_statistics(sites, STORE_PATH)
+    data_processing.get_cso_layer(CSO_PATH)
+
+
+STAGES = [
+    Stage("concentration", _concentration, (RAW_DATA_PATH, SITE_INFO_PATH), (STORE_PATH,)),
+    Stage("site_summary", _site_summary, (STORE_PATH, SITE_INFO_PATH), (SITE_SUMMARY_PATH,)),
+    Stage("app_cache", _app_cache, (STORE_PATH, SITE_REGISTRY_PATH, CSO_PATH)),
+]
+
+
+def dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """
+    Finds the stages each stage depends on, the stages writing its inputs.
+
+    :param stages: Pipeline stages
+    :return: Names of the stages each stage depends on, keyed by stage name
+    """
+    writers = {path: stage.name for stage in stages for path in stage.outputs}
+    return {
+        stage.name: {writers[path] for path in stage.inputs if path in writers} for stage in stages
+    }
+
+
+def select_stages(stages: list[Stage], names: list[str] | None) -> list[Stage]:
+    """
+    Selects stages and the stages they depend on, in pipeline order.
+
+    :param stages: Pipeline stages
+    :param names: Names of the stages to select, all stages if None or empty
+    :return: Selected stages
+    """
+    if not names:
+        return list(stages)
+    unknown = set(names) - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    deps = dependencies(stages)
+    selected, pending = set(), list(names)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+def fingerprint(path: Path, method: str = "mtime") -> str | None:
+    """
+    Fingerprints a stage input.
+
+    Files are fingerprinted by size and modification time, or by content hash. Parquet stores
+    are always fingerprinted by their file listing, see manifest.data_fingerprint.
+
+    :param path: Path to a file or directory
+    :param method: "mtime" or "hash"
+    :return: Fingerprint, None if the path does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+    if method == "hash" or path.is_dir():
+        return data_fingerprint(path)
+    if method == "mtime":
+        stat = path.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    raise ValueError(f"Unknown fingerprint method: {method}")
+
+
+def read_state(state_path: Path = STATE_PATH) -> dict:
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def write_state(state: dict, state_path: Path = STATE_PATH):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    tmp_path.replace(state_path)
+
+
+def input_fingerprints(stage: Stage, method: str = "mtime") -> dict[str, str | None]:
+    return {str(path): fingerprint(path, method) for path in stage.inputs}
+
+
+def is_stale(stage: Stage, state: dict, method: str = "mtime") -> bool:
+    """
+    Checks if a stage needs to run: an input changed since its last run or an output is missing.
+
+    :param stage: Pipeline stage
+    :param state: Pipeline state, see read_state
+    :param method: Fingerprint method, see fingerprint
+    :return: True if the stage needs to run
+    """
+    last = state.get(stage.name)
+    return (
+        last is None
+        or last["method"] != method
+        or last["inputs"] != input_fingerprints(stage, method)
+        or not all(path.exists() for path in stage.outputs)
+    )
+
+
+def run_stage(stage: Stage):
+    with span(f"stage {stage.name}"):
+        stage.run()
+
+
+def run_pipeline(
+    stages: list[Stage],
+    force: bool = False,
+    workers: int = 2,
+    method: str = "mtime",
+    state_path: Path = STATE_PATH,
+) -> dict[str, str]:
+    """
+    Runs stages in dependency order, with independent stages in parallel worker processes.
+
+    A stage is checked for changed inputs once the stages it depends on are done, so it only
+    runs if they changed its inputs. Stages depending on a failed stage are not run.
+
+    :param stages: Stages to run
+    :param force: Run stages even if their inputs are unchanged
+    :param workers: Number of stages run at once
+    :param method: Fingerprint method, see fingerprint
+    :param state_path: Path to the pipeline state
+    :return: Outcome of each stage: "ran", "skipped", "failed" or "blocked"
+    """
+    state = read_state(state_path)
+    deps = {name: d & {s.name for s in stages} for name, d in dependencies(stages).items()}
+    waiting = list(stages)
+    outcomes = {}
+    running = {}
+
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        while waiting or running:
+            for stage in list(waiting):
+                if not deps[stage.name] <= outcomes.keys():
+                    continue
+                waiting.remove(stage)
+                if any(outcomes[d] in ("failed", "blocked") for d in deps[stage.name]):
+                    outcomes[stage.name] = "blocked"
+                elif force or is_stale(stage, state, method):
+                    logger.info(f"Running {stage.name}")
+                    inputs = input_fingerprints(stage, method)
+                    running[pool.submit(run_stage, stage)] = (stage, inputs)
+                else:
+                    logger.info(f"Skipping {stage.name}, inputs are unchanged")
+                    outcomes[stage.name] = "skipped"
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, inputs = running.pop(future)
+                try:
+                    future.result()
+                except Exception:  # noqa: BLE001
+                    # Stages run arbitrary processing, so any error fails the stage and blocks
+                    # its dependents while independent stages carry on
+                    logger.exception(f"Stage {stage.name} failed")
+                    outcomes[stage.name] = "failed"
+                    continue
+                # Fingerprints from before the run, so inputs changed during it rerun next time
+                state[stage.name] = {
+                    "method": method,
+                    "inputs": inputs,
+                    "completed": datetime.now().isoformat(timespec="seconds"),
+                }
+                write_state(state, state_path)
+                outcomes[stage.name] = "ran"
+
+    return outcomes
+
+
+@app.command()
+def run(
+    stages: Annotated[
+        list[str] | None, typer.Argument(help="Stages to run with their dependencies")
+    ] = None,
+    force: Annotated[
+        bool, typer.Option(help="Run stages even if their inputs are unchanged")
+    ] = False,
+    workers: Annotated[int, typer.Option(help="Number of stages run at once")] = 2,
+    check: Annotated[
+        str, typer.Option(help="Detect changed inputs by 'mtime' or 'hash'")
+    ] = "mtime",
+    site_workers: Annotated[
+        int | None, typer.Option(help="Worker processes per stage for per-site work")
+    ] = None,
+):
+    logger.info(f"PROJ_ROOT path is: {PROJ_ROOT}")
+    if site_workers is not None:
+        # Read from the config by the stage processes, see parallel.map_site_shards
+        os.environ["WRWC_WORKERS"] = str(site_workers)
+    outcomes = run_pipeline(select_stages(STAGES, stages), force, workers, check)
+    for name, outcome in outcomes.items():
+        logger.info(f"{name}: {outcome}")
+    if any(outcome in ("failed", "blocked") for outcome in outcomes.values()):
+        raise typer.Exit(1)
+
+
+@app.command()
+def status(
+    check: Annotated[
+        str, typer.Option(help="Detect changed inputs by 'mtime' or 'hash'")
+    ] = "mtime",
+):
+    state = read_state()
+    deps = dependencies(STAGES)
+    for stage in STAGES:
+        last = state.get(stage.name, {}).get("completed", "never")
+        stale = "stale" if is_stale(stage, state, check) else "up to date"
+        after = f", after {', '.join(sorted(deps[stage.name]))}" if deps[stage.name] else ""
+        print(f"{stage.name}: {stale}, last run {last}{after}")
+
+
+if __name__ == "__main__":
+    app()
@@ -1,6 +1,8 @@
 
 import plotly.express as px
 
+from wrwc.thresholds import classify_site, parameter_thresholds
+
 
 def plot_timeseries(df_mean, site, parameter, log=False):
     m = (df_mean['ww_id'] == site) & (df_mean['parameter'] == parameter)
@@ -25,12 +27,8 @@ def plot_timeseries(df_mean, site, parameter, log=False):
                   title=f'Site {site}'
                   )
 
-    match parameter:
-        case 'Phosphorus, Total':
-            fig.add_hline(y=25,  line_dash="dash", line_color="red")
-        case 'Enterococci':
-            fig.add_hline(y=54,  line_dash="dash", line_color="red")
-            fig.add_hline(y=33,  line_dash="dash", line_color="darkred")
+    for threshold in parameter_thresholds(parameter, classify_site(site)):
+        fig.add_hline(y=threshold.value, line_dash="dash", line_color=threshold.color)
 
     fig.show()
 
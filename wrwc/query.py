@@ -0,0 +1,133 @@
+"""
+SQL queries of the processed data in an in-process DuckDB database.
+
+DuckDB is an optional dependency. It reads the parquet store or csv file directly, pruning
+partitions and reading only the columns and rows a query needs, so aggregates are computed
+without loading the data into memory. Callers fall back to pandas when DuckDB is not
+installed, see use_duckdb.
+"""
+
+from collections.abc import Iterable
+import importlib.util
+from pathlib import Path
+
+import pandas as pd
+
+from wrwc.config import QUERY_ENGINE
+from wrwc.schema import conform
+from wrwc.store import read_processed_data
+
+
+def duckdb_installed() -> bool:
+    return importlib.util.find_spec("duckdb") is not None
+
+
+def use_duckdb(engine: str = QUERY_ENGINE) -> bool:
+    """
+    Checks if queries run in DuckDB.
+
+    :param engine: "duckdb", "pandas", or "auto" for DuckDB when it is installed
+    :return: True if queries run in DuckDB
+    """
+    match engine:
+        case "auto":
+            return duckdb_installed()
+        case "duckdb":
+            if not duckdb_installed():
+                raise ImportError("The duckdb query engine requires the duckdb package")
+            return True
+        case "pandas":
+            return False
+        case _:
+            raise ValueError(f"Unknown query engine: {engine}")
+
+
+def sql_literal(value) -> str:
+    """Quotes a value as an SQL string literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def source_sql(input_path: Path) -> str:
+    """
+    Table function reading processed data, see store.read_processed_data.
+
+    Partition values of a parquet store are read as text.
+
+    :param input_path: Path to parquet store or csv file
+    :return: SQL table function
+    """
+    path = Path(input_path)
+    if path.is_dir():
+        files = sql_literal(path / "**" / "*.parquet")
+        return f"read_parquet({files}, hive_partitioning = true, hive_types_autocast = false)"
+    if path.suffix == ".parquet":
+        return f"read_parquet({sql_literal(path)})"
+    return f"read_csv({sql_literal(path)}, header = true, types = {{'date': 'TIMESTAMP'}})"
+
+
+def where_sql(
+    sites: Iterable[str] | None = None,
+    parameters: Iterable[str] | None = None,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+) -> str:
+    """
+    Condition selecting sites, parameters and dates, see store.read_processed_data.
+
+    :return: SQL condition, true if nothing is selected
+    """
+    conditions = []
+    for column, values in [("ww_id", sites), ("parameter", parameters)]:
+        if values is not None:
+            values = ", ".join(map(sql_literal, values))
+            conditions.append(f"{column} IN ({values})" if values else "false")
+    if start is not None:
+        conditions.append(f"date >= {sql_literal(pd.Timestamp(start))}::TIMESTAMP")
+    if end is not None:
+        conditions.append(f"date <= {sql_literal(pd.Timestamp(end))}::TIMESTAMP")
+    return " AND ".join(conditions) or "true"
+
+
+def query(sql: str, tables: dict[str, pd.DataFrame] | None = None) -> pd.DataFrame:
+    """
+    Runs a query in a new in-memory DuckDB database.
+
+    :param sql: Query, reading processed data with source_sql
+    :param tables: Dataframes the query can read as tables, by table name
+    :return: Query result
+    """
+    import duckdb  # Optional and slow to import
+
+    with duckdb.connect() as con:
+        for name, df in (tables or {}).items():
+            con.register(name, df)
+        return con.execute(sql).df()
+
+
+def read_samples(
+    input_path: Path,
+    sites: Iterable[str] | None = None,
+    parameters: Iterable[str] | None = None,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+    columns: list[str] | None = None,
+    engine: str = QUERY_ENGINE,
+) -> pd.DataFrame:
+    """
+    Reads a slice of the processed concentration data, in DuckDB or pandas.
+
+    :param input_path: Path to parquet store or csv file
+    :param sites: Sites (ww_id) to read, all sites if None
+    :param parameters: Parameters to read, all parameters if None
+    :param start: First sample date to include
+    :param end: Last sample date to include
+    :param columns: Columns to read, all columns if None
+    :param engine: Query engine, see use_duckdb
+    :return: Dataframe of processed concentration data with the dtypes of the schema
+    """
+    if not use_duckdb(engine):
+        return read_processed_data(input_path, sites, parameters, start, end, columns)
+
+    select = ", ".join(f'"{col}"' for col in columns) if columns else "*"
+    where = where_sql(sites, parameters, start, end)
+    return conform(query(f"SELECT {select} FROM {source_sql(input_path)} WHERE {where}"))
@@ -0,0 +1,92 @@
+"""
+Time-based rolling statistics of many series at once.
+
+Rolling sums are differences of cumulative sums, so the windows of all series are computed in
+one pass over the rows sorted by series and time, without grouping by series. The first row
+of each window is found by a binary search on a key combining the series and the time, see
+window_bounds.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def window_bounds(
+    series: np.ndarray, times: np.ndarray, window: pd.Timedelta
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the rows in the window ending at each row.
+
+    Rows must be sorted by series and time. A window covers the times in (t - window, t] of the
+    series, to the second, so rows at the same time are in each other's windows.
+
+    :param series: Series number of each row, from 0
+    :param times: Time of each row, datetime64
+    :param window: Window length
+    :return: First row and the row after the last row of each window
+    """
+    seconds = (times - times.min()) // np.timedelta64(1, "s") if len(times) else times
+    window_seconds = int(window.total_seconds())
+    # Series are spaced further apart than any window, so a window doesn't reach another series
+    key = series * (seconds.max() + window_seconds + 1) + seconds if len(times) else series
+    start = np.searchsorted(key, key - window_seconds, side="right")
+    stop = np.searchsorted(key, key, side="right")
+    return start, stop
+
+
+def rolling_sums(values: np.ndarray, start: np.ndarray, stop: np.ndarray) -> np.ndarray:
+    """Sums of values[start:stop] of each window, as differences of cumulative sums."""
+    cumsum = np.concatenate([[0.0], np.cumsum(values, dtype=float)])
+    return cumsum[stop] - cumsum[start]
+
+
+def rolling_geometric_means(
+    df: pd.DataFrame,
+    keys: list[str],
+    window: str | pd.Timedelta = "30D",
+    time: str = "date",
+    value: str = "concentration",
+    limits: pd.Series | None = None,
+    min_samples: int = 1,
+) -> pd.DataFrame:
+    """
+    Calculates the rolling geometric mean of each series, and the rate of samples in each window
+    exceeding a limit, at each sample time.
+
+    Values below 1 are set to 1 so the logarithm is defined, as in derived.monthly_geometric_mean.
+
+    :param df: Samples with key, time and value columns, missing values are left out
+    :param keys: Columns identifying a series, e.g. ww_id and parameter
+    :param window: Window length ending at each sample time, e.g. "30D"
+    :param time: Time column
+    :param value: Value column
+    :param limits: Limit of each sample, aligned with df, e.g. a single sample threshold.
+        Exceedance rates are missing for samples without a limit.
+    :param min_samples: Fewest samples in a window to calculate its statistics
+    :return: Dataframe with the keys, time, number of samples in the window, geometric mean and
+        exceedance rate, one row per series and sample time
+    """
+    m = df[value].notna() & df[time].notna()
+    df = df.loc[m, [*keys, time, value]].assign(
+        limit=np.nan if limits is None else limits[m].astype(float)
+    )
+    df = df.sort_values([*keys, time], kind="stable", ignore_index=True)
+
+    series = df.groupby(keys, observed=True, sort=False).ngroup().to_numpy()
+    start, stop = window_bounds(series, df[time].to_numpy(), pd.Timedelta(window))
+
+    values = df[value].to_numpy(dtype=float)
+    limit = df["limit"].to_numpy()
+    samples = stop - start
+    log_means = rolling_sums(np.log(np.maximum(values, 1)), start, stop) / samples
+    exceedances = rolling_sums(values > limit, start, stop)
+
+    df_rolling = df[[*keys, time]].assign(
+        samples=samples,
+        geometric_mean=np.exp(log_means),
+        # Rows at the same time share the window, so limits are the same within a series
+        exceedance_rate=np.where(np.isnan(limit), np.nan, exceedances / samples),
+    )
+    # Keep the last row at each time, whose window ends at itself
+    last = stop == np.arange(1, len(df) + 1)
+    return df_rolling[last & (samples >= min_samples)].reset_index(drop=True)
@@ -0,0 +1,175 @@
+"""
+Schema of the raw and processed concentration data.
+
+Columns are read with declared dtypes instead of inferred ones: low cardinality text as
+categoricals, measurements as floats and sample dates parsed with an explicit format. Rows
+that don't fit the schema are found with vectorized checks, see invalid_rows.
+"""
+
+import pandas as pd
+
+from wrwc.config import RAW_DATE_FORMAT
+
+# Dtypes of the raw columns by standardized name, other raw columns are read as text. Sample
+# dates are read as categories and parsed once per distinct value, see parse_dates.
+RAW_DTYPES = {
+    "source.name": "category",
+    "ww_id": "category",
+    "date_of_sample": "category",
+    "time": "category",
+    "sample_type": "category",
+    "sample_media": "category",
+    "depth": "float64",
+    "parameter": "category",
+    "concentration": "float64",
+    "unit": "category",
+    "qualifier_code": "category",
+    "detection_limit": "float64",
+    "detection_limit_unit": "category",
+    "quantitation_level": "float64",
+    "quantitation_level_unit": "category",
+    "lab_name": "category",
+    "analytical_method_number": "category",
+    "sediment_particle_size": "category",
+    "particle_size_unit": "category",
+    "fish_sample_type": "category",
+    "fish_taxa": "category",
+    "monitoring_location": "category",
+    "watershed": "category",
+    "watershed_code": "category",
+}
+
+# Dtypes of the processed columns, see dataset.process_concentration_data
+PROCESSED_DTYPES = {
+    "source.name": "category",
+    "ww_id": "category",
+    "time": "category",
+    "sample_type": "category",
+    "sample_media": "category",
+    "depth": "float64",
+    "parameter": "category",
+    "param_code": "category",
+    "concentration": "float64",
+    "unit": "category",
+    "qualifier_code": "category",
+    "detection_limit": "float64",
+    "detection_limit_unit": "category",
+    "quantitation_level": "float64",
+    "quantitation_level_unit": "category",
+    "lab_name": "category",
+    "analytical_method_number": "category",
+    "monitoring_location": "category",
+    "watershed": "category",
+    "watershed_code": "category",
+    "date": "datetime64[ns]",
+    "wbid": "category",
+    "wb_type": "category",
+    "site_descr": "category",
+    "lat_dd": "float64",
+    "lon_dd": "float64",
+    "row_hash": "uint64",
+}
+
+# Units assumed by the derived parameters and the app's thresholds, after dataset.UNIT_FIXES.
+# The units of other parameters are not checked. Rows in other units are kept, but skipped by
+# the derived parameters, and thresholds only compare rows in their own unit.
+ALLOWED_UNITS = {
+    "Temperature": {"C"},
+    "Dissolved Oxygen": {"mg/l"},
+    "Salinity, (ppt)": {"ppt"},
+    "pH": {"SU"},
+    "Phosphorus, Total": {"ug/l"},
+    "Nitrogen, Total": {"mg/l"},
+    "Nitrogen, Ammonia": {"mg/l"},
+    "Enterococci": {"MPN/100ml"},
+    "E.coli": {"MPN/100ml"},
+    "Fecal Coliform": {"MPN/100ml", "CFU/100ml"},
+}
+
+
+# Problems of rows that can't be placed by site, parameter and date, which are dropped
+PLACEMENT_PROBLEMS = ["missing site", "missing parameter", "missing date", "invalid date"]
+
+# Largest share of rows with an invalid date before the date format is taken to be wrong
+MAX_INVALID_DATE_SHARE = 0.5
+
+
+def parse_dates(s: pd.Series, date_format: str = RAW_DATE_FORMAT) -> pd.Series:
+    """
+    Parses dates with an explicit format, once per distinct value.
+
+    :param s: Date strings, categorical or text
+    :param date_format: strftime format, or "ISO8601"
+    :return: Datetime series aligned with s, NaT where a value is missing or doesn't match
+    """
+    s = s.astype("category")
+    dates = pd.to_datetime(s.cat.categories, format=date_format, errors="coerce")
+    # Missing values have code -1, which takes the NaT appended last
+    dates = dates.append(pd.DatetimeIndex([pd.NaT]))
+    return pd.Series(dates[s.cat.codes.to_numpy()], index=s.index, name=s.name)
+
+
+def conform(df: pd.DataFrame, dtypes: dict[str, str] = PROCESSED_DTYPES) -> pd.DataFrame:
+    """
+    Casts the declared columns of a dataframe to their declared dtypes.
+
+    :param df: Dataframe, columns that are not declared are unchanged
+    :param dtypes: Dtypes by column name
+    :return: Dataframe with the declared dtypes
+    """
+    cast = {
+        col: dtype
+        for col, dtype in dtypes.items()
+        if col in df.columns and df[col].dtype != dtype and dtype != "datetime64[ns]"
+    }
+    df = df.astype(cast)
+    for col, dtype in dtypes.items():
+        if dtype == "datetime64[ns]" and col in df.columns and df[col].dtype != dtype:
+            df[col] = pd.to_datetime(df[col], format="ISO8601")
+    return df
+
+
+def unit_allowed(parameter: pd.Series, unit: pd.Series) -> pd.Series:
+    """
+    Checks units against ALLOWED_UNITS.
+
+    :param parameter: Parameter of each row
+    :param unit: Unit of each row
+    :return: Boolean series, True where the parameter isn't checked or the unit is allowed
+    """
+    pairs = pd.MultiIndex.from_arrays([parameter, unit])
+    allowed = pd.MultiIndex.from_tuples(
+        [(p, u) for p, units in ALLOWED_UNITS.items() for u in units]
+    )
+    checked = parameter.isin(list(ALLOWED_UNITS)).to_numpy()
+    return pd.Series(~checked | pairs.isin(allowed), index=parameter.index)
+
+
+def invalid_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Finds concentration rows that don't fit the schema.
+
+    Rows are checked for a site, parameter and parseable sample date, see PLACEMENT_PROBLEMS,
+    and for a unit allowed for the parameter.
+
+    :param df: Concentration data with the raw date_of_sample and the parsed date column, see
+        dataset.process_concentration_data
+    :return: Boolean column of each problem, with the invalid rows indexed like the rows of df
+    """
+    problems = pd.DataFrame(
+        {
+            "missing site": df["ww_id"].isna(),
+            "missing parameter": df["parameter"].isna(),
+            "missing date": df["date_of_sample"].isna(),
+            "invalid date": df["date_of_sample"].notna() & df["date"].isna(),
+            "unit not allowed": ~unit_allowed(df["parameter"], df["unit"]),
+        }
+    )
+    return problems[problems.any(axis=1)]
+
+
+def describe_problems(problems: pd.DataFrame) -> pd.Series:
+    """Problems of each row joined by "; ", see invalid_rows."""
+    if problems.empty:
+        return pd.Series(dtype=object)
+    return problems.dot(problems.columns + "; ").str.removesuffix("; ")
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
+import pandas as pd
+
+from wrwc.config import SITE_REGISTRY_PATH
+
+# Page titles of the site groups in the registry
+SITE_GROUP_TITLES = {
+    "lower_riverine": "Woonasquatucket River Lower Riverine Sites",
+    "upper_reservoirs": "Woonasquatucket River Upper Watershed Reservoirs",
+}
+
+# Flags of the registry and their value when missing
+REGISTRY_FLAGS = {
+    "brackish": False,  # Salinity is filled with the median of brackish sites instead of 0
+    "cso_study": False,  # Compared before and after the 2015 CSO improvements
+    "year_bins": True,  # Compared across ~4 year bins
+}
+
+# Date of the CSO improvements compared at cso_study sites, unless the registry's cso_date
+# column gives a date for the site
+CSO_DATE = pd.Timestamp("2015-01-01")
+
+
+def read_site_registry(
+    registry_path: Path = SITE_REGISTRY_PATH, df_site: pd.DataFrame | None = None
+) -> pd.DataFrame:
+    """
+    Reads the site registry.
+
+    :param registry_path: Path to site registry csv file with ww_id, name, group, river_order
+        and the flags in REGISTRY_FLAGS, and optionally the cso_date of sites
+    :param df_site: Site info, see dataset.read_site_info, used to fill missing names with the
+        site description
+    :return: Dataframe indexed by ww_id and sorted by group and river order
+    """
+    df_registry = pd.read_csv(registry_path, dtype={"ww_id": str, "name": str, "group": str})
+
+    for flag, default in REGISTRY_FLAGS.items():
+        if flag not in df_registry.columns:
+            df_registry[flag] = default
+        df_registry[flag] = df_registry[flag].fillna(default).astype(bool)
+    if "cso_date" not in df_registry.columns:
+        df_registry["cso_date"] = pd.NaT
+    df_registry["cso_date"] = pd.to_datetime(df_registry["cso_date"], format="ISO8601")
+
+    if df_site is not None:
+        site_descr = df_registry["ww_id"].map(df_site.set_index("ww_id")["site_descr"])
+        df_registry["name"] = df_registry["name"].fillna(site_descr)
+
+    return df_registry.sort_values(by=["group", "river_order"], kind="stable").set_index("ww_id")
+
+
+@lru_cache(maxsize=1)
+def site_registry() -> pd.DataFrame:
+    """The site registry at SITE_REGISTRY_PATH, read once per process."""
+    return read_site_registry()
+
+
+def group_sites(group: str, registry: pd.DataFrame | None = None) -> OrderedDict[str, str]:
+    """
+    Finds the sites of a group.
+
+    :param group: Site group, e.g. "lower_riverine"
+    :param registry: Site registry, the registry at SITE_REGISTRY_PATH if None
+    :return: Site names keyed by ww_id in upstream to downstream order
+    """
+    registry = site_registry() if registry is None else registry
+    df_group = registry[registry["group"] == group]
+    if df_group.empty:
+        raise ValueError(f"No sites in site group {group!r}")
+    return OrderedDict(df_group["name"].items())
+
+
+def flagged_sites(
+    flag: str, value: bool = True, registry: pd.DataFrame | None = None
+) -> list[str]:
+    """
+    Finds the sites with a registry flag, e.g. brackish or cso_study.
+
+    :param flag: Flag in REGISTRY_FLAGS
+    :param value: Flag value to select
+    :param registry: Site registry, the registry at SITE_REGISTRY_PATH if None
+    :return: List of ww_id
+    """
+    registry = site_registry() if registry is None else registry
+    return registry.index[registry[flag] == value].tolist()
+
+
+def cso_dates(registry: pd.DataFrame | None = None) -> dict[str, pd.Timestamp]:
+    """
+    Finds the date of the CSO improvements compared at each cso_study site.
+
+    :param registry: Site registry, the registry at SITE_REGISTRY_PATH if None
+    :return: Dates keyed by ww_id, CSO_DATE where the registry has no cso_date
+    """
+    registry = site_registry() if registry is None else registry
+    df_cso = registry[registry["cso_study"]]
+    return df_cso["cso_date"].fillna(CSO_DATE).to_dict()
+
+
+def brackish_sites(registry: pd.DataFrame | None = None) -> list[str]:
+    """Sites with brackish water."""
+    return flagged_sites("brackish", registry=registry)
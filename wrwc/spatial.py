@@ -0,0 +1,65 @@
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+if TYPE_CHECKING:
+    import geopandas as gpd
+
+# NAD83 / Rhode Island state plane in metres, used for all distance calculations
+PROJECTED_CRS = "EPSG:32130"
+
+# Radius for counting CSO outfalls near a site, in metres
+CSO_SEARCH_RADIUS = 1000
+
+
+def read_cso_layer(cso_path) -> "gpd.GeoDataFrame":
+    """
+    Reads CSO outfalls projected to the CRS used for distance calculations.
+
+    :param cso_path: Path to CSO outfall points, e.g. a GeoPackage
+    :return: GeoDataFrame of CSO outfalls in PROJECTED_CRS
+    """
+    import geopandas as gpd
+
+    return gpd.read_file(cso_path).to_crs(PROJECTED_CRS)
+
+
+def cso_proximity(
+    gdf_sites: "gpd.GeoDataFrame",
+    gdf_cso: "gpd.GeoDataFrame",
+    radius: float = CSO_SEARCH_RADIUS,
+    id_column: str = "OF_",
+) -> pd.DataFrame:
+    """
+    Finds the nearest CSO outfall and the number of outfalls within a radius of each site.
+
+    Distances are calculated in PROJECTED_CRS. All sites are queried at once against the
+    spatial index (STRtree) of the CSO layer, so the cost grows with the number of sites and
+    outfalls near them rather than with every site-outfall pair.
+
+    :param gdf_sites: Site locations
+    :param gdf_cso: CSO outfall locations
+    :param radius: Search radius in metres
+    :param id_column: Column identifying each outfall
+    :return: Dataframe indexed like gdf_sites with nearest_cso, cso_distance_m and cso_count
+    """
+    sites = gdf_sites.geometry.to_crs(PROJECTED_CRS)
+    if gdf_cso.crs != PROJECTED_CRS:
+        gdf_cso = gdf_cso.to_crs(PROJECTED_CRS)
+
+    (site_idx, cso_idx), distance = gdf_cso.sindex.nearest(
+        sites, return_all=False, return_distance=True
+    )
+    df_proximity = pd.DataFrame(
+        {
+            "nearest_cso": gdf_cso[id_column].to_numpy()[cso_idx],
+            "cso_distance_m": distance,
+        },
+        index=sites.index[site_idx],
+    ).reindex(sites.index)
+
+    site_idx, _ = gdf_cso.sindex.query(sites, predicate="dwithin", distance=radius)
+    df_proximity["cso_count"] = np.bincount(site_idx, minlength=len(sites))
+
+    return df_proximity
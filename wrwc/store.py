@@ -0,0 +1,239 @@
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+import re
+import shutil
+from urllib.parse import unquote
+
+from loguru import logger
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from wrwc.config import PROCESSED_DATA_DIR
+from wrwc.instrumentation import instrumented
+from wrwc.manifest import read_manifest
+from wrwc.schema import PROCESSED_DTYPES, conform
+
+PARTITION_COLUMNS = ("ww_id",)
+
+# Store that is updated in place by incremental ingestion
+INCREMENTAL_STORE_NAME = "wrwc-processed-data.parquet"
+SNAPSHOT_PATTERN = re.compile(r"wrwc-processed-data-(\d{8})\.(parquet|csv)")
+
+# Site summaries written by dataset.mapping_data, date stamped or tagged "latest"
+SITE_SUMMARY_PATTERN = re.compile(r"site_summary_(\d{8}|latest)\.csv")
+LATEST_TAG = "latest"
+
+
+def is_store(path: Path) -> bool:
+    """
+    Checks if a path points to a parquet store rather than a csv file.
+
+    :param path: Path to processed data
+    :return: True if the path is a parquet file or a partitioned parquet directory
+    """
+    path = Path(path)
+    return path.is_dir() or path.suffix == ".parquet"
+
+
+def to_store_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Casts the processed concentration data to the dtypes used in the store.
+
+    :param df: Processed concentration data
+    :return: Dataframe with the dtypes of schema.PROCESSED_DTYPES
+    """
+    return conform(df)
+
+
+def write_concentration_store(
+    df: pd.DataFrame,
+    store_path: Path,
+    partition_cols: Iterable[str] = PARTITION_COLUMNS,
+    basename_template: str | None = None,
+    append: bool = False,
+):
+    """
+    Writes processed concentration data to a hive partitioned parquet store.
+
+    Existing files in the partitions being written are replaced unless appending.
+
+    :param df: Processed concentration data
+    :param store_path: Directory of the parquet store
+    :param partition_cols: Columns to partition by, e.g. ("ww_id",) or ("ww_id", "parameter")
+    :param basename_template: File name template within partitions, e.g. "part-{i}.parquet"
+    :param append: Add new files next to the existing files in each partition
+    :return: None
+    """
+    partition_cols = list(partition_cols)
+    if append and basename_template is None:
+        basename_template = f"part-{datetime.now():%Y%m%d%H%M%S%f}-{{i}}.parquet"
+
+    table = pa.Table.from_pandas(to_store_frame(df), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=store_path,
+        partition_cols=partition_cols,
+        basename_template=basename_template,
+        existing_data_behavior="overwrite_or_ignore" if append else "delete_matching",
+    )
+    logger.info(f"Wrote {len(df)} rows to {store_path} partitioned by {partition_cols}")
+
+
+def delete_partitions(store_path: Path, column: str, values: Iterable[str]):
+    """
+    Deletes top level partitions from the parquet store.
+
+    :param store_path: Directory of the parquet store
+    :param column: Top level partition column
+    :param values: Partition values to delete
+    :return: None
+    """
+    values = set(values)
+    for partition in Path(store_path).glob(f"{column}=*"):
+        if unquote(partition.name.split("=", 1)[1]) in values:
+            shutil.rmtree(partition)
+
+
+def read_concentration_store(
+    store_path: Path,
+    sites: Iterable[str] | None = None,
+    parameters: Iterable[str] | None = None,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Reads processed concentration data from the parquet store.
+
+    Site and parameter filters prune partitions and the date filter prunes row groups, so
+    only the data that is needed is read from disk.
+
+    :param store_path: Directory of the parquet store
+    :param sites: Sites (ww_id) to read, all sites if None
+    :param parameters: Parameters to read, all parameters if None
+    :param start: First sample date to include
+    :param end: Last sample date to include
+    :param columns: Columns to read, all columns if None
+    :return: Dataframe of processed concentration data
+    """
+    filters = []
+    if sites is not None:
+        filters.append(("ww_id", "in", list(sites)))
+    if parameters is not None:
+        filters.append(("parameter", "in", list(parameters)))
+    if start is not None:
+        filters.append(("date", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("date", "<=", pd.Timestamp(end)))
+
+    df = pd.read_parquet(store_path, columns=columns, filters=filters or None)
+
+    # Partition keys are read back with every partition value as a category
+    for col in df.select_dtypes("category").columns:
+        df[col] = df[col].cat.remove_unused_categories()
+
+    # Text columns of stores written before they were declared categorical
+    return conform(df)
+
+
+@instrumented()
+def read_processed_data(
+    input_path: Path,
+    sites: Iterable[str] | None = None,
+    parameters: Iterable[str] | None = None,
+    start: str | pd.Timestamp | None = None,
+    end: str | pd.Timestamp | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Reads processed concentration data from either a parquet store or a csv file.
+
+    :param input_path: Path to parquet store or csv file
+    :param sites: Sites (ww_id) to read, all sites if None
+    :param parameters: Parameters to read, all parameters if None
+    :param start: First sample date to include
+    :param end: Last sample date to include
+    :param columns: Columns to read, all columns if None
+    :return: Dataframe of processed concentration data
+    """
+    if is_store(input_path):
+        return read_concentration_store(
+            input_path, sites=sites, parameters=parameters, start=start, end=end, columns=columns
+        )
+
+    dtype = {col: d for col, d in PROCESSED_DTYPES.items() if d != "datetime64[ns]"}
+    usecols = None
+    if columns is not None:
+        # The columns filtered on are read too
+        needed = {*columns, "ww_id", "parameter", "date"}
+        usecols = [col for col in pd.read_csv(input_path, nrows=0).columns if col in needed]
+    df = pd.read_csv(
+        input_path, dtype=dtype, usecols=usecols, parse_dates=["date"], date_format="ISO8601"
+    )
+    m = pd.Series(True, index=df.index)
+    if sites is not None:
+        m &= df["ww_id"].isin(list(sites))
+    if parameters is not None:
+        m &= df["parameter"].isin(list(parameters))
+    if start is not None:
+        m &= df["date"] >= pd.Timestamp(start)
+    if end is not None:
+        m &= df["date"] <= pd.Timestamp(end)
+    return df.loc[m, columns or df.columns].reset_index(drop=True)
+
+
+def latest_processed_data(directory: Path = PROCESSED_DATA_DIR) -> Path:
+    """
+    Resolves the most recent processed concentration data in a directory.
+
+    Candidates are the incrementally updated store, dated by its manifest, and date stamped
+    snapshots (wrwc-processed-data-YYYYMMDD.parquet/.csv). Parquet is preferred over csv when
+    both exist for the same date.
+
+    :param directory: Directory containing processed data
+    :return: Path to the latest processed data
+    """
+    candidates = []
+    for path in Path(directory).glob("wrwc-processed-data*"):
+        if path.name == INCREMENTAL_STORE_NAME:
+            manifest = read_manifest(path)
+            if manifest is None:
+                continue
+            created = datetime.fromisoformat(manifest["updated"])
+        elif m := SNAPSHOT_PATTERN.fullmatch(path.name):
+            created = datetime.strptime(m[1], "%Y%m%d")
+        else:
+            continue
+        candidates.append((created, path.suffix == ".parquet", path))
+
+    if not candidates:
+        raise FileNotFoundError(f"No processed concentration data found in {directory}")
+
+    latest = max(candidates)[2]
+    logger.debug(f"Using processed data: {latest}")
+    return latest
+
+
+def latest_site_summary(directory: Path = PROCESSED_DATA_DIR) -> Path:
+    """
+    Resolves the most recent site summary csv file in a directory.
+
+    The summary tagged "latest" is preferred over date stamped summaries
+    (site_summary_YYYYMMDD.csv).
+
+    :param directory: Directory containing site summaries
+    :return: Path to the latest site summary
+    """
+    candidates = [
+        (m[1] == LATEST_TAG, m[1], path)
+        for path in Path(directory).glob("site_summary_*.csv")
+        if (m := SITE_SUMMARY_PATTERN.fullmatch(path.name))
+    ]
+    if not candidates:
+        raise FileNotFoundError(f"No site summary found in {directory}")
+
+    latest = max(candidates)[2]
+    logger.debug(f"Using site summary: {latest}")
+    return latest
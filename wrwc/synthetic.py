@@ -0,0 +1,289 @@
+from pathlib import Path
+
+from loguru import logger
+import numpy as np
+import pandas as pd
+import typer
+
+from wrwc.config import RAW_DATA_DIR
+from wrwc.sites import brackish_sites, site_registry
+
+# Raw parameter string, unit, median and spread of the log values. Units include the
+# inconsistent spellings found in the raw data.
+FIELD_PARAMETERS = [
+    ("Temperature - 00010", "C", 18.0, 0.3),
+    ("Dissolved Oxygen - 00300", "mg/L", 8.0, 0.25),
+    ("pH - 00400", "SU", 6.8, 0.05),
+    ("Salinity, (ppt) - 00480", "ppt", 0.1, 1.0),
+    ("Depth - 82903", "m", 1.0, 0.5),
+]
+NUTRIENT_PARAMETERS = [
+    ("Phosphorus, Total - 00665", "ug/l", 40.0, 0.6),
+    ("Nitrogen, Total - 00600", "mg/l", 0.8, 0.4),
+    ("Nitrogen, Ammonia as N - 00608", "mg/l", 0.08, 0.8),
+    ("Nitrate + Nitrite as N - 00631", "mg/l", 0.4, 0.6),
+    ("Chlorophyll a, corrected for pheophytin - 32209", "ug/l", 6.0, 0.8),
+]
+BACTERIA_PARAMETERS = [
+    ("Enterococci - 31649", "MPN/100ml", 80.0, 1.2),
+    ("E.coli - 31633", "MPN/100ml", 150.0, 1.2),
+    ("Fecal Coliform - 31616", "CFU/100ml", 200.0, 1.2),
+]
+ION_PARAMETERS = [
+    ("Calcium, dissolved - 00915", "mg/L", 6.0, 0.3),
+    ("Chloride - 00940", "mg/l", 45.0, 0.4),
+    ("Sodium, dissolved - 00930", "mg/l", 25.0, 0.4),
+    ("Alkalinity, total as CaCO3 - 00410", "mg/l", 12.0, 0.4),
+]
+
+# Parameter groups and the probability that a sampling event includes them
+PANELS = [
+    (FIELD_PARAMETERS, 1.0),
+    (NUTRIENT_PARAMETERS, 0.5),
+    (BACTERIA_PARAMETERS, 0.6),
+    (ION_PARAMETERS, 0.2),
+]
+
+RAW_COLUMNS = [
+    "Source.Name",
+    "WW ID",
+    "Date of Sample",
+    "Time",
+    "Sample Type",
+    "Sample Media",
+    "Depth",
+    "Parameter",
+    "Concentration",
+    "Unit",
+    "Qualifier Code",
+    "Detection Limit",
+    "Detection Limit Unit",
+    "Quantitation Level",
+    "Quantitation Level Unit",
+    "Lab Name",
+    "Analytical Method Number",
+    "Sediment Particle Size",
+    "Particle Size Unit",
+    "Fish Sample Type",
+    "Fish Taxa",
+    "Monitoring Location",
+    "Watershed",
+]
+
+FIRST_YEAR = 1988
+LAST_YEAR = 2024
+
+
+def synthetic_sites(n_sites: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Creates site info for synthetic stations in the raw SiteInfo.csv format.
+
+    Sites in the site registry come first so the app's site groups are present in the data.
+
+    :param n_sites: Number of sites, at least the number of registered sites
+    :param rng: Random generator
+    :return: Dataframe of site info with raw column names
+    """
+    registry = site_registry()
+    n_extra = max(n_sites - len(registry), 0)
+    ww_id = registry.index.tolist() + [f"WW{1000 + i}" for i in range(n_extra)]
+    reservoir = np.concatenate(
+        [(registry["group"] == "upper_reservoirs").to_numpy(), rng.random(n_extra) < 0.3]
+    )
+    names = registry["name"].tolist() + [f"Synthetic Station {i}" for i in range(n_extra)]
+
+    return pd.DataFrame(
+        {
+            "WW Station": ww_id,
+            "WBID": [f"RI{rng.integers(1, 10**7):010d}" for _ in ww_id],
+            "WB Type": np.where(reservoir, "Reservoir ", "Stream or river"),
+            "Site Descr": names,
+            "Lat DD": rng.uniform(41.80, 41.95, len(ww_id)).round(6),
+            "Lon DD": rng.uniform(-71.60, -71.40, len(ww_id)).round(6),
+        }
+    )
+
+
+def sampling_schedule(df_site: pd.DataFrame, rng: np.random.Generator) -> dict:
+    """
+    Draws the years each site was sampled and the depths of its profiles.
+
+    Sites start and stop sampling in different years and skip some years in between.
+
+    :param df_site: Site info, see synthetic_sites
+    :param rng: Random generator
+    :return: Dictionary of per-site arrays used by sample_events
+    """
+    n_sites = len(df_site)
+    start = rng.integers(FIRST_YEAR, 2010, n_sites)
+    stop = np.minimum(start + rng.integers(8, 40, n_sites), LAST_YEAR)
+
+    years = np.arange(FIRST_YEAR, LAST_YEAR + 1)
+    active = (
+        (years >= start[:, None])
+        & (years <= stop[:, None])
+        & (rng.random((n_sites, len(years))) > 0.15)
+    )
+    active[np.arange(n_sites), start - FIRST_YEAR] = True  # Every site is sampled at least once
+
+    n_active = active.sum(axis=1)
+    reservoir = df_site["WB Type"].str.startswith("Reservoir").to_numpy()
+    brackish = df_site["WW Station"].isin(brackish_sites()).to_numpy()
+    return {
+        "ww_id": df_site["WW Station"].to_numpy(),
+        "active_years": np.nonzero(active)[1] + FIRST_YEAR,  # Grouped by site
+        "offset": np.concatenate([[0], np.cumsum(n_active)[:-1]]),
+        "n_active": n_active,
+        "n_depths": np.where(reservoir, rng.integers(2, 7, n_sites), 1),
+        "salinity_scale": np.where(brackish, 100.0, 1.0),
+        "weight": rng.pareto(1.5, n_sites) + 1,  # Some sites are sampled far more often
+    }
+
+
+def sample_events(schedule: dict, n_events: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Draws sampling events (site and date) from the sampling schedule.
+
+    Most samples are taken between May and October.
+
+    :param schedule: Sampling schedule, see sampling_schedule
+    :param n_events: Number of events
+    :param rng: Random generator
+    :return: Dataframe of events with site index and date
+    """
+    weight = schedule["weight"] / schedule["weight"].sum()
+    site = rng.choice(len(weight), n_events, p=weight)
+    year_idx = (rng.random(n_events) * schedule["n_active"][site]).astype(int)
+    year = schedule["active_years"][schedule["offset"][site] + year_idx]
+
+    in_season = rng.random(n_events) < 0.9
+    day_of_year = np.where(
+        in_season, rng.integers(121, 305, n_events), rng.integers(0, 365, n_events)
+    )
+    date = pd.to_datetime(year.astype(str), format="%Y") + pd.to_timedelta(day_of_year, unit="D")
+
+    return pd.DataFrame({"site": site, "date": date})
+
+
+def expand_events(
+    df_events: pd.DataFrame, schedule: dict, rng: np.random.Generator
+) -> pd.DataFrame:
+    """
+    Expands sampling events to one raw row per parameter and depth.
+
+    Field parameters are measured at each depth of a reservoir profile, other parameters at the
+    surface. Salinity is higher at brackish sites. About 3% of results are missing and 2% are
+    below the detection limit.
+
+    :param df_events: Sampling events, see sample_events
+    :param schedule: Sampling schedule, see sampling_schedule
+    :param rng: Random generator
+    :return: Dataframe of raw rows
+    """
+    event_site = df_events["site"].to_numpy()
+    parts = []
+    for parameters, probability in PANELS:
+        event = np.flatnonzero(rng.random(len(df_events)) < probability)
+        depth = np.full(len(event), 0.5)
+        if parameters is FIELD_PARAMETERS:
+            n_depths = schedule["n_depths"][event_site[event]]
+            event = np.repeat(event, n_depths)
+            first_row = np.repeat(np.cumsum(n_depths) - n_depths, n_depths)
+            depth = np.arange(len(event)) - first_row + 0.5
+
+        for parameter, unit, median, spread in parameters:
+            concentration = median * np.exp(rng.normal(0, spread, len(event)))
+            if parameter.startswith("Salinity"):
+                concentration *= schedule["salinity_scale"][event_site[event]]
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "event": event,
+                        "Depth": np.nan if parameter.startswith("Depth") else depth,
+                        "Parameter": parameter,
+                        "Unit": unit,
+                        "Concentration": concentration.round(3),
+                        "Detection Limit": 0.01 if parameter.startswith(("Phos", "Nitr")) else 0.1,
+                    }
+                )
+            )
+
+    df = pd.concat(parts, ignore_index=True).sort_values("event", kind="stable")
+    event = df["event"].to_numpy()
+    n = len(df)
+
+    detection_limit = df["Detection Limit"].to_numpy()
+    below_detection = rng.random(n) < 0.02
+    concentration = np.where(below_detection, detection_limit, df["Concentration"].to_numpy())
+    concentration[rng.random(n) < 0.03] = np.nan
+
+    return pd.DataFrame(
+        {
+            "Source.Name": "URIWW-synthetic.csv",
+            "WW ID": schedule["ww_id"][event_site[event]],
+            "Date of Sample": df_events["date"].dt.strftime("%Y-%m-%d").to_numpy()[event],
+            "Time": "10:00:00 AM",
+            "Sample Type": "Grab",
+            "Sample Media": "Water",
+            "Depth": df["Depth"].to_numpy(),
+            "Parameter": df["Parameter"].to_numpy(),
+            "Concentration": concentration,
+            "Unit": df["Unit"].to_numpy(),
+            "Qualifier Code": np.where(below_detection, "<", None),
+            "Detection Limit": detection_limit,
+            "Detection Limit Unit": df["Unit"].to_numpy(),
+            "Quantitation Level": (detection_limit * 3).round(3),
+            "Quantitation Level Unit": df["Unit"].to_numpy(),
+            "Lab Name": "URI Watershed Watch",
+            "Analytical Method Number": None,
+            "Sediment Particle Size": None,
+            "Particle Size Unit": None,
+            "Fish Sample Type": None,
+            "Fish Taxa": None,
+            "Monitoring Location": None,
+            "Watershed": "Woonasquatucket",
+        },
+        columns=RAW_COLUMNS,
+    )
+
+
+def synthetic_data(
+    output_path: Path = RAW_DATA_DIR,
+    n_rows: int = 100_000,
+    n_sites: int | None = None,
+    seed: int = 0,
+    events_per_chunk: int = 50_000,
+):
+    """
+    Writes synthetic raw WoonasquatucketData.csv and SiteInfo.csv files.
+
+    Rows are generated and written in chunks of sampling events, so memory use does not grow
+    with n_rows. The same seed and arguments give the same files.
+
+    :param output_path: Directory to write the files to
+    :param n_rows: Number of raw data rows
+    :param n_sites: Number of sites, one per 20000 rows (at least the registered sites) if None
+    :param seed: Random seed
+    :param events_per_chunk: Number of sampling events generated at a time
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    df_site = synthetic_sites(n_sites or n_rows // 20_000, rng)
+    df_site.to_csv(output_path / "SiteInfo.csv", index=False)
+    schedule = sampling_schedule(df_site, rng)
+
+    data_path = output_path / "WoonasquatucketData.csv"
+    rows = 0
+    while rows < n_rows:
+        df = expand_events(sample_events(schedule, events_per_chunk, rng), schedule, rng)
+        df = df.iloc[: n_rows - rows]
+        df.to_csv(data_path, mode="w" if rows == 0 else "a", header=rows == 0, index=False)
+        rows += len(df)
+    logger.info(f"Wrote {rows} rows for {len(df_site)} sites to {data_path}")
+
+
+if __name__ == "__main__":
+    typer.run(synthetic_data)
@@ -0,0 +1,133 @@
+"""
+Registry of water quality thresholds, and flags of the samples exceeding them.
+"""
+
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+from wrwc.derived import geometric_mean_parameter
+from wrwc.sites import brackish_sites
+
+# Site classes a threshold can be limited to
+SITE_CLASSES = ("fresh", "brackish")
+
+
+@dataclass(frozen=True)
+class Threshold:
+    """
+    A threshold of a parameter.
+
+    Samples exceed a "max" threshold above its value and a "min" threshold below it. Only
+    samples in the unit of the threshold are compared with it. Thresholds of a statistic, e.g. a
+    geometric mean, belong to the derived parameter of that statistic, so only its values are
+    compared with them.
+    """
+
+    parameter: str
+    value: float
+    direction: str  # "max" or "min"
+    unit: str
+    site_class: str | None = None  # One of SITE_CLASSES, all sites if None
+    name: str | None = None  # e.g. the statistic the threshold is meant for
+    color: str = "red"  # Color of the threshold line in plots
+
+    @property
+    def label(self) -> str:
+        label = f"{'above' if self.direction == 'max' else 'below'} {self.value:g} {self.unit}"
+        return f"{label} ({self.name})" if self.name else label
+
+
+THRESHOLDS = [
+    Threshold("Phosphorus, Total", 25, "max", "ug/l"),
+    Threshold("Enterococci", 54, "max", "MPN/100ml", name="single sample"),
+    Threshold(
+        geometric_mean_parameter("Enterococci"),
+        33,
+        "max",
+        "MPN/100ml",
+        name="geometric mean",
+        color="darkred",
+    ),
+    Threshold("pH", 6.5, "min", "SU"),
+    Threshold("pH", 9.0, "max", "SU"),
+    Threshold("Dissolved Oxygen", 5.0, "min", "mg/l"),
+    Threshold("Dissolved Oxygen Saturation", 60, "min", "percent"),
+]
+
+
+def classify_site(ww_id: str, brackish: list[str] | None = None) -> str:
+    """Site class of a site, "brackish" for brackish sites of the registry and else "fresh"."""
+    brackish = brackish_sites() if brackish is None else brackish
+    return "brackish" if ww_id in brackish else "fresh"
+
+
+def parameter_thresholds(
+    parameter: str, site_class: str | None = None, thresholds: list[Threshold] = THRESHOLDS
+) -> list[Threshold]:
+    """
+    Finds the thresholds of a parameter.
+
+    :param parameter: Parameter
+    :param site_class: Site class of the site, the thresholds of all site classes if None
+    :param thresholds: Threshold registry
+    :return: Thresholds in registry order
+    """
+    return [
+        t
+        for t in thresholds
+        if t.parameter == parameter
+        and (site_class is None or t.site_class is None or t.site_class == site_class)
+    ]
+
+
+def threshold_table(thresholds: list[Threshold] = THRESHOLDS) -> pd.DataFrame:
+    """
+    Tabulates the threshold registry.
+
+    :param thresholds: Threshold registry
+    :return: Dataframe of the threshold fields and labels, indexed by position in the registry
+    """
+    return pd.DataFrame(
+        [{**asdict(t), "label": t.label} for t in thresholds],
+        index=pd.RangeIndex(len(thresholds), name="threshold"),
+    )
+
+
+def flag_exceedances(
+    df: pd.DataFrame, thresholds: list[Threshold] = THRESHOLDS, brackish: list[str] | None = None
+) -> pd.DataFrame:
+    """
+    Flags every sample against the thresholds of its parameter, unit and site class.
+
+    All samples are compared at once by merging them with the threshold registry.
+
+    :param df: Samples with ww_id, parameter, unit and concentration columns
+    :param thresholds: Threshold registry
+    :param brackish: Brackish sites, the brackish sites of the registry if None
+    :return: The columns of df and the threshold (position in the registry) and exceeds flag,
+        one row per sample and threshold. Samples without a concentration or threshold are
+        left out.
+    """
+    brackish = brackish_sites() if brackish is None else brackish
+    df_thresholds = threshold_table(thresholds)[
+        ["parameter", "unit", "site_class", "value", "direction"]
+    ].reset_index()
+
+    df = df[df["parameter"].isin(df_thresholds["parameter"]) & df["concentration"].notna()]
+    df_flags = df.merge(
+        df_thresholds.astype({"parameter": str, "unit": str}),
+        on=["parameter", "unit"],
+        how="inner",
+    )
+    df_flags = df_flags.astype({"parameter": df["parameter"].dtype, "unit": df["unit"].dtype})
+
+    sample_class = np.where(df_flags["ww_id"].isin(brackish), "brackish", "fresh")
+    df_flags = df_flags[df_flags["site_class"].isna() | (df_flags["site_class"] == sample_class)]
+    exceeds = np.where(
+        df_flags["direction"] == "max",
+        df_flags["concentration"] > df_flags["value"],
+        df_flags["concentration"] < df_flags["value"],
+    )
+    return df_flags.drop(columns=["site_class", "value", "direction"]).assign(exceeds=exceeds)
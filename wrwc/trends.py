@@ -0,0 +1,129 @@
+"""
+Seasonal Mann-Kendall trend tests and Sen's slopes of many series at once.
+
+Each series has at most one value per season and time step, e.g. the monthly means of a site
+and parameter by year. Values are only compared within a season, so a series of n values over
+s seasons has about n²/2s pairs instead of n²/2. The pairs of all series are formed together,
+with one vectorized pass per time offset, see within_season_pairs.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+# Significance level of the trends
+ALPHA = 0.05
+
+
+def within_season_pairs(group: np.ndarray, value: np.ndarray, time: np.ndarray):
+    """
+    Forms every pair of values in the same group, e.g. a season of a series.
+
+    Rows must be sorted by group and time. Each row is paired with the row k positions later,
+    for k = 1, 2, ... as long as any rows k apart share a group.
+
+    :param group: Group of each row
+    :param value: Value of each row
+    :param time: Time of each row
+    :return: Group, value difference and time difference of each pair, later minus earlier
+    """
+    groups, value_diffs, time_diffs = [], [], []
+    for k in range(1, len(group)):
+        same = group[k:] == group[:-k]
+        if not same.any():
+            break
+        groups.append(group[k:][same])
+        value_diffs.append(value[k:][same] - value[:-k][same])
+        time_diffs.append(time[k:][same] - time[:-k][same])
+    if not groups:
+        return np.array([], dtype=int), np.array([]), np.array([])
+    return np.concatenate(groups), np.concatenate(value_diffs), np.concatenate(time_diffs)
+
+
+def seasonal_trends(
+    df: pd.DataFrame,
+    keys: list[str],
+    season: str = "month",
+    time: str = "year",
+    value: str = "value",
+    alpha: float = ALPHA,
+) -> pd.DataFrame:
+    """
+    Tests each series for a monotonic trend with the seasonal Mann-Kendall test and estimates
+    its seasonal Sen's slope.
+
+    The test of Hirsch, Slack and Smith (1982) sums the Mann-Kendall statistic S and its
+    variance, corrected for ties, over the seasons. Serial correlation between seasons is not
+    corrected for. Sen's slope is the median slope of all pairs of values in the same season.
+
+    :param df: At most one value per series, season and time, missing values are left out
+    :param keys: Columns identifying a series, e.g. ww_id and parameter
+    :param season: Season column, e.g. month
+    :param time: Numeric time column, slopes are per unit of time
+    :param value: Value column
+    :param alpha: Significance level of the trend
+    :return: Dataframe indexed by keys with the number of values (n), seasons, first and last
+        time, S, its variance, the normal score z, two-sided p-value, Sen's slope and the trend:
+        "increasing", "decreasing", "no trend" or "insufficient data" if no season has two
+        values to compare
+    """
+    df = df.dropna(subset=[value]).sort_values([*keys, season, time])
+    series = df.groupby(keys, observed=True, sort=False).ngroup().to_numpy()
+    groups = df.groupby([*keys, season], observed=True, sort=False).ngroup().to_numpy()
+    values = df[value].to_numpy(dtype=float)
+    times = df[time].to_numpy(dtype=float)
+
+    # Rows are sorted, so groups are numbered in order and each belongs to one series
+    n_series = series.max() + 1 if len(series) else 0
+    group_series = np.zeros(groups.max() + 1 if len(groups) else 0, dtype=int)
+    group_series[groups] = series
+
+    pair_groups, value_diffs, time_diffs = within_season_pairs(groups, values, times)
+    s = np.bincount(group_series[pair_groups], weights=np.sign(value_diffs), minlength=n_series)
+
+    # Variance of S in each season, less the ties within the season
+    n = np.bincount(groups)
+    ties = pd.DataFrame({"group": groups, "value": values}).groupby(["group", "value"]).size()
+    tie_terms = (ties * (ties - 1) * (2 * ties + 5)).groupby(level="group").sum()
+    group_var = n * (n - 1) * (2 * n + 5) - tie_terms.reindex(range(len(n)), fill_value=0)
+    var_s = np.bincount(group_series, weights=group_var.to_numpy() / 18, minlength=n_series)
+
+    # S and its variance are 0 if all pairs are tied, without pairs there's no test
+    pairs = np.bincount(group_series[pair_groups], minlength=n_series)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = np.where(var_s > 0, (s - np.sign(s)) / np.sqrt(var_s), 0)
+    z[pairs == 0] = np.nan
+    p_value = pd.Series(np.abs(z) / math.sqrt(2)).map(math.erfc).to_numpy()
+
+    slope = (
+        pd.Series(value_diffs / time_diffs)
+        .groupby(group_series[pair_groups])
+        .median()
+        .reindex(range(n_series))
+        .to_numpy()
+    )
+
+    trend = np.select(
+        [np.isnan(p_value), (p_value < alpha) & (s > 0), (p_value < alpha) & (s < 0)],
+        ["insufficient data", "increasing", "decreasing"],
+        "no trend",
+    )
+
+    df_series = df.drop_duplicates(keys)[keys]
+    span = pd.Series(df[time].to_numpy()).groupby(series).agg(["min", "max"])
+    return pd.DataFrame(
+        {
+            "n": np.bincount(series, minlength=n_series),
+            "seasons": np.bincount(group_series, minlength=n_series),
+            "first": span["min"].to_numpy(),
+            "last": span["max"].to_numpy(),
+            "s": s,
+            "var_s": var_s,
+            "z": z,
+            "p_value": p_value,
+            "slope": slope,
+            "trend": trend,
+        },
+        index=pd.MultiIndex.from_frame(df_series),
+    )